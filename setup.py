@@ -39,8 +39,7 @@ def get_extensions():
             "-D__CUDA_NO_HALF_CONVERSIONS__",
             "-D__CUDA_NO_HALF2_OPERATORS__",
         ]
-    else:
-        raise NotImplementedError("cuda is not available")
+    # without CUDA, only the CPU kernels of smoke/csrc/cpu are built, for CPU inference
 
     sources = [os.path.join(extensions_dir, s) for s in sources]
 
@@ -51,6 +51,8 @@ _C.DATASETS.TRAIN_SPLIT = ""
 _C.DATASETS.TEST_SPLIT = ""
 _C.DATASETS.DETECT_CLASSES = ("Car",)
 _C.DATASETS.MAX_OBJECTS = 30
+# read the images, calibration and labels from the memory-mapped store written by tools/pack_kitti_images.py
+_C.DATASETS.IMAGE_STORE = False
 
 # -----------------------------------------------------------------------------
 # DataLoader
@@ -81,6 +83,10 @@ _C.MODEL.BACKBONE.FREEZE_CONV_BODY_AT = 0
 _C.MODEL.BACKBONE.USE_NORMALIZATION = "GN"
 _C.MODEL.BACKBONE.DOWN_RATIO = 4
 _C.MODEL.BACKBONE.BACKBONE_OUT_CHANNELS = 64
+# Implementation of the deformable convolutions: "ext" the compiled smoke._ext kernels,
+# "torchvision" torchvision.ops.deform_conv2d, "sampling" F.grid_sample and a matrix product (fastest on the CPU),
+# "auto" the extension if it is built, then torchvision, then sampling
+_C.MODEL.BACKBONE.DCN_BACKEND = "auto"
 
 # ---------------------------------------------------------------------------- #
 # Group Norm options
@@ -155,6 +161,17 @@ _C.TEST.PRED_2D = True
 # Number of detections per image
 _C.TEST.DETECTIONS_PER_IMG = 50
 _C.TEST.DETECTIONS_THRESHOLD = 0.25
+# Number of intra-op threads for inference on the CPU (MODEL.DEVICE "cpu"), 0 keeps the PyTorch default
+_C.TEST.NUM_THREADS = 0
+# Run the convolutions of inference in channels_last (NHWC) memory format
+_C.TEST.CHANNELS_LAST = False
+# Precision of the backbone and predictor at inference: "fp32", or "bf16"/"fp16" autocast on MODEL.DEVICE.
+# The post-processing runs in fp32, see tools/quantize_model.py for int8 and the accuracy of each precision
+_C.TEST.PRECISION = "fp32"
+# Transform the model for inference after loading it: BatchNorm folded into the convolutions, the first
+# convolutions of the heads merged into one and the model in channels_last (whatever TEST.CHANNELS_LAST),
+# see smoke/modeling/deploy.py
+_C.TEST.DEPLOY = False
 
 
 # ---------------------------------------------------------------------------- #
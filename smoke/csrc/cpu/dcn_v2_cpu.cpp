@@ -58,7 +58,7 @@ dcn_v2_cpu_forward(const at::Tensor &input,
 
     auto ones = at::ones({bias.sizes()[0], height_out, width_out}, input.options());
     auto columns = at::empty({channels * kernel_h * kernel_w, 1 * height_out * width_out}, input.options());
-    auto output = at::empty({batch, channels_out, height_out, width_out}, input.options());
+    auto output = at::zeros({batch, channels_out, height_out, width_out}, input.options());
 
     using scalar_t = float;
     for (int b = 0; b < batch; b++)
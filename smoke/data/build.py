@@ -125,6 +125,13 @@ def make_data_loader(cfg, is_train=True):
 
 
 def build_test_loader(cfg, is_train=False):
+    num_gpus = get_world_size()
+    images_per_batch = cfg.TEST.IMS_PER_BATCH
+    assert images_per_batch % num_gpus == 0, \
+        "TEST.IMS_PER_BATCH ({}) must be divisible by the number of GPUs ({}) used." \
+            .format(images_per_batch, num_gpus)
+    images_per_gpu = images_per_batch // num_gpus
+
     path_catalog = import_file(
         "smoke.config.paths_catalog", cfg.PATHS_CATALOG, True
     )
@@ -137,7 +144,7 @@ def build_test_loader(cfg, is_train=False):
     for dataset in datasets:
         sampler = samplers.InferenceSampler(len(dataset))
         batch_sampler = torch.utils.data.sampler.BatchSampler(
-            sampler, 1, drop_last=False
+            sampler, images_per_gpu, drop_last=False
         )
         collator = BatchCollator(cfg.DATALOADER.SIZE_DIVISIBILITY)
         num_workers = cfg.DATALOADER.NUM_WORKERS
@@ -149,7 +156,7 @@ def build_test_loader(cfg, is_train=False):
         )
         data_loaders.append(data_loader)
 
-    return data_loader
+    return data_loaders
 
 
 def trivial_batch_collator(batch):
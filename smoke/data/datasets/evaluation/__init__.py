@@ -1,6 +1,9 @@
+
+import os
+
 from smoke.data import datasets
 
-from .kitti.kitti_eval import kitti_evaluation
+from .kitti.kitti_eval import kitti_evaluation, KITTIPredictionWriter
 
 
 def evaluate(eval_type, dataset, predictions, output_folder):
@@ -27,3 +30,21 @@ def evaluate(eval_type, dataset, predictions, output_folder):
     else:
         dataset_name = dataset.__class__.__name__
         raise NotImplementedError("Unsupported dataset type {}.".format(dataset_name))
+
+
+def make_prediction_writer(eval_type, dataset, output_folder):
+    """
+    A writer that stores the predictions of each image while inference runs, so that they do not have to be held
+    until evaluate(). None if the dataset has no such writer, then evaluate() gets the predictions.
+    Args:
+        eval_type:
+        dataset: Dataset object
+        output_folder: output folder of the evaluation files
+    Returns:
+        writer with write(image_id, prediction) and close(), or None
+    """
+    if output_folder is None:
+        return None
+    if isinstance(dataset, datasets.KITTIDataset) and "detection" in eval_type:
+        return KITTIPredictionWriter(os.path.join(output_folder, 'data'))
+    return None
@@ -1,7 +1,11 @@
+import io
 import os
-import csv
 import logging
+import queue
 import subprocess
+import threading
+
+import numpy as np
 
 from smoke.utils.miscellaneous import mkdir
 
@@ -11,6 +15,11 @@ ID_TYPE_CONVERSION = {
     2: 'Pedestrian'
 }
 
+TYPE_NAMES = np.array([ID_TYPE_CONVERSION[i] for i in range(len(ID_TYPE_CONVERSION))], dtype=object)
+
+# type, truncation and occlusion, then alpha, 2D box, dimensions, location, rotation_y and score
+ROW_FORMAT = "%s 0 0 " + " ".join(["%.4f"] * 13)
+
 
 def kitti_evaluation(
         eval_type,
@@ -37,11 +46,9 @@ def do_kitti_detection_evaluation(dataset,
     predict_folder = os.path.join(output_folder, 'data')  # only recognize data
     mkdir(predict_folder)
 
-    for image_id, prediction in predictions.items():
-        predict_txt = image_id + '.txt'
-        predict_txt = os.path.join(predict_folder, predict_txt)
-
-        generate_kitti_3d_detection(prediction, predict_txt)
+    with KITTIPredictionWriter(predict_folder) as writer:
+        for image_id, prediction in predictions.items():
+            writer.write(image_id, prediction)
 
     logger.info("Finished generating inferences")
     logger.info("Inferences stored in {}".format(predict_folder))
@@ -57,30 +64,83 @@ def do_kitti_detection_evaluation(dataset,
     # os.chdir('../tools')
 
 
+def format_kitti_3d_detection(prediction):
+    """
+    The KITTI label rows of the [N, 14] detections of an image, without a line break after the last row.
+    """
+    prediction = np.asarray(prediction, dtype=np.float64).reshape(-1, 14)
+    if len(prediction) == 0:
+        return ""
+
+    rows = np.empty(prediction.shape, dtype=object)
+    rows[:, 0] = TYPE_NAMES[prediction[:, 0].astype(np.int64)]
+    rows[:, 1:] = prediction[:, 1:]
+    buffer = io.StringIO()
+    np.savetxt(buffer, rows, fmt=ROW_FORMAT)
+
+    return buffer.getvalue()[:-1]
+
+
 def generate_kitti_3d_detection(prediction, predict_txt):
     with open(predict_txt, 'w', newline='') as f:
-        w = csv.writer(f, delimiter=' ', lineterminator='\n')
-        if len(prediction) == 0:
-            w.writerow([])
-        else:
-            for p in prediction:
-                p = p.numpy()
-                p = p.round(4)
-                type = ID_TYPE_CONVERSION[int(p[0])]
-                row = [type, 0, 0] + p[1:].tolist()
-                w.writerow(row)
-
-    check_last_line_break(predict_txt)
-
-
-def check_last_line_break(predict_txt):
-    f = open(predict_txt, 'rb+')
-    try:
-        f.seek(-1, os.SEEK_END)
-    except:
-        pass
-    else:
-        if f.__next__() == b'\n':
-            f.seek(-1, os.SEEK_END)
-            f.truncate()
-    f.close()
+        f.write(format_kitti_3d_detection(prediction))
+
+
+class KITTIPredictionWriter():
+    """
+    Writes the detection files of KITTI images from background threads, so that inference does not wait for the
+    formatting and the file system. At most max_pending predictions wait to be written, write() blocks when the
+    writer falls behind, so memory stays flat whatever the size of the dataset.
+
+    Use as a context manager, or call close() to wait for the remaining files.
+    """
+
+    def __init__(self, predict_folder, num_threads=1, max_pending=64):
+        mkdir(predict_folder)
+        self.predict_folder = predict_folder
+        self.error = None
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.threads = [threading.Thread(target=self._run, daemon=True) for _ in range(num_threads)]
+        for thread in self.threads:
+            thread.start()
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            image_id, prediction = item
+            try:
+                if self.error is None:
+                    generate_kitti_3d_detection(prediction, os.path.join(self.predict_folder, image_id + '.txt'))
+            except Exception as e:
+                self.error = e
+
+    def _check(self):
+        if self.error is not None:
+            raise RuntimeError("Writing the KITTI predictions failed") from self.error
+
+    def write(self, image_id, prediction):
+        """
+        Args:
+            image_id: image name, the file is predict_folder/image_id.txt
+            prediction: [N, 14] detections of the image, tensor or array
+        """
+        self._check()
+        if hasattr(prediction, "numpy"):
+            prediction = prediction.numpy()
+        self.queue.put((image_id, prediction))
+
+    def close(self):
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+        self._check()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,153 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from smoke.modeling.heatmap_coder import get_transfrom_matrix
+from smoke.utils.calibration import CalibrationRegistry
+from smoke.utils.kitti_labels import LABEL_DTYPE, read_kitti_label_file
+
+
+def image_store_paths(root, split):
+    store_dir = os.path.join(root, "image_store")
+    return os.path.join(store_dir, split + "_images.npy"), os.path.join(store_dir, split + "_index.npz")
+
+
+def _pack_image(image_path, width, height):
+    img = Image.open(image_path)
+    image_size = img.size
+    center = np.array([i / 2 for i in img.size], dtype=np.float32)
+    size = np.array([i for i in img.size], dtype=np.float32)
+
+    # the transform KITTIDataset applies to a sample without augmentation
+    trans_affine = get_transfrom_matrix([center, size], [width, height])
+    img = img.transform(
+        (width, height),
+        method=Image.AFFINE,
+        data=np.linalg.inv(trans_affine).flatten()[:6],
+        resample=Image.BILINEAR,
+    )
+
+    return np.asarray(img.convert("RGB")), image_size, trans_affine
+
+
+def pack_image_store(root, split, names, width, height, with_labels=True, num_threads=4):
+    """
+    Decode the images of a KITTI split once and write them, resized to the network input (width, height) as
+    KITTIDataset would without augmentation, to one .npy file that is read memory-mapped. The index file keeps per
+    image the original image size, the transform from original to stored pixels, the intrinsics K and the labels.
+
+    Args:
+        root: KITTI directory with image_2, calib and label_2
+        split: name of the split, used in the store file names
+        names: image names without extension, in the order of the split
+        width, height: size of the stored images
+        with_labels: also store the label_2 files (training splits)
+        num_threads: number of threads decoding the PNG files
+
+    Returns:
+        paths of the image and index files
+    """
+    images_path, index_path = image_store_paths(root, split)
+    os.makedirs(os.path.dirname(images_path), exist_ok=True)
+
+    images = np.lib.format.open_memmap(images_path, mode="w+", dtype=np.uint8, shape=(len(names), height, width, 3))
+    image_sizes = np.zeros((len(names), 2), dtype=np.int64)
+    transforms = np.zeros((len(names), 3, 3), dtype=np.float32)
+
+    image_paths = [os.path.join(root, "image_2", name + ".png") for name in names]
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        packed = executor.map(_pack_image, image_paths, [width] * len(names), [height] * len(names))
+        for i, (image, image_size, trans_affine) in enumerate(packed):
+            images[i] = image
+            image_sizes[i] = image_size
+            transforms[i] = trans_affine
+    images.flush()
+    del images
+
+    calibration = CalibrationRegistry(os.path.join(root, "calib"), names, shared=False)
+    K = np.stack([calibration.K(i) for i in range(len(names))])
+
+    labels = [read_kitti_label_file(os.path.join(root, "label_2", name + ".txt")) for name in names] \
+        if with_labels else []
+    label_counts = np.array([len(records) for records in labels], dtype=np.int64) if with_labels \
+        else np.zeros(len(names), dtype=np.int64)
+    labels = np.concatenate(labels) if labels else np.zeros(0, dtype=LABEL_DTYPE)
+
+    np.savez(index_path, names=np.array(names), image_sizes=image_sizes, transforms=transforms, K=K,
+             labels=labels, label_counts=label_counts)
+
+    return images_path, index_path
+
+
+class ImageStore():
+    """
+    Read side of pack_image_store. The images are memory-mapped copy-on-write, so image() returns a view of the
+    file without decoding or copying. The file is opened lazily, so that the store is not pickled into the
+    DataLoader workers.
+    """
+
+    def __init__(self, root, split):
+        self.images_path, index_path = image_store_paths(root, split)
+        if not os.path.exists(self.images_path) or not os.path.exists(index_path):
+            raise FileNotFoundError(
+                "No image store for split {} in {}, create it with tools/pack_kitti_images.py".format(split, root)
+            )
+
+        index = np.load(index_path)
+        self.names = index["names"].tolist()
+        self.image_sizes = index["image_sizes"]
+        self.transforms = index["transforms"]
+        self.K = index["K"]
+        self.labels = index["labels"]
+        self.label_offsets = np.concatenate(([0], np.cumsum(index["label_counts"])))
+        self.positions = {name: i for i, name in enumerate(self.names)}
+        self._images = None
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_images"] = None
+        return state
+
+    @property
+    def images(self):
+        if self._images is None:
+            self._images = np.load(self.images_path, mmap_mode="c")
+        return self._images
+
+    def index(self, name):
+        return self.positions[name]
+
+    def image(self, i):
+        return self.images[i]
+
+    def image_labels(self, i):
+        return self.labels[self.label_offsets[i]:self.label_offsets[i + 1]]
+
+    def warp(self, i, trans_affine, flipped, output_size):
+        """
+        The image as KITTIDataset would get it from the PNG: flipped if needed and transformed by trans_affine
+        (original image to output pixels). Without augmentation this is the stored image itself.
+        """
+        inverse = np.linalg.inv(trans_affine)
+        if flipped:
+            # FLIP_LEFT_RIGHT, in the continuous coordinates of the transform (pixel centres at i + 0.5)
+            flip = np.array([[-1, 0, self.image_sizes[i][0]], [0, 1, 0], [0, 0, 1]], dtype=np.float64)
+            inverse = flip @ inverse
+
+        # output pixels to stored pixels
+        inverse = self.transforms[i] @ inverse
+        if tuple(output_size) == self.images.shape[2:0:-1] and np.allclose(inverse, np.eye(3), atol=1e-4):
+            return self.image(i)
+
+        img = Image.fromarray(self.image(i)).transform(
+            tuple(output_size),
+            method=Image.AFFINE,
+            data=inverse.flatten()[:6],
+            resample=Image.BILINEAR,
+        )
+        return np.asarray(img)
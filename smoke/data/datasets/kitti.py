@@ -1,5 +1,4 @@
 import os
-import csv
 import logging
 import random
 import numpy as np
@@ -9,12 +8,15 @@ from torch.utils.data import Dataset
 
 from smoke.modeling.heatmap_coder import (
     get_transfrom_matrix,
-    affine_transform,
+    affine_transform_points,
     gaussian_radius,
     draw_umich_gaussian,
 )
-from smoke.modeling.smoke_coder import encode_label
+from smoke.modeling.smoke_coder import encode_labels
 from smoke.structures.params_3d import ParamsList
+from smoke.data.datasets.image_store import ImageStore
+from smoke.utils.calibration import CalibrationRegistry
+from smoke.utils.kitti_labels import OBJECT_TYPES, read_kitti_label_file
 
 TYPE_ID_CONVERSION = {
     'Car': 0,
@@ -67,21 +69,37 @@ class KITTIDataset(Dataset):
         self.output_height = self.input_height // cfg.MODEL.BACKBONE.DOWN_RATIO
         self.max_objs = cfg.DATASETS.MAX_OBJECTS
 
+        # pre-decoded images, see tools/pack_kitti_images.py
+        self.image_store = ImageStore(root, self.split) if cfg.DATASETS.IMAGE_STORE else None
+
         self.logger = logging.getLogger(__name__)
         self.logger.info("Initializing KITTI {} set with {} files loaded".format(self.split, self.num_samples))
 
+        # P2 of every sample, read once and shared with the DataLoader workers (the image store has its own K)
+        self.calibration = None
+        if self.image_store is None:
+            self.calibration = CalibrationRegistry(self.calib_dir, [i.replace(".txt", "") for i in self.label_files])
+            self.logger.info("{} distinct calibrations".format(self.calibration.num_unique))
+
     def __len__(self):
         return self.num_samples
 
     def __getitem__(self, idx):
         # load default parameter here
         original_idx = self.label_files[idx].replace(".txt", "")
-        img_path = os.path.join(self.image_dir, self.image_files[idx])
-        img = Image.open(img_path)
-        anns, K = self.load_annotations(idx)
+        if self.image_store is None:
+            img_path = os.path.join(self.image_dir, self.image_files[idx])
+            img = Image.open(img_path)
+            anns, K = self.load_annotations(idx)
+            image_size = img.size
+        else:
+            store_idx = self.image_store.index(original_idx)
+            anns = self.records_to_annotations(self.image_store.image_labels(store_idx)) if self.is_train else []
+            K = self.image_store.K[store_idx].copy()
+            image_size = tuple(self.image_store.image_sizes[store_idx])
 
-        center = np.array([i / 2 for i in img.size], dtype=np.float32)
-        size = np.array([i for i in img.size], dtype=np.float32)
+        center = np.array([i / 2 for i in image_size], dtype=np.float32)
+        size = np.array([i for i in image_size], dtype=np.float32)
 
         """
         resize, horizontal flip, and affine augmentation are performed here.
@@ -90,7 +108,8 @@ class KITTIDataset(Dataset):
         flipped = False
         if (self.is_train) and (random.random() < self.flip_prob):
             flipped = True
-            img = img.transpose(Image.FLIP_LEFT_RIGHT)
+            if self.image_store is None:
+                img = img.transpose(Image.FLIP_LEFT_RIGHT)
             center[0] = size[0] - center[0] - 1
             K[0, 2] = size[0] - K[0, 2] - 1
 
@@ -110,13 +129,17 @@ class KITTIDataset(Dataset):
             center_size,
             [self.input_width, self.input_height]
         )
-        trans_affine_inv = np.linalg.inv(trans_affine)
-        img = img.transform(
-            (self.input_width, self.input_height),
-            method=Image.AFFINE,
-            data=trans_affine_inv.flatten()[:6],
-            resample=Image.BILINEAR,
-        )
+        if self.image_store is None:
+            trans_affine_inv = np.linalg.inv(trans_affine)
+            img = img.transform(
+                (self.input_width, self.input_height),
+                method=Image.AFFINE,
+                data=trans_affine_inv.flatten()[:6],
+                resample=Image.BILINEAR,
+            )
+        else:
+            # a view of the memory-mapped image unless the sample is augmented
+            img = self.image_store.warp(store_idx, trans_affine, flipped, (self.input_width, self.input_height))
 
         trans_mat = get_transfrom_matrix(
             center_size,
@@ -134,6 +157,25 @@ class KITTIDataset(Dataset):
 
             return img, target, original_idx
 
+        targets = self.encode_targets(anns, K, trans_mat, flipped, affine)
+
+        target = ParamsList(image_size=(self.input_width, self.input_height),
+                            is_train=self.is_train)
+        for field, value in targets.items():
+            target.add_field(field, value)
+        target.add_field("trans_mat", trans_mat)
+        target.add_field("K", K)
+
+        if self.transforms is not None:
+            img, target = self.transforms(img, target)
+
+        return img, target, original_idx
+
+    def encode_targets(self, anns, K, trans_mat, flipped, affine):
+        """
+        Training targets of one image. All objects are projected with one call to encode_labels and mapped to the
+        output feature map with one matmul, only drawing the heatmap gaussians is done per object.
+        """
         heat_map = np.zeros([self.num_classes, self.output_height, self.output_width], dtype=np.float32)
         regression = np.zeros([self.max_objs, 3, 8], dtype=np.float32)
         cls_ids = np.zeros([self.max_objs], dtype=np.int32)
@@ -145,94 +187,70 @@ class KITTIDataset(Dataset):
         reg_mask = np.zeros([self.max_objs], dtype=np.uint8)
         flip_mask = np.zeros([self.max_objs], dtype=np.uint8)
 
-        for i, a in enumerate(anns):
-            a = a.copy()
-            cls = a["label"]
-
-            locs = np.array(a["locations"])
-            rot_y = np.array(a["rot_y"])
+        if anns:
+            labels = np.array([a["label"] for a in anns])
+            dims = np.array([a["dimensions"] for a in anns])
+            locs = np.array([a["locations"] for a in anns])
+            rot_y = np.array([a["rot_y"] for a in anns])
             if flipped:
-                locs[0] *= -1
+                locs[:, 0] *= -1
                 rot_y *= -1
 
-            point, box2d, box3d = encode_label(
-                K, rot_y, a["dimensions"], locs
-            )
-            point = affine_transform(point, trans_mat)
-            box2d[:2] = affine_transform(box2d[:2], trans_mat)
-            box2d[2:] = affine_transform(box2d[2:], trans_mat)
-            box2d[[0, 2]] = box2d[[0, 2]].clip(0, self.output_width - 1)
-            box2d[[1, 3]] = box2d[[1, 3]].clip(0, self.output_height - 1)
-            h, w = box2d[3] - box2d[1], box2d[2] - box2d[0]
-
-            if (0 < point[0] < self.output_width) and (0 < point[1] < self.output_height):
-                point_int = point.astype(np.int32)
-                p_offset = point - point_int
-                radius = gaussian_radius(h, w)
-                radius = max(0, int(radius))
-                heat_map[cls] = draw_umich_gaussian(heat_map[cls], point_int, radius)
-
-                cls_ids[i] = cls
-                regression[i] = box3d
-                proj_points[i] = point_int
-                p_offsets[i] = p_offset
-                dimensions[i] = np.array(a["dimensions"])
-                locations[i] = locs
-                rotys[i] = rot_y
-                reg_mask[i] = 1 if not affine else 0
-                flip_mask[i] = 1 if not affine and flipped else 0
-
-        target = ParamsList(image_size=img.size,
-                            is_train=self.is_train)
-        target.add_field("hm", heat_map)
-        target.add_field("reg", regression)
-        target.add_field("cls_ids", cls_ids)
-        target.add_field("proj_p", proj_points)
-        target.add_field("dimensions", dimensions)
-        target.add_field("locations", locations)
-        target.add_field("rotys", rotys)
-        target.add_field("trans_mat", trans_mat)
-        target.add_field("K", K)
-        target.add_field("reg_mask", reg_mask)
-        target.add_field("flip_mask", flip_mask)
-
-        if self.transforms is not None:
-            img, target = self.transforms(img, target)
-
-        return img, target, original_idx
+            points, box2d, box3d = encode_labels(K, rot_y, dims, locs)
+            points = affine_transform_points(points, trans_mat)
+            box2d = affine_transform_points(box2d.reshape(-1, 2), trans_mat).reshape(-1, 4)
+            box2d[:, [0, 2]] = box2d[:, [0, 2]].clip(0, self.output_width - 1)
+            box2d[:, [1, 3]] = box2d[:, [1, 3]].clip(0, self.output_height - 1)
+            h, w = box2d[:, 3] - box2d[:, 1], box2d[:, 2] - box2d[:, 0]
+
+            keep = np.flatnonzero((0 < points[:, 0]) & (points[:, 0] < self.output_width) &
+                                  (0 < points[:, 1]) & (points[:, 1] < self.output_height))
+            points_int = points[keep].astype(np.int32)
+            radii = np.maximum(gaussian_radius(h[keep], w[keep]).astype(np.int64), 0)
+            for cls, point_int, radius in zip(labels[keep], points_int, radii):
+                draw_umich_gaussian(heat_map[cls], point_int, radius)
+
+            cls_ids[keep] = labels[keep]
+            regression[keep] = box3d[keep]
+            proj_points[keep] = points_int
+            p_offsets[keep] = points[keep] - points_int
+            dimensions[keep] = dims[keep]
+            locations[keep] = locs[keep]
+            rotys[keep] = rot_y[keep]
+            reg_mask[keep] = 1 if not affine else 0
+            flip_mask[keep] = 1 if not affine and flipped else 0
+
+        return {"hm": heat_map, "reg": regression, "cls_ids": cls_ids, "proj_p": proj_points,
+                "dimensions": dimensions, "locations": locations, "rotys": rotys, "reg_mask": reg_mask,
+                "flip_mask": flip_mask}
 
     def load_annotations(self, idx):
         annotations = []
         file_name = self.label_files[idx]
-        fieldnames = ['type', 'truncated', 'occluded', 'alpha', 'xmin', 'ymin', 'xmax', 'ymax', 'dh', 'dw',
-                      'dl', 'lx', 'ly', 'lz', 'ry']
 
         if self.is_train:
-            with open(os.path.join(self.label_dir, file_name), 'r') as csv_file:
-                reader = csv.DictReader(csv_file, delimiter=' ', fieldnames=fieldnames)
-
-                for line, row in enumerate(reader):
-                    if row["type"] in self.classes:
-                        annotations.append({
-                            "class": row["type"],
-                            "label": TYPE_ID_CONVERSION[row["type"]],
-                            "truncation": float(row["truncated"]),
-                            "occlusion": float(row["occluded"]),
-                            "alpha": float(row["alpha"]),
-                            "dimensions": [float(row['dl']), float(row['dh']), float(row['dw'])],
-                            "locations": [float(row['lx']), float(row['ly']), float(row['lz'])],
-                            "rot_y": float(row["ry"])
-                        })
+            annotations = self.records_to_annotations(read_kitti_label_file(os.path.join(self.label_dir, file_name)))
 
         # get camera intrinsic matrix K
-        with open(os.path.join(self.calib_dir, file_name), 'r') as csv_file:
-            reader = csv.reader(csv_file, delimiter=' ')
-            for line, row in enumerate(reader):
-                if row[0] == 'P2:':
-                    K = row[1:]
-                    K = [float(i) for i in K]
-                    K = np.array(K, dtype=np.float32).reshape(3, 4)
-                    K = K[:3, :3]
-                    break
+        K = self.calibration.K(idx)
 
         return annotations, K
+
+    def records_to_annotations(self, records):
+        annotations = []
+        for row in records.tolist():
+            object_type = OBJECT_TYPES[row[0]]
+            if object_type in self.classes:
+                (_, truncated, occluded, alpha, _, _, _, _, dh, dw, dl, lx, ly, lz, ry, _) = row
+                annotations.append({
+                    "class": object_type,
+                    "label": TYPE_ID_CONVERSION[object_type],
+                    "truncation": truncated,
+                    "occlusion": float(occluded),
+                    "alpha": alpha,
+                    "dimensions": [dl, dh, dw],
+                    "locations": [lx, ly, lz],
+                    "rot_y": ry
+                })
+
+        return annotations
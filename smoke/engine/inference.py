@@ -5,27 +5,77 @@ import torch
 
 from smoke.utils import comm
 from smoke.utils.timer import Timer, get_time_str
-from smoke.data.datasets.evaluation import evaluate
+from smoke.data.datasets.evaluation import evaluate, make_prediction_writer
+from smoke.modeling.deploy import deploy
 
+# TEST.PRECISION: the autocast dtype of the model, the post-processing always runs in fp32
+PRECISIONS = {"fp32": None, "bf16": torch.bfloat16, "fp16": torch.float16}
 
-def compute_on_dataset(model, data_loader, device, timer=None):
+
+def use_channels_last(cfg):
+    """
+    Whether inference runs in channels_last, with TEST.CHANNELS_LAST or as part of the deploy transform (TEST.DEPLOY).
+    """
+    return cfg.TEST.CHANNELS_LAST or cfg.TEST.DEPLOY
+
+
+def configure_inference(cfg, model):
+    """
+    CPU threads, memory format and deploy transform of the model for inference, see TEST.NUM_THREADS,
+    TEST.CHANNELS_LAST and TEST.DEPLOY. The images have to be passed in the same memory format, see
+    use_channels_last.
+    """
+    if cfg.MODEL.DEVICE == "cpu" and cfg.TEST.NUM_THREADS > 0:
+        torch.set_num_threads(cfg.TEST.NUM_THREADS)
+    if cfg.TEST.DEPLOY:
+        deploy(model, channels_last=True)
+    elif cfg.TEST.CHANNELS_LAST:
+        model.to(memory_format=torch.channels_last)
+
+    logger = logging.getLogger(__name__)
+    logger.info("Inference on {} with {} threads, channels_last {}, precision {}, deploy {}".format(
+        cfg.MODEL.DEVICE, torch.get_num_threads(), use_channels_last(cfg), cfg.TEST.PRECISION, cfg.TEST.DEPLOY))
+    return model
+
+
+def autocast(device, precision="fp32"):
+    """
+    Autocast context of the inference in the given precision, disabled for fp32.
+    """
+    if precision not in PRECISIONS:
+        raise ValueError("Unknown precision {}, expected one of {}".format(precision, tuple(PRECISIONS)))
+    dtype = PRECISIONS[precision]
+    return torch.autocast(device.type, dtype=dtype, enabled=dtype is not None)
+
+
+def compute_on_dataset(model, data_loader, device, timer=None, channels_last=False, writer=None, precision="fp32"):
+    """
+    Runs the model on the data loader, under autocast for a precision other than fp32. The detections of each image
+    are passed to writer if given, otherwise they are returned in a dict by image id.
+    """
     model.eval()
     results_dict = {}
     cpu_device = torch.device("cpu")
+    memory_format = torch.channels_last if channels_last else torch.contiguous_format
     for _, batch in enumerate(tqdm(data_loader)):
         images, targets, image_ids = batch["images"], batch["targets"], batch["img_ids"]
-        images = images.to(device)
-        with torch.no_grad():
+        images = images.to(device, memory_format=memory_format)
+        with torch.no_grad(), autocast(device, precision):
             if timer:
                 timer.tic()
             output = model(images, targets)
             if timer:
-                torch.cuda.synchronize()
+                if device.type == "cuda":
+                    torch.cuda.synchronize()
                 timer.toc()
-            output = output.to(cpu_device)
-        results_dict.update(
-            {img_id: output for img_id in image_ids}
-        )
+            output = [o.to(cpu_device) for o in output]
+        if writer is not None:
+            for img_id, result in zip(image_ids, output):
+                writer.write(img_id, result)
+        else:
+            results_dict.update(
+                {img_id: result for img_id, result in zip(image_ids, output)}
+            )
     return results_dict
 
 
@@ -36,6 +86,8 @@ def inference(
         eval_types=("detections",),
         device="cuda",
         output_folder=None,
+        channels_last=False,
+        precision="fp32",
 
 ):
     device = torch.device(device)
@@ -47,7 +99,11 @@ def inference(
     total_timer = Timer()
     inference_timer = Timer()
     total_timer.tic()
-    predictions = compute_on_dataset(model, data_loader, device, inference_timer)
+    # the predictions are written while inference runs, evaluate() then only gets the files
+    writer = make_prediction_writer(eval_types, dataset, output_folder)
+    predictions = compute_on_dataset(model, data_loader, device, inference_timer, channels_last, writer, precision)
+    if writer is not None:
+        writer.close()
     comm.synchronize()
 
     total_time = total_timer.toc()
@@ -1,7 +1,7 @@
 import os
 
 from smoke.data import build_test_loader
-from smoke.engine.inference import inference
+from smoke.engine.inference import configure_inference, inference, use_channels_last
 from smoke.utils import comm
 from smoke.utils.miscellaneous import mkdir
 
@@ -15,14 +15,17 @@ def run_test(cfg, model):
             output_folder = os.path.join(cfg.OUTPUT_DIR, "inference", dataset_name)
             mkdir(output_folder)
             output_folders[idx] = output_folder
+    configure_inference(cfg, model)
     data_loaders_val = build_test_loader(cfg)
     for output_folder, dataset_name, data_loader_val in zip(output_folders, dataset_names, data_loaders_val):
         inference(
             model,
-            data_loaders_val,
+            data_loader_val,
             dataset_name=dataset_name,
             eval_types=eval_types,
             device=cfg.MODEL.DEVICE,
             output_folder=output_folder,
+            channels_last=use_channels_last(cfg),
+            precision=cfg.TEST.PRECISION,
         )
         comm.synchronize()
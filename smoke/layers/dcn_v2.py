@@ -7,11 +7,89 @@ import math
 
 import torch
 from torch import nn
+from torch.nn import functional as F
 from torch.autograd import Function
 from torch.nn.modules.utils import _pair
 from torch.autograd.function import once_differentiable
 
-from smoke import _ext as _backend
+try:
+    from smoke import _ext as _backend
+except ImportError:
+    _backend = None
+
+try:
+    from torchvision.ops import deform_conv2d
+except ImportError:
+    deform_conv2d = None
+
+BACKENDS = ("auto", "ext", "torchvision", "sampling")
+_backend_name = "auto"
+
+
+def set_backend(name):
+    """
+    Selects the implementation of the modulated deformable convolution (MODEL.BACKBONE.DCN_BACKEND):
+    "ext" the compiled smoke._ext kernels, "torchvision" torchvision.ops.deform_conv2d, "sampling" bilinear sampling
+    with F.grid_sample and a matrix product (dcn_v2_sampling), which compute the same convolution with the same
+    weights, and "auto" the extension if it is built, then torchvision, then sampling.
+    """
+    global _backend_name
+    if name not in BACKENDS:
+        raise ValueError("Unknown DCN backend {}, expected one of {}".format(name, BACKENDS))
+    if name == "ext" and _backend is None:
+        raise ImportError("The DCN backend ext requires the smoke._ext extension, build it with setup.py")
+    if name == "torchvision" and deform_conv2d is None:
+        raise ImportError("The DCN backend torchvision requires torchvision")
+    _backend_name = name
+
+
+def get_backend():
+    """ The backend used by dcn_v2_conv, "ext", "torchvision" or "sampling". """
+    if _backend_name != "auto":
+        return _backend_name
+    if _backend is not None:
+        return "ext"
+    return "torchvision" if deform_conv2d is not None else "sampling"
+
+
+def dcn_v2_sampling(input, offset, mask, weight, bias, stride, padding, dilation, deformable_groups):
+    """
+    Modulated deformable convolution in PyTorch operations: the input is sampled bilinearly at the kernel positions
+    moved by the offsets, as the columns of an im2col, which are weighted by the mask and multiplied with the weights.
+    Samples outside of the input are 0, as in the _ext kernels.
+    """
+    stride, padding, dilation = _pair(stride), _pair(padding), _pair(dilation)
+    batch, channels, height, width = input.shape
+    channels_out, _, kernel_h, kernel_w = weight.shape
+    kernel_size = kernel_h * kernel_w
+    height_out, width_out = offset.shape[2:]
+    groups = deformable_groups
+
+    # sampling positions in input pixels, [N * G, K, H_out, W_out]
+    offset = offset.reshape(batch * groups, kernel_size, 2, height_out, width_out)
+    kernel_y = torch.arange(kernel_h, dtype=input.dtype, device=input.device) * dilation[0]
+    kernel_x = torch.arange(kernel_w, dtype=input.dtype, device=input.device) * dilation[1]
+    out_y = torch.arange(height_out, dtype=input.dtype, device=input.device) * stride[0] - padding[0]
+    out_x = torch.arange(width_out, dtype=input.dtype, device=input.device) * stride[1] - padding[1]
+    y = kernel_y.view(-1, 1, 1, 1).expand(kernel_h, kernel_w, 1, 1).reshape(1, kernel_size, 1, 1) + \
+        out_y.view(1, 1, -1, 1) + offset[:, :, 0]
+    x = kernel_x.view(1, -1, 1, 1).expand(kernel_h, kernel_w, 1, 1).reshape(1, kernel_size, 1, 1) + \
+        out_x.view(1, 1, 1, -1) + offset[:, :, 1]
+
+    # pixel to grid_sample coordinates, with align_corners=False pixel i is at (2 * i + 1) / size - 1
+    grid = torch.stack([(2 * x + 1) / width - 1, (2 * y + 1) / height - 1], dim=-1)
+    columns = F.grid_sample(input.reshape(batch * groups, channels // groups, height, width),
+                            grid.view(batch * groups, kernel_size * height_out, width_out, 2),
+                            mode="bilinear", padding_mode="zeros", align_corners=False)
+    columns = columns.view(batch * groups, channels // groups, kernel_size, height_out * width_out) * \
+        mask.reshape(batch * groups, 1, kernel_size, height_out * width_out)
+
+    # [C_out, C * K] x [N, C * K, H_out * W_out]
+    output = torch.matmul(weight.reshape(channels_out, -1),
+                          columns.view(batch, channels * kernel_size, height_out * width_out))
+    output = output + bias.view(1, -1, 1)
+
+    return output.view(batch, channels_out, height_out, width_out)
 
 
 class _DCNv2(Function):
@@ -23,6 +101,8 @@ class _DCNv2(Function):
         ctx.dilation = _pair(dilation)
         ctx.kernel_size = _pair(weight.shape[2:4])
         ctx.deformable_groups = deformable_groups
+        # the kernels index NCHW memory directly, e.g. with a channels_last model
+        input, offset, mask, weight, bias = (t.contiguous() for t in (input, offset, mask, weight, bias))
         output = _backend.dcn_v2_forward(input, weight, bias,
                                          offset, mask,
                                          ctx.kernel_size[0], ctx.kernel_size[1],
@@ -52,7 +132,24 @@ class _DCNv2(Function):
                None, None, None, None,
 
 
-dcn_v2_conv = _DCNv2.apply
+def dcn_v2_conv(input, offset, mask, weight, bias, stride, padding, dilation, deformable_groups):
+    # the extension can not be traced, torchvision has the same modulated deformable convolution as an operator
+    # that TorchScript serializes and that is exported to the ONNX DeformConv, see smoke/modeling/detector/export.py
+    tracing = torch.jit.is_tracing() or torch.onnx.is_in_onnx_export()
+    if input.dtype != weight.dtype or offset.dtype != weight.dtype:
+        # the ext and torchvision CPU kernels have no half precision, under autocast (TEST.PRECISION) DCN is in float
+        input, offset, mask = input.to(weight.dtype), offset.to(weight.dtype), mask.to(weight.dtype)
+    backend = get_backend()
+    if backend == "sampling" and not (tracing and deform_conv2d is not None):
+        return dcn_v2_sampling(input, offset, mask, weight, bias, stride, padding, dilation, deformable_groups)
+    if tracing or backend == "torchvision":
+        if deform_conv2d is None:
+            raise ImportError("Tracing or exporting the deformable convolutions requires torchvision")
+        # the offsets hold (y, x) per kernel position and the mask one weight per kernel position, as for _ext
+        return deform_conv2d(input, offset, weight, bias,
+                             stride=_pair(stride), padding=_pair(padding), dilation=_pair(dilation), mask=mask)
+    return _DCNv2.apply(input, offset, mask, weight, bias,
+                        stride, padding, dilation, deformable_groups)
 
 
 class DCNv2(nn.Module):
@@ -140,6 +237,8 @@ class _DCNv2Pooling(Function):
                 part_size=None,
                 sample_per_part=4,
                 trans_std=.0):
+        if _backend is None:
+            raise ImportError("DCNv2Pooling requires the smoke._ext extension, build it with setup.py")
         ctx.spatial_scale = spatial_scale
         ctx.no_trans = int(no_trans)
         ctx.output_dim = output_dim
@@ -1,5 +1,4 @@
 import torch
-from torch.nn import functional as F
 
 
 def sigmoid_hm(hm_features):
@@ -9,19 +8,29 @@ def sigmoid_hm(hm_features):
     return x
 
 
+def _max_filter(x, dim, pad):
+    # maximum over a window of 2 * pad + 1 along dim, as max pooling with stride 1 and padding pad
+    size = x.shape[dim]
+    out = x.clone()
+    for shift in range(1, min(pad, size - 1) + 1):
+        lead, trail = out.narrow(dim, shift, size - shift), out.narrow(dim, 0, size - shift)
+        lead.copy_(torch.max(lead, x.narrow(dim, 0, size - shift)))
+        trail.copy_(torch.max(trail, x.narrow(dim, shift, size - shift)))
+
+    return out
+
+
 def nms_hm(heat_map, kernel=3):
     pad = (kernel - 1) // 2
 
-    hmax = F.max_pool2d(heat_map,
-                        kernel_size=(kernel, kernel),
-                        stride=1,
-                        padding=pad)
+    # separable max filter, the same maxima as F.max_pool2d but much cheaper on the CPU
+    hmax = _max_filter(_max_filter(heat_map, 3, pad), 2, pad)
     eq_index = (hmax == heat_map).float()
 
     return heat_map * eq_index
 
 
-def select_topk(heat_map, K=100):
+def select_topk(heat_map, K: int = 100):
     '''
     Args:
         heat_map: heat_map in [N, C, H, W]
@@ -40,20 +49,15 @@ def select_topk(heat_map, K=100):
     topk_scores_all, topk_inds_all = torch.topk(heat_map, K)
 
     # topk_inds_all = topk_inds_all % (height * width) # todo: this seems redudant
-    topk_ys = (topk_inds_all / width).float()
+    topk_ys = torch.div(topk_inds_all, width, rounding_mode="floor").float()
     topk_xs = (topk_inds_all % width).float()
 
-    assert isinstance(topk_xs, torch.cuda.FloatTensor)
-    assert isinstance(topk_ys, torch.cuda.FloatTensor)
-
     # Select topK examples across channel
     # [N, C, K] -----> [N, C*K]
     topk_scores_all = topk_scores_all.view(batch, -1)
     # Both in [N, K]
     topk_scores, topk_inds = torch.topk(topk_scores_all, K)
-    topk_clses = (topk_inds / K).float()
-
-    assert isinstance(topk_clses, torch.cuda.FloatTensor)
+    topk_clses = torch.div(topk_inds, K, rounding_mode="floor").float()
 
     # First expand it as 3 dimension
     topk_inds_all = _gather_feat(topk_inds_all.view(batch, -1, 1), topk_inds).view(batch, K)
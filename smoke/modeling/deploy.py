@@ -0,0 +1,115 @@
+from collections import OrderedDict
+
+import torch
+from torch import nn
+from torch.nn.utils.fusion import fuse_conv_bn_weights
+
+from smoke.layers.dcn_v2 import DCNv2
+from smoke.layers.deform_conv import DeformConv
+from smoke.modeling.backbone.dla import BasicBlock, Root
+
+# (convolution, normalization) attributes of the modules that apply the norm_func after a convolution, the
+# nn.Sequential ones (base_layer, levels, Tree.project, the heads) are found by their order
+_CONV_NORM_PAIRS = (
+    (BasicBlock, (("conv1", "norm1"), ("conv2", "norm2"))),
+    (Root, (("conv", "norm"),)),
+    (DeformConv, (("deform_conv", "norm"),)),
+)
+
+
+def _fold_batch_norm(conv, norm):
+    conv.weight, conv.bias = fuse_conv_bn_weights(conv.weight, conv.bias,
+                                                  norm.running_mean, norm.running_var, norm.eps,
+                                                  norm.weight, norm.bias)
+
+
+def fold_batch_norms(model):
+    '''
+    Folds every BatchNorm2d that follows a convolution or DCN into the weights and bias of the convolution, with the
+    running statistics, and replaces it with nn.Identity. GroupNorm (the default MODEL.BACKBONE.USE_NORMALIZATION and
+    SMOKE_HEAD.USE_NORMALIZATION) normalizes with the statistics of each image and can not be folded.
+
+    Returns:
+        the number of folded normalizations
+    '''
+    folded = 0
+    for module in list(model.modules()):
+        pairs = []
+        if isinstance(module, nn.Sequential):
+            pairs = [(str(i), str(i + 1)) for i in range(len(module) - 1)]
+        for module_type, attributes in _CONV_NORM_PAIRS:
+            if isinstance(module, module_type):
+                pairs = attributes
+
+        for conv_name, norm_name in pairs:
+            conv, norm = getattr(module, conv_name), getattr(module, norm_name)
+            if isinstance(conv, (nn.Conv2d, DCNv2)) and type(norm) is nn.BatchNorm2d:
+                _fold_batch_norm(conv, norm)
+                setattr(module, norm_name, nn.Identity())
+                folded += 1
+
+    return folded
+
+
+def _concat_norms(first, second):
+    if isinstance(first, nn.Identity) and isinstance(second, nn.Identity):
+        return nn.Identity()
+    if isinstance(first, nn.GroupNorm) and isinstance(second, nn.GroupNorm) and \
+            first.num_groups == second.num_groups and first.eps == second.eps:
+        # the groups of the wider normalization are the ones of both
+        norm = nn.GroupNorm(2 * first.num_groups, first.num_channels + second.num_channels, eps=first.eps)
+    elif isinstance(first, nn.BatchNorm2d) and isinstance(second, nn.BatchNorm2d) and first.eps == second.eps:
+        norm = nn.BatchNorm2d(first.num_features + second.num_features, eps=first.eps)
+        norm.running_mean.copy_(torch.cat([first.running_mean, second.running_mean]))
+        norm.running_var.copy_(torch.cat([first.running_var, second.running_var]))
+    else:
+        raise ValueError("Can not merge the normalizations {} and {}".format(first, second))
+    norm.weight.data.copy_(torch.cat([first.weight.data, second.weight.data]))
+    norm.bias.data.copy_(torch.cat([first.bias.data, second.bias.data]))
+
+    return norm
+
+
+def merge_head_convs(predictor):
+    '''
+    Collapses the first 3x3 convolutions of class_head and regression_head of SMOKEPredictor, which are applied to the
+    same features, with their normalizations into one convolution of twice the channels. Its output is split between
+    the output convolutions of the heads, see SMOKEPredictor.forward.
+    '''
+    if predictor.shared_head is not None:
+        return predictor
+    class_conv, class_norm, _, class_out = predictor.class_head
+    regression_conv, regression_norm, _, regression_out = predictor.regression_head
+
+    conv = nn.Conv2d(class_conv.in_channels,
+                     class_conv.out_channels + regression_conv.out_channels,
+                     kernel_size=class_conv.kernel_size,
+                     padding=class_conv.padding,
+                     bias=True).to(class_conv.weight.device)
+    conv.weight.data.copy_(torch.cat([class_conv.weight.data, regression_conv.weight.data]))
+    conv.bias.data.copy_(torch.cat([class_conv.bias.data, regression_conv.bias.data]))
+    norm = _concat_norms(class_norm, regression_norm).to(class_conv.weight.device)
+
+    predictor.shared_head = nn.Sequential(conv, norm, nn.ReLU(inplace=True))
+    # the output convolutions keep their names, and their keys in the state dict
+    output_name = str(len(predictor.class_head) - 1)
+    predictor.class_head = nn.Sequential(OrderedDict([(output_name, class_out)]))
+    predictor.regression_head = nn.Sequential(OrderedDict([(output_name, regression_out)]))
+
+    return predictor
+
+
+def deploy(model, channels_last=True):
+    '''
+    Inference graph of a trained KeypointDetector, transformed in place: the BatchNorm2d layers folded into the
+    convolutions, the first convolutions of the heads merged, and the weights in channels_last memory format. The
+    detections are the same, the model can not be trained any more.
+    '''
+    model.eval()
+    with torch.no_grad():
+        fold_batch_norms(model)
+        merge_head_convs(model.heads.predictor)
+    if channels_last:
+        model.to(memory_format=torch.channels_last)
+
+    return model
@@ -1,4 +1,7 @@
+from smoke.layers import dcn_v2
+
 from .keypoint_detector import KeypointDetector
 
 def build_detection_model(cfg):
+    dcn_v2.set_backend(cfg.MODEL.BACKBONE.DCN_BACKEND)
     return KeypointDetector(cfg)
\ No newline at end of file
@@ -0,0 +1,101 @@
+import inspect
+
+import torch
+from torch import nn
+
+from smoke.modeling.heads.smoke_head.inference import ExportPostProcessor
+
+INPUT_NAMES = ["images", "K", "trans_mat", "size"]
+OUTPUT_NAMES = ["detections", "num_detections"]
+
+
+class ExportDetector(nn.Module):
+    '''
+    KeypointDetector for export to TorchScript and ONNX: the backbone, SMOKEPredictor and ExportPostProcessor on a
+    batch of image tensors, with the camera intrinsics, the image to feature map transforms and the image sizes as
+    tensors instead of ParamsList targets.
+    '''
+
+    def __init__(self, model):
+        super(ExportDetector, self).__init__()
+
+        self.backbone = model.backbone
+        self.predictor = model.heads.predictor
+        self.post_processor = ExportPostProcessor(model.heads.post_processor)
+
+    def forward(self, images, K, trans_mat, size):
+        """
+        Args:
+            images: normalized images in [N, 3, H, W]
+            K: camera intrinsics of each image, [N, 3, 3]
+            trans_mat: transformation from image to feature map of each image, [N, 3, 3]
+            size: (width, height) of each image, [N, 2]
+
+        Returns:
+            detections in [N, K, 14] and number of detections above the threshold in [N], see ExportPostProcessor
+        """
+        features = self.backbone(images)
+        pred_heatmap, pred_regression = self.predictor(features)
+
+        return self.post_processor(pred_heatmap, pred_regression, K, trans_mat, size)
+
+
+def export_inputs(images, targets):
+    '''
+    The inputs of ExportDetector for a batch of images and their ParamsList targets, as given to KeypointDetector.
+    '''
+    K = torch.stack([t.get_field("K") for t in targets]).float()
+    trans_mat = torch.stack([t.get_field("trans_mat") for t in targets]).float()
+    size = torch.stack([torch.tensor(t.size) for t in targets]).float()
+
+    return images, K, trans_mat, size
+
+
+def export_torchscript(model, inputs, path):
+    '''
+    Traces the detector on the example inputs and saves it, to be loaded with torch.jit.load without this package.
+    The deformable convolutions are traced as torchvision::deform_conv2d, so the runtime needs torchvision.
+    '''
+    detector = ExportDetector(model).eval()
+    with torch.no_grad():
+        traced = torch.jit.trace(detector, inputs)
+    traced = torch.jit.freeze(traced)
+    traced.save(path)
+
+    return traced
+
+
+def _deform_conv2d_symbolic(g, input, weight, offset, mask, bias, stride_h, stride_w, pad_h, pad_w,
+                            dilation_h, dilation_w, groups, offset_groups, use_mask):
+    from torch.onnx.symbolic_helper import _get_const
+
+    stride = [_get_const(stride_h, "i", "stride_h"), _get_const(stride_w, "i", "stride_w")]
+    pad = [_get_const(pad_h, "i", "pad_h"), _get_const(pad_w, "i", "pad_w")]
+    dilation = [_get_const(dilation_h, "i", "dilation_h"), _get_const(dilation_w, "i", "dilation_w")]
+    inputs = [input, weight, offset, bias]
+    if _get_const(use_mask, "b", "use_mask"):
+        inputs.append(mask)
+
+    return g.op("DeformConv", *inputs,
+                strides_i=stride, pads_i=pad + pad, dilations_i=dilation,
+                group_i=_get_const(groups, "i", "groups"), offset_group_i=_get_const(offset_groups, "i", "offset_groups"))
+
+
+def export_onnx(model, inputs, path, opset_version=19):
+    '''
+    Exports the detector to ONNX, with a dynamic batch size. The deformable convolutions are exported to the
+    DeformConv operator, which needs opset 19.
+    '''
+    torch.onnx.register_custom_op_symbolic("torchvision::deform_conv2d", _deform_conv2d_symbolic, opset_version)
+    detector = ExportDetector(model).eval()
+
+    # the TorchScript based exporter, which the custom symbolic is registered with; newer PyTorch defaults to dynamo
+    kwargs = {"dynamo": False} if "dynamo" in inspect.signature(torch.onnx.export).parameters else {}
+    dynamic_axes = {name: {0: "batch"} for name in INPUT_NAMES + OUTPUT_NAMES}
+    with torch.no_grad():
+        torch.onnx.export(detector, inputs, path,
+                          input_names=INPUT_NAMES,
+                          output_names=OUTPUT_NAMES,
+                          dynamic_axes=dynamic_axes,
+                          opset_version=opset_version,
+                          **kwargs)
@@ -1,11 +1,11 @@
 import torch
 from torch import nn
+from torch.nn import functional as F
 
 from smoke.modeling.smoke_coder import SMOKECoder
 from smoke.layers.utils import (
     nms_hm,
     select_topk,
-    select_point_of_interest,
 )
 
 
@@ -33,8 +33,16 @@ class PostProcessor(nn.Module):
                     size=size)
 
     def forward(self, predictions, targets):
+        """
+        Args:
+            predictions: heatmap and regression maps of the batch
+            targets: ParamsList of each image, with the K and trans_mat fields
+
+        Returns:
+            list of the detections of each image, in [num_detections, 14]
+        """
         pred_heatmap, pred_regression = predictions[0], predictions[1]
-        batch = pred_heatmap.shape[0]
+        batch, channel = pred_regression.shape[:2]
 
         target_varibales = self.prepare_targets(targets)
 
@@ -45,65 +53,164 @@ class PostProcessor(nn.Module):
             K=self.max_detection,
         )
 
-        pred_regression = select_point_of_interest(
-            batch, indexs, pred_regression
-        )
-        pred_regression_pois = pred_regression.view(-1, self.reg_head)
+        # only the top k points above the threshold are decoded, in the order of the top k of each image
+        keep = scores > self.det_threshold
+        batch_ids = keep.nonzero()[:, 0]
+        scores, indexs, clses, ys, xs = scores[keep], indexs[keep], clses[keep], ys[keep], xs[keep]
 
-        pred_proj_points = torch.cat([xs.view(-1, 1), ys.view(-1, 1)], dim=1)
-        # FIXME: fix hard code here
-        pred_depths_offset = pred_regression_pois[:, 0]
-        pred_proj_offsets = pred_regression_pois[:, 1:3]
-        pred_dimensions_offsets = pred_regression_pois[:, 3:6]
-        pred_orientation = pred_regression_pois[:, 6:]
+        # [N, C, H, W] -----> [M, C] at the selected points
+        pred_regression_pois = pred_regression.reshape(batch, channel, -1)[batch_ids, :, indexs]
+        pred_proj_points = torch.stack([xs, ys], dim=1)
 
-        pred_depths = self.smoke_coder.decode_depth(pred_depths_offset)
-        pred_locations = self.smoke_coder.decode_location(
+        pred_locations, pred_dimensions, pred_rotys, pred_alphas = self.smoke_coder.decode_detections(
             pred_proj_points,
-            pred_proj_offsets,
-            pred_depths,
+            pred_regression_pois,
+            clses,
+            batch_ids,
             target_varibales["K"],
             target_varibales["trans_mat"]
         )
-        pred_dimensions = self.smoke_coder.decode_dimension(
-            clses,
-            pred_dimensions_offsets
-        )
-        # we need to change center location to bottom location
-        pred_locations[:, 1] += pred_dimensions[:, 1] / 2
-
-        pred_rotys, pred_alphas = self.smoke_coder.decode_orientation(
-            pred_orientation,
-            pred_locations
-        )
 
         if self.pred_2d:
+            # intrinsics and image size of the image of each detection
             box2d = self.smoke_coder.encode_box2d(
-                target_varibales["K"],
+                target_varibales["K"].to(device=batch_ids.device)[batch_ids],
                 pred_rotys,
                 pred_dimensions,
                 pred_locations,
-                target_varibales["size"]
+                target_varibales["size"].to(device=batch_ids.device)[batch_ids]
             )
         else:
-            box2d = torch.tensor([0, 0, 0, 0])
+            box2d = pred_locations.new_zeros(pred_locations.shape[0], 4)
 
-        # change variables to the same dimension
-        clses = clses.view(-1, 1)
-        pred_alphas = pred_alphas.view(-1, 1)
-        pred_rotys = pred_rotys.view(-1, 1)
-        scores = scores.view(-1, 1)
         # change dimension back to h,w,l
         pred_dimensions = pred_dimensions.roll(shifts=-1, dims=1)
 
         result = torch.cat([
-            clses, pred_alphas, box2d, pred_dimensions, pred_locations, pred_rotys, scores
+            clses.view(-1, 1), pred_alphas.view(-1, 1), box2d, pred_dimensions, pred_locations,
+            pred_rotys.view(-1, 1), scores.view(-1, 1)
         ], dim=1)
 
-        keep_idx = result[:, -1] > self.det_threshold
-        result = result[keep_idx]
+        # [M, 14] -----> one [num_detections, 14] tensor per image
+        results = result.split(keep.sum(dim=1).tolist())
+
+        return list(results)
+
+
+def _inverse_3x3(matrices):
+    # inverse of [N, 3, 3] matrices by their adjugate, with tensor operations only (ONNX has no matrix inverse)
+    m = matrices.reshape(-1, 9).unbind(1)
+    adjugate = torch.stack([
+        m[4] * m[8] - m[5] * m[7], m[2] * m[7] - m[1] * m[8], m[1] * m[5] - m[2] * m[4],
+        m[5] * m[6] - m[3] * m[8], m[0] * m[8] - m[2] * m[6], m[2] * m[3] - m[0] * m[5],
+        m[3] * m[7] - m[4] * m[6], m[1] * m[6] - m[0] * m[7], m[0] * m[4] - m[1] * m[3],
+    ], dim=1)
+    determinant = m[0] * adjugate[:, 0] + m[1] * adjugate[:, 3] + m[2] * adjugate[:, 6]
+
+    return (adjugate / determinant.unsqueeze(1)).view(-1, 3, 3)
+
+
+class ExportPostProcessor(nn.Module):
+    """
+    The decoding of PostProcessor as tensor operations with fixed output shapes, so that it can be traced or
+    scripted and exported to ONNX with the network. The camera intrinsics K, the image to feature map transforms
+    and the image sizes are inputs instead of ParamsList targets.
+
+    All top k points are decoded. The outputs are the [N, K, 14] detections in decreasing score, as the rows of
+    PostProcessor, and the number of detections above the threshold of each image, which are the first ones.
+    """
+
+    def __init__(self, post_processor):
+        super(ExportPostProcessor, self).__init__()
+        smoke_coder = post_processor.smoke_coder
+        self.det_threshold = float(post_processor.det_threshold)
+        self.max_detection = int(post_processor.max_detection)
+        self.pred_2d = bool(post_processor.pred_2d)
+
+        self.register_buffer("depth_ref", torch.as_tensor(smoke_coder.depth_ref, dtype=torch.float32).cpu())
+        self.register_buffer("dim_ref", torch.as_tensor(smoke_coder.dim_ref, dtype=torch.float32).cpu())
+        # corners of the 3D box in units of (l, h, w), from the bottom center
+        self.register_buffer("corners", torch.tensor([[0.5, 0., 0.5], [0.5, 0., -0.5], [-0.5, 0., -0.5],
+                                                      [-0.5, 0., 0.5], [0.5, -1., 0.5], [0.5, -1., -0.5],
+                                                      [-0.5, -1., -0.5], [-0.5, -1., 0.5]]))
+
+    def forward(self, pred_heatmap, pred_regression, K, trans_mat, size):
+        """
+        Args:
+            pred_heatmap, pred_regression: outputs of SMOKEPredictor, [N, C, H, W]
+            K: camera intrinsics of each image, [N, 3, 3]
+            trans_mat: transformation from image to feature map of each image, [N, 3, 3]
+            size: (width, height) of each image, [N, 2]
+
+        Returns:
+            detections in [N, K, 14] and number of detections above the threshold in [N]
+        """
+        batch, channel = pred_regression.shape[0], pred_regression.shape[1]
+        pi = 3.14159
+
+        # nms_hm with max pooling, which all runtimes implement
+        hmax = F.max_pool2d(pred_heatmap, kernel_size=3, stride=1, padding=1)
+        heatmap = pred_heatmap * (hmax == pred_heatmap).float()
+        scores, indexs, clses, ys, xs = select_topk(heatmap, K=self.max_detection)
+
+        # [N, C, H, W] -----> [N, K, C] at the selected points
+        indexs = indexs.unsqueeze(1).expand(batch, channel, self.max_detection)
+        regression = pred_regression.reshape(batch, channel, -1).gather(2, indexs).permute(0, 2, 1)
+
+        # decode_detections for [N, K] points
+        back_projections = torch.matmul(_inverse_3x3(K), _inverse_3x3(trans_mat)).unsqueeze(1)
+        depths = regression[:, :, 0:1] * self.depth_ref[1] + self.depth_ref[0]
+        proj_points = torch.stack([xs, ys], dim=2) + regression[:, :, 1:3]
+        locations = torch.matmul(back_projections[:, :, :, :2], proj_points.unsqueeze(-1)).squeeze(-1)
+        locations = (locations + back_projections[:, :, :, 2]) * depths
+
+        dimensions = regression[:, :, 3:6].exp() * self.dim_ref[clses.long()]
+        # center to bottom location
+        locations = torch.cat([locations[:, :, 0:1], locations[:, :, 1:2] + dimensions[:, :, 1:2] / 2,
+                               locations[:, :, 2:3]], dim=2)
+
+        rays = torch.atan(locations[:, :, 0] / (locations[:, :, 2] + 1e-7))
+        sin, cos = regression[:, :, 6], regression[:, :, 7]
+        alphas = torch.atan(sin / (cos + 1e-7)) - pi / 2 + pi * (cos < 0).float()
+        rotys = alphas + rays
+        rotys = rotys - 2 * pi * (rotys > pi).float() + 2 * pi * (rotys < -pi).float()
 
-        return result
+        if self.pred_2d:
+            box2d = self.encode_box2d(K, rotys, dimensions, locations, size)
+        else:
+            box2d = torch.zeros_like(locations[:, :, :1]).expand(batch, self.max_detection, 4)
+
+        # change dimension back to h,w,l
+        detections = torch.cat([
+            clses.unsqueeze(2), alphas.unsqueeze(2), box2d, dimensions[:, :, [1, 2, 0]], locations,
+            rotys.unsqueeze(2), scores.unsqueeze(2)
+        ], dim=2)
+        num_detections = (scores > self.det_threshold).sum(dim=1)
+
+        return detections, num_detections
+
+    def encode_box2d(self, K, rotys, dimensions, locations, size):
+        # [N, K, 8, 3] corners in the object frame, rotated around y and moved to the locations
+        corners = dimensions.unsqueeze(2) * self.corners
+        cos, sin = rotys.cos().unsqueeze(2), rotys.sin().unsqueeze(2)
+        x = cos * corners[:, :, :, 0] + sin * corners[:, :, :, 2] + locations[:, :, 0:1]
+        y = corners[:, :, :, 1] + locations[:, :, 1:2]
+        z = -sin * corners[:, :, :, 0] + cos * corners[:, :, :, 2] + locations[:, :, 2:3]
+
+        # [N, K * 8, 3] projected corners
+        corners = torch.stack([x, y, z], dim=3).reshape(K.shape[0], -1, 3)
+        corners = torch.matmul(corners, K.transpose(1, 2)).reshape(x.shape[0], x.shape[1], 8, 3)
+        u = corners[:, :, :, 0] / corners[:, :, :, 2]
+        v = corners[:, :, :, 1] / corners[:, :, :, 2]
+
+        size = size.to(dtype=u.dtype).unsqueeze(1)
+        width, height = size[:, :, 0], size[:, :, 1]
+        box2d = torch.stack([
+            torch.min(u.min(dim=2)[0].clamp(min=0), width), torch.min(v.min(dim=2)[0].clamp(min=0), height),
+            torch.min(u.max(dim=2)[0].clamp(min=0), width), torch.min(v.max(dim=2)[0].clamp(min=0), height),
+        ], dim=2)
+
+        return box2d
 
 
 def make_smoke_post_processor(cfg):
@@ -24,7 +24,9 @@ class SMOKEHead(nn.Module):
             return {}, dict(hm_loss=loss_heatmap,
                             reg_loss=loss_regression, )
         if not self.training:
-            result = self.post_processor(x, targets)
+            # the boxes are decoded in fp32, also under autocast (TEST.PRECISION)
+            with torch.autocast(x[0].device.type, enabled=False):
+                result = self.post_processor([t.float() for t in x], targets)
 
             return result, {}
 
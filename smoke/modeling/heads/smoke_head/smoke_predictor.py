@@ -84,9 +84,18 @@ class SMOKEPredictor(nn.Module):
         )
         _fill_fc_weights(self.regression_head)
 
+        # the first convolutions of both heads as one, split between the heads, see smoke.modeling.deploy
+        self.shared_head = None
+
     def forward(self, features):
-        head_class = self.class_head(features)
-        head_regression = self.regression_head(features)
+        if self.shared_head is not None:
+            shared = self.shared_head(features)
+            channels = shared.shape[1] // 2
+            head_class = self.class_head(shared[:, :channels])
+            head_regression = self.regression_head(shared[:, channels:])
+        else:
+            head_class = self.class_head(features)
+            head_regression = self.regression_head(features)
 
         head_class = sigmoid_hm(head_class)
         # (N, C, H, W)
@@ -1,3 +1,5 @@
+import functools
+
 import numpy as np
 from skimage import transform as trans
 
@@ -35,6 +37,12 @@ def affine_transform(point, matrix):
     return new_point[:2]
 
 
+def affine_transform_points(points, matrix):
+    """ affine_transform of (N, 2) points at once. """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    return points @ matrix[:2, :2].T + matrix[:2, 2]
+
+
 def get_3rd_point(point_a, point_b):
     d = point_a - point_b
     point_c = point_b + np.array([-d[1], d[0]])
@@ -42,6 +50,7 @@ def get_3rd_point(point_a, point_b):
 
 
 def gaussian_radius(h, w, thresh_min=0.7):
+    """ Accepts scalars or arrays of box heights and widths. """
     a1 = 1
     b1 = h + w
     c1 = h * w * (1 - thresh_min) / (1 + thresh_min)
@@ -60,7 +69,7 @@ def gaussian_radius(h, w, thresh_min=0.7):
     sq3 = np.sqrt(b3 ** 2 - 4 * a3 * c3)
     r3 = (b3 + sq3) / (2 * a3)
 
-    return min(r1, r2, r3)
+    return np.minimum(np.minimum(r1, r2), r3)
 
 
 def gaussian2D(shape, sigma=1):
@@ -72,9 +81,17 @@ def gaussian2D(shape, sigma=1):
     return h
 
 
-def draw_umich_gaussian(heatmap, center, radius, k=1):
+@functools.lru_cache(maxsize=256)
+def umich_gaussian(radius):
+    """ The gaussian2D kernel of draw_umich_gaussian, cached by radius. The returned array is read-only. """
     diameter = 2 * radius + 1
     gaussian = gaussian2D((diameter, diameter), sigma=diameter / 6)
+    gaussian.setflags(write=False)
+    return gaussian
+
+
+def draw_umich_gaussian(heatmap, center, radius, k=1):
+    gaussian = umich_gaussian(int(radius))
 
     x, y = int(center[0]), int(center[1])
 
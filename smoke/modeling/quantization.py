@@ -0,0 +1,93 @@
+import copy
+import itertools
+
+import torch
+from torch import nn
+
+try:
+    from torch.ao import quantization
+except ImportError:
+    from torch import quantization
+
+from smoke.layers.dcn_v2 import DCN
+
+
+def default_backend():
+    """ The quantized engine of this CPU, x86 (fbgemm on PyTorch before 1.13) or qnnpack on ARM. """
+    engines = torch.backends.quantized.supported_engines
+    for engine in ("x86", "fbgemm", "qnnpack"):
+        if engine in engines:
+            return engine
+    raise RuntimeError("PyTorch has no quantized engine for this CPU")
+
+
+def quantizable_convs(model):
+    '''
+    The nn.Conv2d layers of the backbone (DLA, IDAUp) and of the SMOKEPredictor heads that are quantized to int8, by
+    name. Kept in float are the offset and mask convolutions of DCN, whose outputs are sampling positions, and the
+    output convolutions of the heads, the heatmap logits and the regression that the 3D boxes are decoded from.
+    '''
+    predictor = model.heads.predictor
+    keep_float = {id(predictor.class_head[-1]), id(predictor.regression_head[-1])}
+    for module in model.modules():
+        if isinstance(module, DCN):
+            keep_float.add(id(module.conv_offset_mask))
+
+    return [name for name, module in model.named_modules()
+            if type(module) is nn.Conv2d and id(module) not in keep_float]
+
+
+def prepare_int8(model, backend=None):
+    '''
+    Eager mode post-training quantization of a copy of the detector: every quantizable_convs layer is wrapped with
+    QuantStub and DeQuantStub, with the observers of the default qconfig of the backend. Normalization, activations,
+    upsampling, DCN and the post-processing stay in float between the quantized convolutions.
+
+    Args:
+        model: KeypointDetector in fp32, it is not modified
+        backend: quantized engine, default_backend() if not given
+
+    Returns:
+        the prepared copy, to calibrate with calibrate() and then convert_int8()
+    '''
+    backend = backend or default_backend()
+    torch.backends.quantized.engine = backend
+    qconfig = quantization.get_default_qconfig(backend)
+
+    model = copy.deepcopy(model).cpu().eval()
+    for name in quantizable_convs(model):
+        parent_name, _, child_name = name.rpartition(".")
+        parent = model.get_submodule(parent_name) if parent_name else model
+        wrapper = quantization.QuantWrapper(getattr(parent, child_name))
+        wrapper.qconfig = qconfig
+        setattr(parent, child_name, wrapper)
+
+    return quantization.prepare(model)
+
+
+def calibrate(model, data_loader, num_batches):
+    '''
+    Runs the prepared model on the first num_batches batches of the data loader on the CPU, the observers record
+    the range of the inputs and outputs of every wrapped convolution.
+    '''
+    model.eval()
+    with torch.no_grad():
+        for batch in itertools.islice(data_loader, num_batches):
+            model(batch["images"], batch["targets"])
+
+    return model
+
+
+def convert_int8(model):
+    '''
+    Replaces the calibrated convolutions with quantized ones, the quantized model only runs on the CPU.
+    '''
+    return quantization.convert(model.eval())
+
+
+def quantize_int8(model, data_loader, num_batches, backend=None):
+    '''
+    prepare_int8, calibrate and convert_int8: an int8 copy of the detector, calibrated on the first num_batches
+    batches of the data loader.
+    '''
+    return convert_int8(calibrate(prepare_int8(model, backend), data_loader, num_batches))
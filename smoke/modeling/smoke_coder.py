@@ -2,51 +2,59 @@ import numpy as np
 
 import torch
 
+from smoke.utils.box3d import encode_boxes, project_points
+
 PI = 3.14159
 
 
-def encode_label(K, ry, dims, locs):
-    l, h, w = dims[0], dims[1], dims[2]
-    x, y, z = locs[0], locs[1], locs[2]
+def encode_labels(K, rotys, dims, locs):
+    '''
+    encode the labels of N objects at once.
+    Args:
+        K: camera intrinsics (3, 3)
+        rotys: rotations in shape N
+        dims: dimensions l, h, w in shape (N, 3)
+        locs: locations x, y, z in shape (N, 3)
 
-    x_corners = [0, l, l, l, l, 0, 0, 0]
-    y_corners = [0, 0, h, h, 0, 0, h, h]
-    z_corners = [0, 0, 0, w, w, w, w, 0]
+    Returns:
+        proj_points: projected 3D centres (N, 2)
+        box2d: 2D boxes of the projected corners (N, 4)
+        corners_3d: 3D corners (N, 3, 8)
+    '''
+    dims = np.asarray(dims, dtype=np.float64).reshape(-1, 3)
+    locs = np.asarray(locs, dtype=np.float64).reshape(-1, 3)
 
-    x_corners += - np.float32(l) / 2
-    y_corners += - np.float32(h)
-    z_corners += - np.float32(w) / 2
+    corners_3d, _, box2d = encode_boxes(K, rotys, dims, locs)
 
-    corners_3d = np.array([x_corners, y_corners, z_corners])
-    rot_mat = np.array([[np.cos(ry), 0, np.sin(ry)],
-                        [0, 1, 0],
-                        [-np.sin(ry), 0, np.cos(ry)]])
-    corners_3d = np.matmul(rot_mat, corners_3d)
-    corners_3d += np.array([x, y, z]).reshape([3, 1])
+    loc_centers = locs - np.stack((np.zeros(len(dims)), dims[:, 1] / 2, np.zeros(len(dims))), axis=1)
+    proj_points = project_points(loc_centers, K)
 
-    loc_center = np.array([x, y - h / 2, z])
-    proj_point = np.matmul(K, loc_center)
-    proj_point = proj_point[:2] / proj_point[2]
+    return proj_points, box2d, corners_3d.transpose(0, 2, 1)
 
-    corners_2d = np.matmul(K, corners_3d)
-    corners_2d = corners_2d[:2] / corners_2d[2]
-    box2d = np.array([min(corners_2d[0]), min(corners_2d[1]),
-                      max(corners_2d[0]), max(corners_2d[1])])
 
-    return proj_point, box2d, corners_3d
+def encode_label(K, ry, dims, locs):
+    proj_points, box2d, corners_3d = encode_labels(K, [ry], [dims], [locs])
+
+    return proj_points[0], box2d[0], corners_3d[0]
 
 
 class SMOKECoder():
-    def __init__(self, depth_ref, dim_ref, device="cuda"):
+    def __init__(self, depth_ref, dim_ref, device="cpu"):
         self.depth_ref = torch.as_tensor(depth_ref).to(device=device)
         self.dim_ref = torch.as_tensor(dim_ref).to(device=device)
 
     def encode_box2d(self, K, rotys, dims, locs, img_size):
+        '''
+        Args:
+            K: camera intrinsics, shape = [3, 3], or [N, 3, 3] for one per object
+            img_size: image (width, height), shape = [2], or [N, 2] for one per object
+
+        Returns:
+            boxes of the projected 3D boxes, clipped to the image, shape = [N, 4]
+        '''
         device = rotys.device
         K = K.to(device=device)
 
-        img_size = img_size.flatten()
-
         box3d = self.encode_box3d(rotys, dims, locs)
         box3d_image = torch.matmul(K, box3d)
         box3d_image = box3d_image[:, :2, :] / box3d_image[:, 2, :].view(
@@ -58,10 +66,12 @@ class SMOKECoder():
         ymins, _ = box3d_image[:, 1, :].min(dim=1)
         ymaxs, _ = box3d_image[:, 1, :].max(dim=1)
 
-        xmins = xmins.clamp(0, img_size[0])
-        xmaxs = xmaxs.clamp(0, img_size[0])
-        ymins = ymins.clamp(0, img_size[1])
-        ymaxs = ymaxs.clamp(0, img_size[1])
+        img_size = img_size.to(device=device, dtype=box3d_image.dtype).view(-1, 2)
+        widths, heights = img_size[:, 0], img_size[:, 1]
+        xmins = torch.min(xmins.clamp(min=0), widths)
+        xmaxs = torch.min(xmaxs.clamp(min=0), widths)
+        ymins = torch.min(ymins.clamp(min=0), heights)
+        ymaxs = torch.min(ymaxs.clamp(min=0), heights)
 
         bboxfrom3d = torch.cat((xmins.unsqueeze(1), ymins.unsqueeze(1),
                                 xmaxs.unsqueeze(1), ymaxs.unsqueeze(1)), dim=1)
@@ -78,7 +88,7 @@ class SMOKECoder():
                                [0, 1, 0],
                                [-1, 0, 1]]).to(dtype=torch.float32,
                                                device=device)
-        ry = i_temp.repeat(N, 1).view(N, -1, 3)
+        ry = i_temp.repeat(N, 1).view(N, 3, 3)
 
         ry[:, 0, 0] *= cos
         ry[:, 0, 2] *= sin
@@ -117,7 +127,7 @@ class SMOKECoder():
                               [4, 5, 0, 1, 6, 7, 2, 3],
                               [4, 5, 6, 0, 1, 2, 3, 7]]).repeat(N, 1).to(device=device)
         box_3d_object = torch.gather(dims, 1, index)
-        box_3d = torch.matmul(ry, box_3d_object.view(N, 3, -1))
+        box_3d = torch.matmul(ry, box_3d_object.view(N, 3, 8))
         box_3d += locs.unsqueeze(-1).repeat(1, 1, 8)
 
         return box_3d
@@ -126,7 +136,8 @@ class SMOKECoder():
         '''
         Transform depth offset to depth
         '''
-        depth = depths_offset * self.depth_ref[1] + self.depth_ref[0]
+        depth_ref = self.depth_ref.to(device=depths_offset.device)
+        depth = depths_offset * depth_ref[1] + depth_ref[0]
 
         return depth
 
@@ -192,7 +203,7 @@ class SMOKECoder():
         '''
         cls_id = cls_id.flatten().long()
 
-        dims_select = self.dim_ref[cls_id, :]
+        dims_select = self.dim_ref.to(device=dims_offset.device)[cls_id, :]
         dimensions = dims_offset.exp() * dims_select
 
         return dimensions
@@ -250,6 +261,53 @@ class SMOKECoder():
             return rotys, alphas
 
 
+    def decode_detections(self, points, regression, clses, batch_ids, Ks, trans_mats):
+        '''
+        fused decoding of the selected detections of a batch at inference time, equivalent to decode_depth,
+        decode_location, decode_dimension and decode_orientation. The camera and feature map transforms are inverted
+        and combined once per image, and the angles are wrapped without index selection.
+        Args:
+            points: detections on feature map in (x, y), shape = [M, 2]
+            regression: regression of the detections (depth, offset x, offset y, 3 dimensions, sin, cos),
+                shape = [M, 8]
+            clses: class of the detections, shape = [M]
+            batch_ids: image of the detections in the batch, shape = [M]
+            Ks: camera intrinsic matrix of each image, shape = [N_batch, 3, 3]
+            trans_mats: transformation matrix from image to feature map of each image, shape = [N_batch, 3, 3]
+
+        Returns:
+            locations: bottom center of the objects, shape = [M, 3]
+            dimensions: object dimensions in (l, h, w), shape = [M, 3]
+            rotys, alphas: rotation y and observation angle, shape = [M]
+        '''
+        device = regression.device
+        depth_ref = self.depth_ref.to(device=device)
+        dim_ref = self.dim_ref.to(device=device)
+
+        # feature map to camera coordinates, K^-1 * trans_mat^-1, per image
+        back_projections = torch.matmul(Ks.to(device=device).inverse(),
+                                        trans_mats.to(device=device).inverse())[batch_ids]
+
+        depths = regression[:, 0] * depth_ref[1] + depth_ref[0]
+        proj_points = points + regression[:, 1:3]
+        locations = torch.matmul(back_projections[:, :, :2], proj_points.unsqueeze(-1)).squeeze(-1)
+        locations = (locations + back_projections[:, :, 2]) * depths.unsqueeze(-1)
+
+        dimensions = regression[:, 3:6].exp() * dim_ref[clses.long()]
+        # center to bottom location
+        locations[:, 1] += dimensions[:, 1] / 2
+
+        rays = torch.atan(locations[:, 0] / (locations[:, 2] + 1e-7))
+        sin, cos = regression[:, 6], regression[:, 7]
+        # - PI / 2 where the cosine is positive, + PI / 2 where it is negative
+        alphas = torch.atan(sin / (cos + 1e-7)) - PI / 2 + PI * (cos < 0).to(dtype=sin.dtype)
+
+        rotys = alphas + rays
+        rotys = rotys - 2 * PI * (rotys > PI).to(dtype=rotys.dtype) + 2 * PI * (rotys < -PI).to(dtype=rotys.dtype)
+
+        return locations, dimensions, rotys, alphas
+
+
 if __name__ == '__main__':
     sc = SMOKECoder(depth_ref=(28.01, 16.32),
                     dim_ref=((3.88, 1.63, 1.53),
@@ -0,0 +1,96 @@
+import numpy as np
+
+# Corners of a 3D box in object coordinates, in units of (length, height, width), in the KITTI order used by
+# encode_label and the visualisations: corners 0, 1, 4, 5 are the top face (y = -height), 2, 3, 6, 7 the bottom face
+# and corners 0, 1, 4, 5 in this order also give the BEV footprint.
+CORNERS = np.array([[-0.5, 0.5, 0.5, 0.5, 0.5, -0.5, -0.5, -0.5],
+                    [-1.0, -1.0, 0.0, 0.0, -1.0, -1.0, 0.0, 0.0],
+                    [-0.5, -0.5, -0.5, 0.5, 0.5, 0.5, 0.5, -0.5]]).T
+BEV_CORNERS = [0, 1, 4, 5]
+
+
+def box3d_corners(dims, locs, rotys):
+    """
+    Corners of N 3D boxes in camera coordinates.
+
+    Args:
+        dims: (N, 3) length, height, width of the boxes
+        locs: (N, 3) bottom centres of the boxes, x, y, z in camera coordinates
+        rotys: (N,) rotations around the camera y axis
+
+    Returns:
+        (N, 8, 3) corners, in the order of CORNERS
+    """
+    dims = np.asarray(dims, dtype=np.float64).reshape(-1, 3)
+    locs = np.asarray(locs, dtype=np.float64).reshape(-1, 3)
+    rotys = np.asarray(rotys, dtype=np.float64).reshape(-1)
+
+    corners = CORNERS * dims[:, None, :]
+    cos, sin = np.cos(rotys)[:, None], np.sin(rotys)[:, None]
+
+    return np.stack((cos * corners[:, :, 0] + sin * corners[:, :, 2],
+                     corners[:, :, 1],
+                     -sin * corners[:, :, 0] + cos * corners[:, :, 2]), axis=-1) + locs[:, None, :]
+
+
+def bev_corners(x, z, length, width, rotation_y):
+    """
+    BEV footprints of N boxes, i.e. corners 0, 1, 4, 5 of box3d_corners in the x-z plane, without computing the
+    heights. Returns (N, 4, 2) x, z corners.
+    """
+    x, z, length, width, rotation_y = (np.asarray(values, dtype=np.float64).reshape(-1) for values in
+                                       (x, z, length, width, rotation_y))
+
+    along = CORNERS[BEV_CORNERS, 0] * length[:, None]
+    across = CORNERS[BEV_CORNERS, 2] * width[:, None]
+    cos, sin = np.cos(rotation_y)[:, None], np.sin(rotation_y)[:, None]
+
+    return np.stack((cos * along + sin * across + x[:, None],
+                     -sin * along + cos * across + z[:, None]), axis=-1)
+
+
+def project_points(points, K):
+    """
+    Projects (..., 3) points in camera coordinates to (..., 2) pixels, with K being the (3, 3) intrinsics or the
+    (3, 4) projection matrix P2.
+    """
+    K = np.asarray(K, dtype=np.float64)
+    projected = points @ K[:, :3].T
+    if K.shape[1] == 4:
+        projected += K[:, 3]
+
+    return projected[..., :2] / projected[..., 2:3]
+
+
+def boxes2d(corners_2d, img_size=None):
+    """
+    2D boxes (N, 4) xmin, ymin, xmax, ymax enclosing the (N, 8, 2) projected corners. If img_size (width, height) is
+    given, the corners are first clipped to [0, width] x [0, height].
+    """
+    if img_size is not None:
+        corners_2d = np.stack((corners_2d[..., 0].clip(0, img_size[0]), corners_2d[..., 1].clip(0, img_size[1])),
+                              axis=-1)
+
+    return np.concatenate((corners_2d.min(axis=-2), corners_2d.max(axis=-2)), axis=-1)
+
+
+def encode_boxes(K, rotys, dims, locs, img_size=None):
+    """
+    Batched corner generation and projection of N 3D boxes.
+
+    Args:
+        K: (3, 3) intrinsics or (3, 4) projection matrix
+        rotys: (N,) rotations around the camera y axis
+        dims: (N, 3) length, height, width of the boxes
+        locs: (N, 3) bottom centres of the boxes in camera coordinates
+        img_size: optional (width, height) to which the 2D boxes are clipped
+
+    Returns:
+        corners_3d: (N, 8, 3) corners in camera coordinates
+        corners_2d: (N, 8, 2) projected corners
+        box2d: (N, 4) 2D boxes xmin, ymin, xmax, ymax
+    """
+    corners_3d = box3d_corners(dims, locs, rotys)
+    corners_2d = project_points(corners_3d, K)
+
+    return corners_3d, corners_2d, boxes2d(corners_2d, img_size)
@@ -0,0 +1,110 @@
+import os
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+def read_P2_line(calib_file):
+    """ The P2 row of a KITTI calibration file (or P_rect_02 of a raw drive's calib_cam_to_cam.txt). """
+    with open(calib_file, 'r') as f:
+        for line in f:
+            if line.startswith('P2:') or line.startswith('P_rect_02:'):
+                return line.split(':', 1)[1].strip()
+    raise ValueError("No P2 in {}".format(calib_file))
+
+
+def parse_P2(values):
+    return np.array([float(i) for i in values.split()], dtype=np.float64).reshape(3, 4)
+
+
+class CalibrationRegistry():
+    """
+    The P2 matrices of a set of calibration files, each file read once. Identical matrices are stored once, keyed by
+    their content: the frames of a raw drive all share one P2, and KITTI object splits only hold a few distinct
+    matrices per recording day.
+
+    The unique matrices and the per-file index are kept in one shared memory block. Pickling the registry (e.g. into
+    spawned DataLoader workers) only sends the name of the block, which the workers attach to instead of copying it.
+    The registry that created the block releases it with close(), or when it is garbage collected, only in the process
+    that created it: copies of the registry in forked workers (which are not pickled) leave the block to that process.
+    """
+
+    def __init__(self, calib_dir, names, shared=True):
+        """
+        Args:
+            calib_dir: directory of the calibration files
+            names: file names without the .txt extension, P2(i) is the matrix of names[i]
+            shared: keep the matrices in shared memory, otherwise in regular arrays
+        """
+        parsed = {}
+        unique = {}
+        index = np.zeros(len(names), dtype=np.int32)
+        for i, name in enumerate(names):
+            values = read_P2_line(os.path.join(calib_dir, name + ".txt"))
+            if values not in parsed:
+                parsed[values] = parse_P2(values)
+            index[i] = unique.setdefault(parsed[values].tobytes(), len(unique))
+
+        matrices = np.stack([np.frombuffer(key).reshape(3, 4) for key in unique]) if unique \
+            else np.zeros((0, 3, 4))
+
+        self.names = list(names)
+        self._shm = None
+        # process that created the block and unlinks it, None for registries attached to a block
+        self._owner_pid = None
+        if shared and len(names):
+            self._shm = shared_memory.SharedMemory(create=True, size=matrices.nbytes + index.nbytes)
+            self._owner_pid = os.getpid()
+            self._attach(len(matrices), len(index))
+            self.matrices[:] = matrices
+            self.index[:] = index
+        else:
+            self.matrices, self.index = matrices, index
+
+    def _attach(self, num_matrices, num_files):
+        self.matrices = np.ndarray((num_matrices, 3, 4), dtype=np.float64, buffer=self._shm.buf)
+        self.index = np.ndarray((num_files,), dtype=np.int32, buffer=self._shm.buf, offset=self.matrices.nbytes)
+
+    def __len__(self):
+        return len(self.index)
+
+    @property
+    def num_unique(self):
+        return len(self.matrices)
+
+    def P2(self, i):
+        """ The (3, 4) P2 matrix of file i. """
+        return self.matrices[self.index[i]].copy()
+
+    def K(self, i):
+        """ The (3, 3) camera intrinsics of file i, as float32 as used by KITTIDataset. """
+        return self.matrices[self.index[i], :, :3].astype(np.float32)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self._shm is not None:
+            state.update(_shm=self._shm.name, _owner_pid=None, matrices=len(self.matrices), index=len(self.index))
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if isinstance(self._shm, str):
+            # workers started by multiprocessing share the resource tracker of the process that created the
+            # block, so attaching does not make the block unlinked when a worker exits
+            self._shm = shared_memory.SharedMemory(name=self._shm)
+            self._attach(state["matrices"], state["index"])
+
+    def close(self):
+        if self._shm is None:
+            return
+        self.matrices, self.index = self.matrices.copy(), self.index.copy()
+        self._shm.close()
+        if self._owner_pid == os.getpid():
+            self._shm.unlink()
+        self._shm = None
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
@@ -0,0 +1,118 @@
+import numpy as np
+
+# KITTI object types, encoded as their index in this tuple. The first three match TYPE_ID_CONVERSION of the dataset
+OBJECT_TYPES = ('Car', 'Cyclist', 'Pedestrian', 'Van', 'Truck', 'Person_sitting', 'Tram', 'Misc', 'DontCare')
+OBJECT_TYPE_IDS = {object_type: type_id for type_id, object_type in enumerate(OBJECT_TYPES)}
+
+# One record per label line. The score is only written for predictions, it is NaN for ground truth labels
+LABEL_DTYPE = np.dtype([
+    ('object_type', np.uint8), ('truncation', np.float64), ('occlusion', np.int64), ('alpha', np.float64),
+    ('left', np.float64), ('top', np.float64), ('right', np.float64), ('bottom', np.float64),
+    ('height', np.float64), ('width', np.float64), ('length', np.float64),
+    ('x', np.float64), ('y', np.float64), ('z', np.float64), ('rotation_y', np.float64),
+    ('score', np.float64),
+])
+NUMERIC_FIELDS = LABEL_DTYPE.names[1:]
+
+
+def parse_kitti_labels(text):
+    """
+    Parse the content of one or more KITTI label files (15 columns, or 16 with the prediction score) into a
+    structured array of LABEL_DTYPE, with one record per non-empty line.
+    """
+    num_lines = _count_lines(text)
+    tokens = text.split()
+    if not tokens:
+        return np.zeros(0, dtype=LABEL_DTYPE)
+
+    type_ids = None
+    num_columns, remainder = divmod(len(tokens), num_lines)
+    if remainder == 0 and num_columns in (15, 16):
+        # all lines have the same number of columns, unless a type is found at a numeric position
+        try:
+            type_ids = [OBJECT_TYPE_IDS[object_type] for object_type in tokens[::num_columns]]
+        except KeyError:
+            type_ids = None
+    if type_ids is not None:
+        del tokens[::num_columns]
+    else:
+        type_ids, tokens, num_columns = _split_lines(text)
+        num_lines = len(type_ids)
+
+    values = np.array(tokens, dtype=np.float64).reshape(num_lines, num_columns - 1)
+
+    records = np.empty(num_lines, dtype=LABEL_DTYPE)
+    records['object_type'] = type_ids
+    for column, field in enumerate(NUMERIC_FIELDS[:num_columns - 1]):
+        records[field] = values[:, column]
+    if num_columns == 15:
+        records['score'] = np.nan
+
+    return records
+
+
+def _count_lines(text):
+    """
+    Number of non-empty lines. Lines with only whitespace are counted too, in which case the columns do not line up
+    with the object types and parse_kitti_labels falls back to _split_lines, which skips them.
+    """
+    lines = text.splitlines()
+    return len(lines) - lines.count('')
+
+
+def _split_lines(text):
+    """
+    Slow path of parse_kitti_labels for text that mixes lines with and without a score, which are padded with NaN.
+    """
+    type_ids, tokens = [], []
+    for line in text.splitlines():
+        fields = line.split()
+        if not fields:
+            continue
+        if len(fields) not in (15, 16):
+            raise ValueError("Invalid KITTI label line: {}".format(line))
+        if fields[0] not in OBJECT_TYPE_IDS:
+            raise ValueError("Unknown KITTI object type: {}".format(fields[0]))
+        type_ids.append(OBJECT_TYPE_IDS[fields[0]])
+        tokens.extend(fields[1:])
+        if len(fields) == 15:
+            tokens.append('nan')
+
+    return type_ids, tokens, 16
+
+
+def read_kitti_label_file(label_path):
+    """
+    Read a single KITTI label file into a structured array of LABEL_DTYPE.
+    """
+    with open(label_path, 'r') as f:
+        return parse_kitti_labels(f.read())
+
+
+def read_kitti_label_files(label_paths):
+    """
+    Read several KITTI label files with a single parse of their concatenated content.
+
+    Returns the records of all files and the number of records of each file, so that the records of the i-th file
+    are records[offsets[i]:offsets[i] + counts[i]] with offsets = np.cumsum(counts) - counts.
+    """
+    texts = []
+    for label_path in label_paths:
+        with open(label_path, 'r') as f:
+            texts.append(f.read())
+
+    records = parse_kitti_labels('\n'.join(texts))
+    counts = np.array([_count_lines(text) for text in texts], dtype=np.int64)
+    if counts.sum() != len(records):
+        # some files have lines with only whitespace
+        counts = np.array([sum(1 for line in text.splitlines() if line.strip()) for text in texts], dtype=np.int64)
+
+    return records, counts
+
+
+def record_to_fields(record):
+    """
+    Convert a record back to the list of fields of a label line, i.e. the object type name followed by the values.
+    """
+    fields = [OBJECT_TYPES[record['object_type']]] + [record[field].item() for field in NUMERIC_FIELDS]
+    return fields if not np.isnan(record['score']) else fields[:-1]
@@ -0,0 +1,175 @@
+try:
+    import os
+    import numpy as np
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.cm import rainbow
+    from matplotlib.collections import PolyCollection
+    from matplotlib.figure import Figure
+    from PIL import Image
+
+    from helper_functions import car_boxes_in_BEV
+
+except ImportError as e:
+    raise e
+
+
+class BEVRenderer:
+    """
+    Headless renderer of BEV figures, for rendering large numbers of images without pyplot. A single figure is drawn
+    on an Agg canvas that is reused for every image: the car boxes are one PolyCollection, the car centres one scatter
+    and the directions of motion one quiver, so rendering an image only updates these three artists and draws the
+    canvas once. The result is returned as an RGB numpy array or written to a PNG file.
+
+    The figure follows TailgateVisualisation.plot_BEV_vectors, i.e. the same axes, unit motion vectors and axes limits
+    as define_BEV_plot_ranges. Most of the drawing time goes into the axes (ticks and labels), which change with the
+    limits of every image. If fixed_range (x_min, x_max, z_min, z_max) is given instead, the axes are drawn once and
+    kept as a background, and only the cars are drawn on top of it for each image.
+    """
+
+    def __init__(self, figsize: tuple = (8, 6), dpi: int = 100, plot_car_boxes: bool = True,
+                 plot_motion_vectors: bool = True, fixed_range: tuple = None, png_compress_level: int = 1):
+        self.plot_car_boxes = plot_car_boxes
+        self.plot_motion_vectors = plot_motion_vectors
+        self.fixed_range = fixed_range
+
+        # Fast zlib compression, PNG files are a few percent larger than with the default level but faster to write
+        self.png_compress_level = png_compress_level
+
+        self.figure = Figure(figsize=figsize, dpi=dpi)
+        self.canvas = FigureCanvasAgg(self.figure)
+        self.ax = self.figure.add_subplot(1, 1, 1)
+
+        self.ax.set_xlabel('X Coordinate')
+        self.ax.set_ylabel('Z Coordinate')
+        self.ax.grid(True)
+
+        self.centres = self.ax.scatter([], [], color='blue', marker='o')
+        self.boxes = PolyCollection([], facecolors='none', edgecolors='black')
+        self.ax.add_collection(self.boxes)
+        self.vectors = None
+
+        # Limits of the empty axes, used for images without any cars
+        self.default_limits = self.ax.get_xlim() + self.ax.get_ylim()
+
+        # Axes drawn without any cars, only used with a fixed range
+        self.background = None
+        if fixed_range is not None:
+            self.ax.set_title('BEV of Detected Cars with Motion Vectors')
+            self.ax.set_xlim(fixed_range[0], fixed_range[1])
+            self.ax.set_ylim(fixed_range[2], fixed_range[3])
+            for artist in (self.centres, self.boxes):
+                artist.set_animated(True)
+            self.canvas.draw()
+            self.background = self.canvas.copy_from_bbox(self.figure.bbox)
+
+    def render(self, x, z, rotation_y, length, width, colors=None,
+               title: str = 'BEV of Detected Cars with Motion Vectors'):
+        """
+        Draws the cars of one image on the canvas.
+        Parameters
+        ----------
+        x: Locations of the cars in x
+        z: Locations of the cars in z
+        rotation_y: Rotations of the cars
+        length: Lengths of the car 3D boxes
+        width: Widths of the car 3D boxes
+        colors: Optional colours of the cars (e.g. one per car), blue centres and black boxes by default
+        title: Title of the figure, ignored with a fixed range
+
+        Returns
+        -------
+        The RGB image as a numpy array of shape (height, width, 3)
+        """
+        x, z, rotation_y = (np.asarray(values, dtype=np.float64) for values in (x, z, rotation_y))
+
+        self.centres.set_offsets(np.column_stack((x, z)))
+        self.centres.set_color('blue' if colors is None else colors)
+
+        self.boxes.set_verts(car_boxes_in_BEV(x, z, length, width, rotation_y) if self.plot_car_boxes else [])
+        self.boxes.set_edgecolor('black' if colors is None else colors)
+
+        # A quiver holds a fixed number of arrows, so it is replaced instead of updated
+        if self.vectors is not None:
+            self.vectors.remove()
+            self.vectors = None
+        if self.plot_motion_vectors and len(x):
+            self.vectors = self.ax.quiver(x, z, np.cos(-rotation_y), np.sin(-rotation_y), color='red', angles='xy',
+                                          scale_units='xy', scale=1, width=0.004, animated=self.background is not None)
+
+        if self.background is not None:
+            # Only the cars are drawn, on top of the cached axes
+            self.canvas.restore_region(self.background)
+            for artist in (self.boxes, self.centres, self.vectors):
+                if artist is not None:
+                    self.ax.draw_artist(artist)
+            return self.to_array()
+
+        self.ax.set_title(title)
+        # Without cars the limits of the previous image would be kept, the empty axes are shown instead
+        x_bottom, x_top, z_bottom, z_top = self.define_BEV_plot_ranges(x, z) if len(z) else self.default_limits
+        self.ax.set_xlim(x_bottom, x_top)
+        self.ax.set_ylim(z_bottom, z_top)
+
+        self.canvas.draw()
+        return self.to_array()
+
+    def to_array(self):
+        """ The current content of the canvas as an RGB numpy array. """
+        return np.asarray(self.canvas.buffer_rgba())[:, :, :3].copy()
+
+    def save(self, output_path: str):
+        """ Writes the current content of the canvas to a PNG file, without drawing the figure again. """
+        image = Image.fromarray(np.asarray(self.canvas.buffer_rgba())[:, :, :3])
+        image.save(output_path, format='png', compress_level=self.png_compress_level)
+
+    def render_images(self, images, output_dir: str = None, color_by_rank: bool = False):
+        """
+        Renders several images, one at a time on the same canvas.
+        Parameters
+        ----------
+        images: An iterable of (image_name, cars) tuples, with cars being a list of parsed labels (LabelLoader format)
+        output_dir: If given, each image is written to output_dir/image_name.png
+        color_by_rank: Colour the cars by their order in the list, as in TailgateVisualisation.plot_BEV_arranged
+
+        Returns
+        -------
+        A generator of (image_name, RGB array) tuples
+        """
+        if output_dir is not None:
+            os.makedirs(output_dir, exist_ok=True)
+
+        for image_name, cars in images:
+            cars = [car for car in cars if car['object_type'].startswith('Car')]
+            array = self.render([car['coordinates']['x'] for car in cars], [car['coordinates']['z'] for car in cars],
+                                [car['rotation_y'] for car in cars],
+                                [car['3Dbox_dimensions']['length'] for car in cars],
+                                [car['3Dbox_dimensions']['width'] for car in cars],
+                                colors=self.rank_colors(len(cars)) if color_by_rank else None)
+            if output_dir is not None:
+                self.save(os.path.join(output_dir, f'{image_name}.png'))
+
+            yield image_name, array
+
+    @staticmethod
+    def define_BEV_plot_ranges(x, z):
+        """
+        Axes limits of TailgateVisualisation.define_BEV_plot_ranges, the x range is the same as the z range so that
+        the car boxes are not distorted, with 5m of padding in z
+        Returns
+        -------
+        The bottom and top x limits and the bottom and top z limits
+        """
+        min_z, max_z = float(np.min(z)), float(np.max(z))
+        central_x_coordinate = float(np.mean(x))
+        z_range = abs(max_z - min_z)
+
+        x_bottom, x_top = central_x_coordinate - z_range / 2, central_x_coordinate + z_range / 2
+        if x_bottom == x_top:  # Only one car in the image
+            x_bottom, x_top = x_bottom - 5, x_top + 5
+
+        return x_bottom, x_top, min_z - 5, max_z + 5
+
+    @staticmethod
+    def rank_colors(num_cars: int):
+        """ Rainbow colours by rank, as used by TailgateVisualisation.plot_BEV_arranged. """
+        return rainbow(np.linspace(0, 1, num_cars))
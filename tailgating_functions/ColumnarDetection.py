@@ -0,0 +1,359 @@
+try:
+    import numpy as np
+
+    from helper_functions import angles_between_angles_radians, calculate_max_speed_difference_two_second_rule, \
+        track_stage_memory
+
+except ImportError as e:
+    raise e
+
+
+class DetectionColumns:
+    """
+    Columnar container of the Car detections of a set of images. Instead of the dictionary of lists of dictionaries
+    produced by LabelLoader, every detection is one row across a set of NumPy arrays, with image_index pointing into
+    the image_names list. Only Car detections are kept, since these are the only objects used for tailgating.
+    Images without any cars are still listed in image_names so that the outputs cover every input image.
+    """
+
+    FIELDS = ('image_index', 'x', 'y', 'z', 'rotation_y', 'height', 'width', 'length')
+
+    def __init__(self, image_names, image_index, x, y, z, rotation_y, height, width, length):
+        self.image_names = list(image_names)
+
+        self.image_index = np.asarray(image_index, dtype=np.int64)
+        self.x = np.asarray(x, dtype=np.float64)
+        self.y = np.asarray(y, dtype=np.float64)
+        self.z = np.asarray(z, dtype=np.float64)
+        self.rotation_y = np.asarray(rotation_y, dtype=np.float64)
+        self.height = np.asarray(height, dtype=np.float64)
+        self.width = np.asarray(width, dtype=np.float64)
+        self.length = np.asarray(length, dtype=np.float64)
+
+    def __len__(self):
+        return len(self.image_index)
+
+    @classmethod
+    def from_labeled_data(cls, labeled_data: dict):
+        """
+        Builds the columns from the dictionary produced by LabelLoader.get_parsed_data()
+        Parameters
+        ----------
+        labeled_data: Dictionary with image names as keys and a list of parsed label dictionaries as values
+
+        Returns
+        -------
+        A DetectionColumns instance holding every Car detection of every image
+        """
+        rows = [(image_index, obj['coordinates']['x'], obj['coordinates']['y'], obj['coordinates']['z'],
+                 obj['rotation_y'], obj['3Dbox_dimensions']['height'], obj['3Dbox_dimensions']['width'],
+                 obj['3Dbox_dimensions']['length'])
+                for image_index, labels in enumerate(labeled_data.values())
+                for obj in labels if obj['object_type'] == 'Car']
+        table = np.array(rows, dtype=np.float64).reshape(-1, len(cls.FIELDS))
+
+        return cls(labeled_data.keys(), table[:, 0].astype(np.int64), *table[:, 1:].T)
+
+    def take(self, indices):
+        """ Returns a new DetectionColumns with the rows selected by indices, keeping the same image names. """
+        return DetectionColumns(self.image_names, *(getattr(self, field)[indices] for field in self.FIELDS))
+
+
+class ColumnarTailgateDetector:
+    """
+    Vectorised counterpart of TailgateDetector. The stages keep the same names and the same semantics as the
+    per-dictionary implementation, but each stage is a single NumPy pass over all the images at once:
+
+    1) arranged_cars: one segmented sort of all cars by (image, z)
+    2) find_cases_along_Z: pairs are consecutive cars of the sorted arrays that belong to the same image
+    3) filter_direction_of_motion, filter_tailgating_by_lane, filter_by_relative_rotation, detect_tailgating_distance
+       and calculate_tailgating_speed_limits operate on index arrays of pairs
+
+    The resulting tailgating_parameters dictionary is the same as the one produced by TailgateDetector when the
+    stages are called in the order used in Tailgating_main.py, up to floating point rounding: the scalar helpers used
+    by TailgateDetector compute the rotational differences with math rather than NumPy, so they can differ in the last
+    bits (at most about 1e-8 rad, for nearly parallel directions). Setting report_memory to True stores the memory used
+    by each stage in self.stage_memory.
+    """
+
+    def __init__(self, labeled_data: dict = None, columns: DetectionColumns = None, report_memory: bool = False):
+        # Memory used by each stage in bytes, only populated if report_memory is True
+        self.report_memory = report_memory
+        self.stage_memory = {}
+
+        if columns is None:
+            columns = DetectionColumns.from_labeled_data(labeled_data)
+        self.columns = columns
+
+        # Sorted view of the cars (by image, then by increasing Z) along with the Car1, Car2... rank in each image
+        self.cars, self.car_rank = self.arranged_cars()
+
+        # Pairs are stored as indices of the rear (closer to the camera) and front car in self.cars
+        self.pair_rear = np.empty(0, dtype=np.int64)
+        self.pair_front = np.empty(0, dtype=np.int64)
+
+        # Rotations used by the tailgating stages, which are edited by filter_direction_of_motion
+        self.rotation_y = self.cars.rotation_y.copy()
+
+        # Indices into the pair arrays for the pairs that are still considered to be tailgating cases
+        self.tailgating_cases = np.empty(0, dtype=np.int64)
+
+        # Parameters are kept as columns, one row per pair in self._parameter_pairs. The pair names are stored as
+        # ranks and only turned into strings when the dictionary output is requested
+        self._parameter_pairs = None
+        self._parameter_names = None
+        self._parameter_columns = {}
+
+    @track_stage_memory
+    def arranged_cars(self):
+        """
+        Arranges the cars of all images by increasing Z with one stable sort keyed on (image, z), which gives the
+        same order as sorting the cars of each image separately.
+        Returns
+        -------
+        The sorted DetectionColumns and the rank of each car in its image (1 for the car nearest to the camera)
+        """
+        order = np.lexsort((self.columns.z, self.columns.image_index))
+        cars = self.columns.take(order)
+
+        segment_start = np.searchsorted(cars.image_index, cars.image_index, side='left')
+        car_rank = np.arange(len(cars)) - segment_start + 1
+
+        return cars, car_rank
+
+    @track_stage_memory
+    def find_cases_along_Z(self):
+        """
+        Pairs each car with the next car along Z in the same image. As in TailgateDetector, cars with equal Z are not
+        paired.
+        Returns
+        -------
+        Updates self.pair_rear and self.pair_front
+        """
+        same_image = self.cars.image_index[1:] == self.cars.image_index[:-1]
+        increasing_z = self.cars.z[:-1] < self.cars.z[1:]
+
+        self.pair_rear = np.flatnonzero(same_image & increasing_z)
+        self.pair_front = self.pair_rear + 1
+
+    def construct_tailgating_dictionaries(self):
+        """
+        Marks every pair as a tailgating case, which will then be filtered to only include tailgating pairs
+        """
+        self.tailgating_cases = np.arange(len(self.pair_rear))
+
+    @track_stage_memory
+    def filter_direction_of_motion(self):
+        """
+        Inverts the direction of motion of cars pointing towards decreasing Z. TailgateDetector applies the inversion
+        once per pair a car belongs to, on car dictionaries shared between consecutive pairs, so a car that is the
+        front of one pair and the rear of the next is inverted twice. The same is reproduced here so that the rotations
+        (and everything derived from them) are identical.
+        Returns
+        -------
+        Updates self.rotation_y
+        """
+        cases = self.tailgating_cases
+        appearances = np.bincount(np.concatenate((self.pair_rear[cases], self.pair_front[cases])),
+                                  minlength=len(self.cars))
+
+        rotation_y = self.rotation_y
+        for count in (1, 2):
+            rotation_y = np.where((rotation_y > 0) & (appearances >= count), rotation_y + np.pi, rotation_y)
+
+        self.rotation_y = rotation_y
+
+    @track_stage_memory
+    def filter_tailgating_by_lane(self, threshold: float):
+        """
+        Filters tailgating cases based on the distance of the front car from the direction of motion of the rear car.
+        Parameters
+        ----------
+        threshold: A float, in meters, above which the cars are considered to move in different lanes
+
+        Returns
+        -------
+        Updates the self.tailgating_cases and the tailgating parameters to include lane distances.
+        """
+        cases = self.tailgating_cases
+        distance = self.calculate_perpendicular_distance(self.pair_rear[cases], self.pair_front[cases])
+
+        different_lane = distance >= threshold
+        possible_tailgating = np.where(different_lane, 'No', 'Yes')
+        self._reset_parameters(cases, {'possible_tailgating': possible_tailgating,
+                                       'same_lane': possible_tailgating,
+                                       'lane_distance': distance})
+
+        self.tailgating_cases = cases[~different_lane]
+
+    @track_stage_memory
+    def filter_by_relative_rotation(self, angular_threshold: float = np.pi / 4):
+        """
+        Filters tailgating cases whose directions of motion differ by more than the angular threshold.
+        Parameters
+        ----------
+        angular_threshold: the threshold, in rads, above which two cars are considered to move in different directions
+
+        Returns
+        -------
+        Updates the self.tailgating_cases and the tailgating parameters to include rotational differences.
+        """
+        cases = self.tailgating_cases
+        rotation_diff = self.calculate_rotational_difference(self.rotation_y[self.pair_rear[cases]],
+                                                            self.rotation_y[self.pair_front[cases]])
+
+        exceeded = rotation_diff >= angular_threshold
+        self._reset_parameters(cases, {'possible_tailgating': np.where(exceeded, 'No', 'Yes'),
+                                       'angular_threshold_between_cars': np.where(exceeded, 'Exceeded', 'Maintained'),
+                                       'rotational_difference': rotation_diff})
+
+        self.tailgating_cases = cases[~exceeded]
+
+    @track_stage_memory
+    def detect_tailgating_distance(self):
+        """
+        Calculates the distance between the rear car and the projection of the front car on the direction of motion of
+        the rear car. TailgateDetector writes the distance of the i-th remaining case of an image into the i-th
+        parameter entry of that image (renaming it Car{i}-Car{i+1}), which is reproduced here.
+        Returns
+        -------
+        Updates the tailgating parameters
+        """
+        cases = self.tailgating_cases
+        distance = self.calculate_distance_along_direction(self.pair_rear[cases], self.pair_front[cases])
+
+        # Position of each case among the cases of its image, and the parameter row at the same position
+        case_image = self.cars.image_index[self.pair_rear[cases]]
+        parameter_image = self.cars.image_index[self.pair_rear[self._parameter_pairs]]
+        position = np.arange(len(cases)) - np.searchsorted(case_image, case_image, side='left')
+        rows = np.searchsorted(parameter_image, case_image, side='left') + position
+
+        rear_names, front_names = self._parameter_names
+        rear_names[rows] = position + 1
+        front_names[rows] = position + 2
+        self._set_parameter_column('current_distance', rows, distance)
+
+    @track_stage_memory
+    def calculate_tailgating_speed_limits(self, time_gap_seconds: float = 2):
+        """
+        Calculates the maximum speed difference between two cars, above which tailgating occurs, for every parameter
+        entry that has a current distance.
+        Parameters
+        ----------
+        time_gap_seconds: The minimum allowable time gap between two cars, 2 seconds for the 2 second rule
+
+        Returns
+        -------
+        Updates the tailgating parameters
+        """
+        if 'current_distance' not in self._parameter_columns:
+            return
+
+        distance, has_distance = self._parameter_columns['current_distance']
+        rows = np.flatnonzero(has_distance)
+        self._set_parameter_column('max_speed_difference_kmh', rows,
+                                   calculate_max_speed_difference_two_second_rule(distance[rows], time_gap_seconds))
+
+    def run(self, distance_threshold: float, angular_threshold: float, time_gap_seconds: float = 2):
+        """
+        Runs every stage in the order used in Tailgating_main.py
+        Returns
+        -------
+        The tailgating_parameters dictionary
+        """
+        self.find_cases_along_Z()
+        self.construct_tailgating_dictionaries()
+        self.filter_direction_of_motion()
+        self.filter_tailgating_by_lane(threshold=distance_threshold)
+        self.filter_by_relative_rotation(angular_threshold=angular_threshold)
+        self.detect_tailgating_distance()
+        self.calculate_tailgating_speed_limits(time_gap_seconds=time_gap_seconds)
+
+        return self.tailgating_parameters
+
+    @property
+    def tailgating_parameters(self):
+        """
+        The tailgating parameters in the same dictionary form used by TailgateDetector, i.e. a list of dictionaries
+        per image name.
+        """
+        if self._parameter_pairs is None:
+            return {}
+
+        image_names = self.columns.image_names
+        parameters = {image_name: [] for image_name in image_names}
+
+        images = self.cars.image_index[self.pair_rear[self._parameter_pairs]].tolist()
+        rear_names, front_names = (names.tolist() for names in self._parameter_names)
+        columns = [(name, values.tolist(), mask.tolist()) for name, (values, mask) in
+                   self._parameter_columns.items()]
+
+        for row, image in enumerate(images):
+            params = {'pair': f'Car{rear_names[row]}-Car{front_names[row]}'}
+            for name, values, mask in columns:
+                if mask[row]:
+                    params[name] = values[row]
+            parameters[image_names[image]].append(params)
+
+        return parameters
+
+    def get_stage_memory(self):
+        """
+        Get the memory, in bytes, allocated and peaked by each stage. Empty unless report_memory was set to True.
+        """
+        return self.stage_memory
+
+    def get_tailgating_parameters(self, image_name: str):
+        """
+        Get tailgating parameters for a specific image.
+        """
+        return self.tailgating_parameters.get(image_name, None)
+
+    def calculate_perpendicular_distance(self, rear, front):
+        """
+        Distance between each front car and the direction of motion of the corresponding rear car, using the same
+        arithmetic as TailgateDetector.calculate_perpendicular_distance
+        """
+        x1, z1 = self.cars.x[rear], self.cars.z[rear]
+        x2, z2 = self.cars.x[front], self.cars.z[front]
+        dx1 = np.cos(-self.rotation_y[rear])
+        dz1 = np.sin(-self.rotation_y[rear])
+
+        dot_product = (x2 - x1) * dx1 + (z2 - z1) * dz1
+        projection_x = x1 + dot_product * dx1
+        projection_z = z1 + dot_product * dz1
+
+        return np.sqrt((x2 - projection_x) ** 2 + (z2 - projection_z) ** 2)
+
+    def calculate_distance_along_direction(self, rear, front):
+        """
+        Distance along the direction of motion of each rear car to the corresponding front car
+        """
+        dx1 = np.cos(-self.rotation_y[rear])
+        dz1 = np.sin(-self.rotation_y[rear])
+
+        return (self.cars.x[front] - self.cars.x[rear]) * dx1 + (self.cars.z[front] - self.cars.z[rear]) * dz1
+
+    @staticmethod
+    def calculate_rotational_difference(angle1_rad, angle2_rad):
+        """
+        Smallest angle between the two directions of motion, following helper_functions.angles_between_angles_radians
+        """
+        angle_radians_1, angle_radians_2 = angles_between_angles_radians(angle1_rad, angle2_rad)
+
+        # Same tie and NaN behaviour as the builtin min used by TailgateDetector
+        return np.where(angle_radians_2 < angle_radians_1, angle_radians_2, angle_radians_1)
+
+    def _reset_parameters(self, pairs, columns: dict):
+        """ Replaces the parameter rows, as the filters of TailgateDetector replace tailgating_parameters. """
+        self._parameter_pairs = pairs
+        self._parameter_names = (self.car_rank[self.pair_rear[pairs]], self.car_rank[self.pair_front[pairs]])
+        self._parameter_columns = {name: (values, np.ones(len(pairs), dtype=bool)) for name, values in columns.items()}
+
+    def _set_parameter_column(self, name, rows, values):
+        """ Sets a column for a subset of the parameter rows, the remaining rows will not contain the key. """
+        column = np.zeros(len(self._parameter_pairs), dtype=np.float64)
+        mask = np.zeros(len(self._parameter_pairs), dtype=bool)
+        column[rows] = values
+        mask[rows] = True
+        self._parameter_columns[name] = (column, mask)
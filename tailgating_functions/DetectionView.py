@@ -0,0 +1,56 @@
+try:
+    from collections.abc import Mapping
+    from types import MappingProxyType
+
+except ImportError as e:
+    raise e
+
+
+class DetectionView(Mapping):
+    """
+    Copy-on-write view of a single parsed label (one of the dictionaries produced by LabelLoader). The base label is
+    shared between every stage of the tailgating pipeline and is never modified. Any value assigned to the view, such
+    as a renamed object_type or an inverted rotation_y, is stored in a small overlay dictionary that belongs to the
+    view only. Reading a key returns the overlay value if it exists, otherwise the base value.
+
+    The view behaves like the label dictionary it wraps, so it can be used wherever the labels were used before, e.g.
+    car['coordinates']['x'] or car['rotation_y']. Nested dictionaries (coordinates, 3Dbox_dimensions, bbox) belong to
+    the base label and should be treated as read-only.
+    """
+
+    __slots__ = ('_base', '_overlay')
+
+    def __init__(self, base, overlay: dict = None):
+        self._base = base if isinstance(base, MappingProxyType) else MappingProxyType(base)
+        self._overlay = {} if overlay is None else overlay
+
+    def __getitem__(self, key):
+        if key in self._overlay:
+            return self._overlay[key]
+        return self._base[key]
+
+    def __setitem__(self, key, value):
+        if key not in self._base:
+            raise KeyError(f'{key} is not a field of the label')
+        self._overlay[key] = value
+
+    def __iter__(self):
+        return iter(self._base)
+
+    def __len__(self):
+        return len(self._base)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({dict(self)})'
+
+    def derive(self):
+        """
+        Creates a new view on the same base label, starting from a copy of this view's overlay. Used by each stage
+        instead of a deepcopy, so that edits in one stage are not visible to the previous ones.
+        """
+        return DetectionView(self._base, dict(self._overlay))
+
+    @property
+    def overlay(self):
+        """ The values edited by this view, as a read-only mapping. """
+        return MappingProxyType(self._overlay)
@@ -0,0 +1,133 @@
+try:
+    import os
+    import json
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError as e:
+    raise e
+
+
+class DirectoryScanner:
+    """
+    Scans an image directory and a label directory with os.scandir and pairs the images with their labels, yielding
+    (image_name, image_path, label_path) tuples instead of building dictionaries of every path up front.
+
+    If manifest_path is given, the file names found in each directory are stored in a json manifest along with the
+    modification time of the directory. Adding, removing or renaming a file changes the modification time of its
+    directory, so on later runs only the directories whose modification time differs from the manifest are scanned
+    again, which is a single stat per unchanged directory. Modifying the content of a file does not change the
+    directory, which is fine here since only the file names are stored.
+
+    With num_threads > 1 the directories that need scanning are listed concurrently, which helps on network mounted
+    folders where listing is dominated by latency.
+    """
+
+    MANIFEST_VERSION = 1
+
+    def __init__(self, labels_directory: str, image_directory: str, label_format: str = 'txt',
+                 image_format: str = 'png', manifest_path: str = None, num_threads: int = 1):
+        self.label_directory = labels_directory
+        self.image_directory = image_directory
+
+        self.label_extension = f'.{label_format}'
+        self.image_extension = f'.{image_format}'
+
+        self.manifest_path = manifest_path
+        self.num_threads = num_threads
+
+        # Directories that were scanned again by the last call to scan_directories, empty if the manifest was valid
+        self.scanned_directories = []
+
+    def __iter__(self):
+        return self.iter_paths()
+
+    def iter_paths(self, sort_names: bool = False):
+        """
+        Pairs the images with their labels. Images without labels are filtered out.
+        Parameters
+        ----------
+        sort_names: If True the pairs are yielded in increasing order of image name, otherwise in directory order
+
+        Returns
+        -------
+        A generator of (image_name, image_path, label_path) tuples
+        """
+        image_names, label_names = self.scan_directories()
+
+        image_names = set(image_names)
+        names = (name for name in label_names if name in image_names)
+        if sort_names:
+            names = sorted(names)
+
+        for name in names:
+            yield (name, os.path.join(self.image_directory, f'{name}{self.image_extension}'),
+                   os.path.join(self.label_directory, f'{name}{self.label_extension}'))
+
+    def scan_directories(self):
+        """
+        Lists the image and label directories, reusing the manifest for directories that have not changed.
+        Returns
+        -------
+        The image names and the label names (file names without extension)
+        """
+        directories = [(self.image_directory, self.image_extension), (self.label_directory, self.label_extension)]
+        manifest = self._read_manifest()
+
+        names, to_scan = {}, []
+        for directory, extension in directories:
+            key = self._manifest_key(directory, extension)
+            entry = manifest.get(key)
+            mtime_ns = os.stat(directory).st_mtime_ns
+            if entry is not None and entry['mtime_ns'] == mtime_ns:
+                names[key] = entry['names']
+            else:
+                to_scan.append((directory, extension))
+
+        if self.num_threads > 1 and len(to_scan) > 1:
+            with ThreadPoolExecutor(max_workers=self.num_threads) as executor:
+                scanned = list(executor.map(lambda args: self._scan(*args), to_scan))
+        else:
+            scanned = [self._scan(directory, extension) for directory, extension in to_scan]
+
+        for (directory, extension), (mtime_ns, directory_names) in zip(to_scan, scanned):
+            key = self._manifest_key(directory, extension)
+            names[key] = directory_names
+            manifest[key] = {'mtime_ns': mtime_ns, 'names': directory_names}
+
+        self.scanned_directories = [directory for directory, _ in to_scan]
+        if to_scan and self.manifest_path:
+            self._write_manifest(manifest)
+
+        image_key, label_key = (self._manifest_key(directory, extension) for directory, extension in directories)
+        return names[image_key], names[label_key]
+
+    @staticmethod
+    def _scan(directory, extension):
+        # The modification time is taken before listing, so that a file added during the scan invalidates the entry
+        mtime_ns = os.stat(directory).st_mtime_ns
+        with os.scandir(directory) as entries:
+            directory_names = [entry.name[:-len(extension)] for entry in entries
+                               if entry.name.endswith(extension) and entry.is_file()]
+        return mtime_ns, directory_names
+
+    @staticmethod
+    def _manifest_key(directory, extension):
+        return f'{os.path.abspath(directory)}|{extension}'
+
+    def _read_manifest(self):
+        if not self.manifest_path or not os.path.isfile(self.manifest_path):
+            return {}
+        try:
+            with open(self.manifest_path, 'r') as f:
+                manifest = json.load(f)
+        except ValueError:  # Corrupted manifest, scan everything again
+            return {}
+        if manifest.get('version') != self.MANIFEST_VERSION:
+            return {}
+        return manifest['directories']
+
+    def _write_manifest(self, directories):
+        # Write to a temporary file first, so that an interrupted run never leaves a partially written manifest
+        temporary_path = f'{self.manifest_path}.tmp'
+        with open(temporary_path, 'w') as f:
+            json.dump({'version': self.MANIFEST_VERSION, 'directories': directories}, f)
+        os.replace(temporary_path, self.manifest_path)
@@ -0,0 +1,157 @@
+try:
+    import os
+    import hashlib
+    import numpy as np
+
+    from ColumnarDetection import DetectionColumns
+    from LabelLoading import LabelLoader
+    from smoke.utils.kitti_labels import LABEL_DTYPE, OBJECT_TYPES, OBJECT_TYPE_IDS, read_kitti_label_files
+
+except ImportError as e:
+    raise e
+
+
+def label_schema():
+    """
+    Hash of the object types and the record layout of the parsed labels. It is stored in the index, so that a cache
+    written with different object type ids or a different LABEL_DTYPE is rebuilt instead of being misread.
+    """
+    digest = hashlib.sha1(repr((OBJECT_TYPES, LABEL_DTYPE.descr)).encode()).digest()
+    return np.uint64(int.from_bytes(digest[:8], 'little'))
+
+
+class LabelCache:
+    """
+    Binary cache of parsed label files. All label lines of all images are stored as records of a single structured
+    NumPy array (LABEL_DTYPE) saved as a .npy file, along with an index .npy file that holds, for each image, the offset
+    and number of its records, the modification time and size of its label file and the label_schema() it was parsed
+    with. Both files are memory-mapped when loaded, so when none of the label files have changed no text is parsed at
+    all.
+
+    A label file is parsed again if its modification time or size differ from the ones in the index. If any file has
+    changed, been added or been removed, the cache files are rewritten, reusing the records of the unchanged files. If
+    the schema differs, e.g. after the object types were reordered, all label files are parsed again.
+
+    The input is the dictionary of LabelIO.get_inference_dictionary(). The parsed labels are available either in the
+    dictionary format of LabelLoader (get_parsed_data) or as DetectionColumns for ColumnarTailgateDetector
+    (get_columns).
+    """
+
+    def __init__(self, label_mapping: dict, cache_dir: str, cache_name: str = 'label_cache'):
+        self.label_mapping = label_mapping
+
+        self.records_path = os.path.join(cache_dir, f'{cache_name}_labels.npy')
+        self.index_path = os.path.join(cache_dir, f'{cache_name}_index.npy')
+
+        # Number of label files that had to be parsed, 0 if the cache was fully valid
+        self.num_parsed = 0
+
+        self.records, self.index = self.load()
+        self.image_rows = {image_name: row for row, image_name in enumerate(self.index['image_name'].tolist())}
+
+    def load(self):
+        """
+        Loads the cache files, parses any label file that is missing from the cache or has changed, and rewrites the
+        cache files if needed.
+        Returns
+        -------
+        The memory-mapped records and index arrays
+        """
+        cached_records, cached_index = self._read_cache()
+        schema = label_schema()
+        if cached_index is not None and ('schema' not in cached_index.dtype.names or cached_records.dtype != LABEL_DTYPE
+                                         or np.any(cached_index['schema'] != schema)):
+            cached_records, cached_index = None, None
+
+        image_names, label_paths = [], []
+        for image_name, paths in self.label_mapping.items():
+            if paths['label_path']:  # Ensure there is a label path
+                image_names.append(image_name)
+                label_paths.append(paths['label_path'])
+
+        stats = np.array([(stat.st_mtime_ns, stat.st_size) for stat in map(os.stat, label_paths)],
+                         dtype=np.int64).reshape(-1, 2)
+
+        # Fast path, the cache holds the same images in the same order and none of the files has changed
+        if cached_index is not None and cached_index['image_name'].tolist() == image_names and \
+                np.array_equal(cached_index['mtime_ns'], stats[:, 0]) and \
+                np.array_equal(cached_index['size'], stats[:, 1]):
+            return cached_records, cached_index
+
+        cached = {} if cached_index is None else \
+            {image_name: entry for image_name, *entry in cached_index[['image_name', 'offset', 'count', 'mtime_ns',
+                                                                        'size']].tolist()}
+        pieces, changed_pieces, changed_paths = [], [], []
+        for image_name, label_path, (mtime_ns, size) in zip(image_names, label_paths, stats.tolist()):
+            entry = cached.get(image_name)
+            if entry is not None and entry[2:] == [mtime_ns, size]:
+                pieces.append(cached_records[entry[0]:entry[0] + entry[1]])
+            else:
+                changed_pieces.append(len(pieces))
+                changed_paths.append(label_path)
+                pieces.append(None)
+
+        # Parse all new or changed label files at once
+        self.num_parsed = len(changed_paths)
+        records, counts = read_kitti_label_files(changed_paths)
+        for piece, offset, count in zip(changed_pieces, (np.cumsum(counts) - counts).tolist(), counts.tolist()):
+            pieces[piece] = records[offset:offset + count]
+
+        counts = np.array([len(piece) for piece in pieces], dtype=np.int64)
+        index = np.zeros(len(image_names), dtype=[('image_name', f'U{max(map(len, image_names), default=1)}'),
+                                                  ('offset', np.int64), ('count', np.int64),
+                                                  ('mtime_ns', np.int64), ('size', np.int64),
+                                                  ('schema', np.uint64)])
+        index['image_name'] = image_names
+        index['offset'] = np.cumsum(counts) - counts
+        index['count'] = counts
+        index['mtime_ns'], index['size'] = stats.T
+        index['schema'] = schema
+
+        records = np.concatenate(pieces) if pieces else np.zeros(0, dtype=LABEL_DTYPE)
+        self._write_cache(records, index)
+
+        return self._read_cache()
+
+    def get_image_records(self, image_name):
+        """ Returns the records of a specific image, as a view of the memory-mapped records. """
+        row = self.image_rows.get(image_name)
+        if row is None:
+            return None
+        offset, count = self.index['offset'][row], self.index['count'][row]
+        return self.records[offset:offset + count]
+
+    def get_image_data(self, image_name):
+        """ Returns the labels of a specific image in the format of LabelLoader. """
+        records = self.get_image_records(image_name)
+        if records is None:
+            return None
+        return [LabelLoader.parse_record(record) for record in records.tolist()]
+
+    def get_parsed_data(self):
+        """ Returns the labels of all images in the format of LabelLoader.get_parsed_data(). """
+        return {image_name: self.get_image_data(image_name) for image_name in self.image_rows}
+
+    def get_columns(self, object_type: str = 'Car'):
+        """
+        Returns the detections of the chosen object type as DetectionColumns, without going through dictionaries.
+        """
+        image_index = np.repeat(np.arange(len(self.index)), self.index['count'])
+        selected = np.flatnonzero(self.records['object_type'] == OBJECT_TYPE_IDS[object_type])
+        records = self.records[selected]
+
+        return DetectionColumns(self.index['image_name'].tolist(), image_index[selected], records['x'], records['y'],
+                                records['z'], records['rotation_y'], records['height'], records['width'],
+                                records['length'])
+
+    def _read_cache(self):
+        if not (os.path.isfile(self.records_path) and os.path.isfile(self.index_path)):
+            return None, None
+        return np.load(self.records_path, mmap_mode='r'), np.load(self.index_path, mmap_mode='r')
+
+    def _write_cache(self, records, index):
+        # Write to temporary files first, so that an interrupted run never leaves a partially written cache
+        for path, array in ((self.records_path, records), (self.index_path, index)):
+            temporary_path = f'{path}.tmp.npy'
+            np.save(temporary_path, array)
+            os.replace(temporary_path, path)
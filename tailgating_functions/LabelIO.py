@@ -1,5 +1,7 @@
 try:
     import os
+
+    from DirectoryScanner import DirectoryScanner
 except ImportError as e:
     raise e
 
@@ -9,15 +11,24 @@ class LabelIO:
     This class loads the paths to the images used throughout car detection inference, as well as the corresponding
     labels generated by the network. The output is a dictionary which includes the image names, the paths to each
     image and the corresponding label. Images without labels are filtered out
+
+    The directories are listed by a DirectoryScanner. Passing a manifest_path stores the listing so that later runs
+    only list the directories that have changed, and num_threads > 1 lists both directories concurrently. To go
+    through the (image_name, image_path, label_path) tuples without building the dictionary, use iter_paths of
+    DirectoryScanner directly.
     """
     def __init__(self, labels_directory: str, image_directory: str, label_format: str = 'txt',
-                 image_format: str = 'png'):
+                 image_format: str = 'png', manifest_path: str = None, num_threads: int = 1):
         self.label_directory = labels_directory
         self.image_directory = image_directory
 
         self.label_format = label_format
         self.image_format = image_format
 
+        self.scanner = DirectoryScanner(labels_directory, image_directory, label_format=label_format,
+                                        image_format=image_format, manifest_path=manifest_path,
+                                        num_threads=num_threads)
+
         self.label_paths = {}  # initialise dictionary that will contain label paths
         self.image_paths = {}  # same for iamge paths
 
@@ -26,16 +37,13 @@ class LabelIO:
         self.valid_image_names = list(self.inference_data_dict.keys())  # List of valid image names
         self.valid_image_names.sort()  # make sure to sort in increasing order
 
-    def _load_paths(self, directory, file_extension):
-        """ Load and return a dictionary of filenames (without extension)"""
-        files = os.listdir(directory)
-        return {os.path.splitext(f)[0]: os.path.join(directory, f) for f in files if f.endswith(file_extension)}
-
     def _create_mapping(self):
         """ Create a mapping of image names to their corresponding image and label paths. """
-        self.image_paths = self._load_paths(self.image_directory,
-                                            f'.{self.image_format}')  # Adjust the extension as needed
-        self.label_paths = self._load_paths(self.label_directory, f'.{self.label_format}')
+        image_names, label_names = self.scanner.scan_directories()
+        self.image_paths = {name: os.path.join(self.image_directory, f'{name}.{self.image_format}')
+                            for name in image_names}
+        self.label_paths = {name: os.path.join(self.label_directory, f'{name}.{self.label_format}')
+                            for name in label_names}
 
         # Once the paths are loaded, ensure that all images have corresponding labels, and reject the ones who dont
         output_dir = {name: {'image_path': img_path, 'label_path': self.label_paths.get(name)} for name, img_path in
@@ -44,6 +52,12 @@ class LabelIO:
 
         return output_dir
 
+    def iter_paths(self):
+        """ Iterate over (image_name, image_path, label_path) tuples of the valid images, in sorted order. """
+        for name in self.valid_image_names:
+            paths = self.inference_data_dict[name]
+            yield name, paths['image_path'], paths['label_path']
+
     def get_image_label_paths(self, image_name):
         """ Retrieve image and label paths using the image name. """
         return self.inference_data_dict.get(image_name)
@@ -1,5 +1,8 @@
 try:
     import os
+    import numpy as np
+
+    from smoke.utils.kitti_labels import OBJECT_TYPES, read_kitti_label_file, read_kitti_label_files
 except ImportError as e:
     raise e
 
@@ -34,15 +37,25 @@ class LabelLoader:
         self.label_data = self.process_labels()  # Dictionary of all labels
 
     def process_labels(self):
-        data = {}
-        for image_name, paths in self.label_mapping.items():
-            if paths['label_path']:  # Ensure there is a label path
-                with open(paths['label_path'], 'r') as file:
-                    detections = [self.parse_line(line.strip()) for line in file if line.strip()]
-                data[image_name] = detections
-        return data
-
-    def parse_line(self, line):
+        # Ensure there is a label path
+        mapping = {image_name: paths['label_path'] for image_name, paths in self.label_mapping.items()
+                   if paths['label_path']}
+
+        # Parse all label files at once, then split the records back per image
+        records, counts = read_kitti_label_files(mapping.values())
+        detections = [self.parse_record(record) for record in records.tolist()]
+        offsets = np.cumsum(counts) - counts
+
+        return {image_name: detections[offset:offset + count]
+                for image_name, offset, count in zip(mapping, offsets.tolist(), counts.tolist())}
+
+    @staticmethod
+    def load_label_file(label_path):
+        """ Reads a single label file and returns the list of parsed detections. """
+        return [LabelLoader.parse_record(record) for record in read_kitti_label_file(label_path).tolist()]
+
+    @staticmethod
+    def parse_line(line):
         fields = line.split()
         return {
             'object_type': fields[0],
@@ -55,6 +68,22 @@ class LabelLoader:
             'rotation_y': float(fields[14])
         }
 
+    @staticmethod
+    def parse_record(record):
+        """ Same as parse_line, for a record of smoke.utils.kitti_labels.LABEL_DTYPE converted to a tuple. """
+        (object_type, truncation, occlusion, alpha, left, top, right, bottom, height, width, length,
+         x, y, z, rotation_y, score) = record
+        return {
+            'object_type': OBJECT_TYPES[object_type],
+            'truncation': truncation,
+            'occlusion': occlusion,
+            'alpha': alpha,
+            'bbox': [left, top, right, bottom],
+            '3Dbox_dimensions': {'height': height, 'width': width, 'length': length},
+            'coordinates': {'x': x, 'y': y, 'z': z},
+            'rotation_y': rotation_y
+        }
+
     def get_image_data(self, image_name):
         """ Returns the processed label data for a specific image. """
         return self.label_data.get(image_name, None)
@@ -2,9 +2,10 @@ try:
     import os
     import matplotlib.pyplot as plt
     import numpy as np
-    import copy
 
-    from helper_functions import angles_between_angles_radians, calculate_max_speed_difference_two_second_rule
+    from DetectionView import DetectionView
+    from helper_functions import angles_between_angles_radians, calculate_max_speed_difference_two_second_rule, \
+        find_leading_cars, track_stage_memory
 
 except ImportError as e:
     raise e
@@ -19,10 +20,18 @@ class TailgateDetector:
     1) All detected cars are moving away from the camera
     2) There are no stationary cars, since each image is a unique instance, the distances between cars are all examined
     3) Velocities are not considered, instead the maximum speed difference between cars is calculated
+
+    The input labels are never copied or modified. Each stage wraps them in DetectionView objects, which store the
+    values edited by the stage (e.g. the renamed object_type or the inverted rotation_y) in a small overlay. Setting
+    report_memory to True stores the memory used by each stage in self.stage_memory.
     """
-    def __init__(self, labeled_data):
+    def __init__(self, labeled_data, report_memory: bool = False):
         self.labeled_data = labeled_data
 
+        # Memory used by each stage in bytes, only populated if report_memory is True
+        self.report_memory = report_memory
+        self.stage_memory = {}
+
         # Create a dictionary that includes the car labels in arrange form, from lower Z (i.e. nearest to the camera)
         self.arranged_labels = self.arranged_cars()
 
@@ -30,6 +39,9 @@ class TailgateDetector:
         # have 2 cases, since these are the possible tailgating events that should be explored
         self.paired_data = {}
 
+        # Cars with no car ahead of them, only populated by find_cases_indexed
+        self.unpaired_cars = {}
+
         # Create the final 2 dictionaries, one containing the cases of tailgating, the other used to store the
         # parameters of tailgating situations
         # Initialize tailgating_cases as a copy of paired_data
@@ -38,6 +50,7 @@ class TailgateDetector:
         # Initialize tailgating_parameters dictionary
         self.tailgating_parameters = {}
 
+    @track_stage_memory
     def arranged_cars(self):
         """
         Arrange cars in each image by their Z coordinate and rename them as Car1, Car2, Car3, etc. The car with
@@ -50,23 +63,18 @@ class TailgateDetector:
         """
         arranged_labels = {}
 
-        # Make a copy of the original labeled_data dictionary
-        labeled_data_copy = copy.deepcopy(self.labeled_data)
-
-        for image_name, labels in labeled_data_copy.items():
+        for image_name, labels in self.labeled_data.items():
             # Filter out pedestrians and cyclists, and sort cars by Z coordinate
             cars = [obj for obj in labels if obj['object_type'] == 'Car']
             cars.sort(key=lambda x: x['coordinates']['z'])
 
-            # Rename cars as Car1, Car2, Car3, etc.
-            for i, car in enumerate(cars, start=1):
-                car['object_type'] = 'Car{}'.format(i)
-
-            # Add arranged labels to the dictionary
-            arranged_labels[image_name] = cars
+            # Rename cars as Car1, Car2, Car3, etc. The new name is stored in the view, not in the original label
+            arranged_labels[image_name] = [DetectionView(car, {'object_type': 'Car{}'.format(i)})
+                                           for i, car in enumerate(cars, start=1)]
 
         return arranged_labels
 
+    @track_stage_memory
     def find_cases(self):
         """
         Following the arranging of cars in increasing Z, this method splits the cars of each image into pairs. For
@@ -78,11 +86,10 @@ class TailgateDetector:
         Updates self.paired_data
         """
 
-        # Make a copy of the original labeled_data dictionary
-        labeled_data_copy = copy.deepcopy(self.arranged_labels)
+        # Iterate over each image in the arranged_labels dictionary, using new views of the arranged cars
+        for image_name, arranged in self.arranged_labels.items():
+            data = [car.derive() for car in arranged]
 
-        # Iterate over each image in the arranged_labels dictionary
-        for image_name, data in labeled_data_copy.items():
             # Initialize a list to store tailgating cases for the current image
             cases = []
 
@@ -109,6 +116,33 @@ class TailgateDetector:
             # Update the paired_data dictionary with the paired data for the current image
             self.paired_data[image_name] = cases
 
+    @track_stage_memory
+    def find_cases_indexed(self, lateral_threshold: float = 3.5):
+        """
+        Indexed alternative to find_cases. Each car is paired with the nearest car ahead of it along its direction of
+        motion, found with a grid over the ground plane (see find_leading_cars) rather than by comparing every pair of
+        cars in a loop. Only cars that are ahead (positive distance along the direction of motion) and within
+        lateral_threshold of the direction of motion are considered, so a pair never has a negative distance. Cars with
+        no car ahead are not paired, and are stored in self.unpaired_cars instead.
+
+        Each pair holds its own views of the two cars, since a car can be the car ahead of several others.
+        Parameters
+        ----------
+        lateral_threshold: A float, in meters, the maximum perpendicular distance of the car ahead
+
+        Returns
+        -------
+        Updates self.paired_data and self.unpaired_cars
+        """
+        for image_name, arranged in self.arranged_labels.items():
+            leaders, _ = find_leading_cars([car['coordinates']['x'] for car in arranged],
+                                           [car['coordinates']['z'] for car in arranged],
+                                           [car['rotation_y'] for car in arranged], lateral_threshold)
+
+            self.paired_data[image_name] = [(arranged[i].derive(), arranged[j].derive())
+                                            for i, j in enumerate(leaders.tolist()) if j >= 0]
+            self.unpaired_cars[image_name] = [arranged[i].derive() for i in np.flatnonzero(leaders < 0).tolist()]
+
     @staticmethod
     def calculate_distance_along_direction(car1, car2):
         """
@@ -127,6 +161,7 @@ class TailgateDetector:
 
         return distance_along_direction
 
+    @track_stage_memory
     def find_cases_along_Z(self):
         """
         Following the arranging of cars in increasing Z, this method splits the cars of each image into pairs. For
@@ -137,10 +172,9 @@ class TailgateDetector:
         Updates self.paired_data
         """
 
-        # Make a copy of the original labeled_data dictionary
-        labeled_data_copy = copy.deepcopy(self.arranged_labels)
-
-        for image_name, cars in labeled_data_copy.items():
+        for image_name, arranged in self.arranged_labels.items():
+            # New views of the arranged cars, shared by the consecutive pairs of the image
+            cars = [car.derive() for car in arranged]
             cases = []
 
             # Iterate through the cars to find tailgating cases
@@ -161,6 +195,7 @@ class TailgateDetector:
         """
         self.tailgating_cases = self.paired_data.copy()
 
+    @track_stage_memory
     def filter_direction_of_motion(self):
         """
         This function edits self.tailgating_cases dictionary. When the dictionary is first created, it is a copy of
@@ -186,6 +221,7 @@ class TailgateDetector:
                 case[0]['rotation_y'] = car1_rotation
                 case[1]['rotation_y'] = car2_rotation
 
+    @track_stage_memory
     def filter_tailgating_by_lane(self, threshold: float):
         """
         Filter tailgating cases based on the lane alignment of cars. Specifically, in a pair of cars, the one furthest
@@ -246,6 +282,7 @@ class TailgateDetector:
         self.tailgating_cases = filtered_tailgating_cases
         self.tailgating_parameters = filtered_tailgating_parameters
 
+    @track_stage_memory
     def filter_by_relative_rotation(self, angular_threshold: float = np.pi / 4):
         """
         Compares the direction of motion of two cars, and if the angle between the two vectors exceeds the angular
@@ -308,6 +345,7 @@ class TailgateDetector:
         self.tailgating_cases = filtered_tailgating_cases
         self.tailgating_parameters = filtered_tailgating_parameters
 
+    @track_stage_memory
     def detect_tailgating_distance(self):
         """
         Calculate the distance between Car1 and the projection of Car2 on the direction of motion of Car1.
@@ -328,9 +366,14 @@ class TailgateDetector:
                 # Append the updated parameters to the tailgating_parameters dictionary
                 self.tailgating_parameters[image_name][i - 1].update(params)
 
-    def calculate_tailgating_speed_limits(self):
+    @track_stage_memory
+    def calculate_tailgating_speed_limits(self, time_gap_seconds: float = 2):
         """
         Used to calculate the maximum speed difference between two cars, above which tailgating occurs
+        Parameters
+        ----------
+        time_gap_seconds: The minimum allowable time gap between two cars, 2 seconds for the 2 second rule
+
         Returns
         -------
         updates self.tailgating_parameters
@@ -342,7 +385,8 @@ class TailgateDetector:
                 if 'current_distance' in pair_data:
                     # Calculate the maximum speed difference
                     tailgating_distance = pair_data['current_distance']
-                    max_speed_difference_kmh = calculate_max_speed_difference_two_second_rule(tailgating_distance)
+                    max_speed_difference_kmh = calculate_max_speed_difference_two_second_rule(tailgating_distance,
+                                                                                              time_gap_seconds)
 
                     # Update the entry with the maximum speed difference
                     pair_data['max_speed_difference_kmh'] = max_speed_difference_kmh
@@ -352,6 +396,12 @@ class TailgateDetector:
         # Update self.tailgating_parameters with the modified data
         self.tailgating_parameters = updated_parameters
 
+    def get_stage_memory(self):
+        """
+        Get the memory, in bytes, allocated and peaked by each stage. Empty unless report_memory was set to True.
+        """
+        return self.stage_memory
+
     def get_paired_cases(self, image_name: str):
         """
         Get tailgating cases for a specific image.
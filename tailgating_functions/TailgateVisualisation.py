@@ -3,6 +3,8 @@ try:
     import matplotlib.pyplot as plt
     import numpy as np
 
+    from BEVRendering import BEVRenderer
+    from helper_functions import car_boxes_in_BEV
     from TailgateDetection import TailgateDetector
 
 except ImportError as e:
@@ -15,8 +17,8 @@ class TailgateVisualisation(TailgateDetector):
     bounding boxes.
     """
 
-    def __init__(self, labeled_data):
-        super().__init__(labeled_data)
+    def __init__(self, labeled_data, report_memory: bool = False):
+        super().__init__(labeled_data, report_memory=report_memory)
 
         # Define the lists that will be populated in each image for plotting (and reset in each method) that will
         # contain the necessary parameters for plotting
@@ -468,6 +470,31 @@ class TailgateVisualisation(TailgateDetector):
         plt.tight_layout()
         plt.show()
 
+    def render_BEV_images(self, image_names: list = None, output_dir: str = None, arranged: bool = False,
+                          renderer: BEVRenderer = None):
+        """
+        Headless alternative to plot_BEV_vectors and plot_BEV_arranged for batch jobs. The images are rendered with a
+        BEVRenderer, which reuses a single Agg canvas and draws all cars of an image with one call per artist, instead
+        of opening a pyplot figure per image.
+
+        Parameters
+        ----------
+        image_names: The images to render, all images by default
+        output_dir: If given, each figure is written to output_dir/image_name.png
+        arranged: Set to true to colour the cars by their distance from the camera, as in plot_BEV_arranged
+        renderer: The BEVRenderer to use, e.g. to change the figure size. A new one is created by default
+
+        Returns
+        -------
+        A generator of (image_name, RGB array) tuples
+        """
+        labels = self.arranged_labels if arranged else self.labeled_data
+        image_names = list(labels) if image_names is None else image_names
+        renderer = BEVRenderer() if renderer is None else renderer
+
+        return renderer.render_images(((image_name, labels.get(image_name, [])) for image_name in image_names),
+                                      output_dir=output_dir, color_by_rank=arranged)
+
     @staticmethod
     def define_car_boxes_in_BEV(x, z, length, width, rotation_y):
         """
@@ -485,20 +512,7 @@ class TailgateVisualisation(TailgateDetector):
         rotated_corners: Numpy array that includes the locations of the four corners of the car following rotation
         """
 
-        car_center = np.array([x, z])
-        # Calculate corner points of the bounding box
-        corners = np.array([
-            [-length / 2, -width / 2],  # Front-left
-            [length / 2, -width / 2],  # Front-right
-            [length / 2, width / 2],  # Back-right
-            [-length / 2, width / 2],  # Back-left
-        ])
-        # Rotate the corners based on the rotation angle
-        rotation_matrix = np.array([
-            [np.cos(-rotation_y), -np.sin(-rotation_y)],
-            [np.sin(-rotation_y), np.cos(-rotation_y)]
-        ])
-        rotated_corners = np.dot(corners, rotation_matrix.T) + car_center
+        rotated_corners = car_boxes_in_BEV(x, z, length, width, rotation_y)[0]
 
         return rotated_corners
 
@@ -0,0 +1,98 @@
+try:
+    import os
+    import multiprocessing
+    import numpy as np
+
+    from ColumnarDetection import ColumnarTailgateDetector
+    from LabelIO import LabelIO
+    from LabelLoading import LabelLoader
+
+except ImportError as e:
+    raise e
+
+
+def _process_shard(shard):
+    """
+    Worker function, parses the labels of one shard of images and runs the tailgating detection on them. Defined at
+    module level so that it can be sent to the worker processes.
+    Parameters
+    ----------
+    shard: A tuple of a list of (image_name, label_path) tuples, the distance threshold and the angular threshold
+
+    Returns
+    -------
+    A list of (image_name, tailgating_parameters) tuples, in the order of the shard
+    """
+    paths, distance_threshold, angular_threshold = shard
+
+    labeled_data = {image_name: LabelLoader.load_label_file(label_path) for image_name, label_path in paths}
+    detector = ColumnarTailgateDetector(labeled_data=labeled_data)
+
+    return list(detector.run(distance_threshold=distance_threshold, angular_threshold=angular_threshold).items())
+
+
+class ParallelTailgatingRunner:
+    """
+    Runs the tailgating analysis (label parsing, arranged_cars through calculate_tailgating_speed_limits) over a pool
+    of processes. The valid image names of a LabelIO instance are split into shards of chunk_size images, each shard is
+    processed independently by a worker and the results are streamed back as the shards finish.
+
+    If ordered is True, the results are returned in the order of LabelIO.valid_image_names, otherwise in the order the
+    shards complete, which avoids waiting on slow shards. In both cases the merged dictionary has the same content as
+    TailgateDetector.tailgating_parameters.
+    """
+
+    def __init__(self, label_io: LabelIO, distance_threshold: float = 1, angular_threshold: float = np.pi / 6,
+                 num_workers: int = None, chunk_size: int = 256, ordered: bool = True):
+        self.label_io = label_io
+
+        self.distance_threshold = distance_threshold
+        self.angular_threshold = angular_threshold
+
+        self.num_workers = num_workers if num_workers is not None else os.cpu_count()
+        self.chunk_size = chunk_size
+        self.ordered = ordered
+
+        # Populated by run()
+        self.tailgating_parameters = {}
+
+    def shards(self):
+        """
+        Splits the valid image names into shards of chunk_size images.
+        Returns
+        -------
+        A generator of (paths, distance_threshold, angular_threshold) tuples, as expected by the workers
+        """
+        image_names = self.label_io.get_valid_image_names()
+        for start in range(0, len(image_names), self.chunk_size):
+            paths = [(image_name, self.label_io.get_image_label_paths(image_name)['label_path'])
+                     for image_name in image_names[start:start + self.chunk_size]]
+            yield paths, self.distance_threshold, self.angular_threshold
+
+    def iter_results(self):
+        """
+        Processes the shards in the pool and yields the results of each image as soon as its shard is finished.
+        Returns
+        -------
+        A generator of (image_name, tailgating_parameters) tuples
+        """
+        with multiprocessing.Pool(processes=self.num_workers) as pool:
+            pool_map = pool.imap if self.ordered else pool.imap_unordered
+            for shard_results in pool_map(_process_shard, self.shards()):
+                yield from shard_results
+
+    def run(self):
+        """
+        Processes all shards and merges the results.
+        Returns
+        -------
+        The tailgating_parameters dictionary, with image names as keys and a list of car pair parameters as values
+        """
+        self.tailgating_parameters = dict(self.iter_results())
+        return self.tailgating_parameters
+
+    def get_tailgating_parameters(self, image_name: str):
+        """
+        Get tailgating parameters for a specific image.
+        """
+        return self.tailgating_parameters.get(image_name, None)
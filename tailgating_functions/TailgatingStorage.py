@@ -25,3 +25,34 @@ class TailgatingParametersCSVWriter:
             for image_name, data_list in self.tailgating_parameters.items():
                 for data in data_list:
                     writer.writerow(data)
+
+
+class TailgatingParametersStreamWriter:
+    """
+    Writes tailgating parameters to a csv one image at a time, so the parameters of all images never need to be held in
+    memory. Since the parameter names cannot be collected up front, the columns are fixed to the parameters produced by
+    the pipeline of Tailgating_main.py, plus the name of the image each pair belongs to. Use as a context manager.
+    """
+    FIELDNAMES = ['image_name', 'angular_threshold_between_cars', 'current_distance', 'max_speed_difference_kmh',
+                  'pair', 'possible_tailgating', 'rotational_difference']
+
+    def __init__(self, output_dir: str, filename: str, fieldnames: list = None):
+        self.output_path = f"{output_dir}/{filename}.csv"
+        self.fieldnames = fieldnames if fieldnames is not None else self.FIELDNAMES
+
+        self.file = None
+        self.writer = None
+
+    def __enter__(self):
+        self.file = open(self.output_path, mode='w', newline='')
+        self.writer = csv.DictWriter(self.file, fieldnames=self.fieldnames, extrasaction='ignore')
+        self.writer.writeheader()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.file.close()
+
+    def write_image(self, image_name: str, data_list: list):
+        """ Writes one row per car pair of the image. """
+        for data in data_list:
+            self.writer.writerow({'image_name': image_name, **data})
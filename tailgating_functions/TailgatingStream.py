@@ -0,0 +1,116 @@
+try:
+    import numpy as np
+
+    from ColumnarDetection import ColumnarTailgateDetector
+    from DirectoryScanner import DirectoryScanner
+    from LabelLoading import LabelLoader
+    from TailgatingStorage import TailgatingParametersStreamWriter
+
+except ImportError as e:
+    raise e
+
+
+class TailgatingStream:
+    """
+    Generator based version of the tailgating pipeline, for prediction directories that are too large to be loaded in
+    memory by LabelIO and LabelLoader. Each stage is a generator that consumes the previous one:
+
+    1) scan: finds the label files that have a corresponding image
+    2) parse: reads each label file into the LabelLoader dictionary format
+    3) detect: groups chunk_size images and runs ColumnarTailgateDetector on them (arrange, pair, filter, distance and
+       speed), yielding the tailgating parameters of each image
+
+    Iterating over the class yields (image_name, tailgating_parameters) tuples, with the parameters being identical to
+    the per image entries of TailgateDetector.tailgating_parameters. At most chunk_size images are held in memory.
+    """
+
+    def __init__(self, labels_directory: str, image_directory: str, distance_threshold: float = 1,
+                 angular_threshold: float = np.pi / 6, chunk_size: int = 1024, label_format: str = 'txt',
+                 image_format: str = 'png', sort_names: bool = False, manifest_path: str = None,
+                 num_threads: int = 1):
+        self.label_directory = labels_directory
+        self.image_directory = image_directory
+
+        self.distance_threshold = distance_threshold
+        self.angular_threshold = angular_threshold
+
+        self.chunk_size = chunk_size
+        self.label_format = label_format
+        self.image_format = image_format
+
+        # Sorting requires holding all the image names (not their labels) in memory, so it is optional
+        self.sort_names = sort_names
+
+        # Lists the directories, optionally reusing a manifest of a previous run, see DirectoryScanner
+        self.scanner = DirectoryScanner(labels_directory, image_directory, label_format=label_format,
+                                        image_format=image_format, manifest_path=manifest_path,
+                                        num_threads=num_threads)
+
+    def __iter__(self):
+        return self.detect(self.parse(self.scan()))
+
+    def scan(self):
+        """
+        Scans the label directory and yields the labels that have a corresponding image.
+        Returns
+        -------
+        A generator of (image_name, image_path, label_path) tuples
+        """
+        return self.scanner.iter_paths(sort_names=self.sort_names)
+
+    @staticmethod
+    def parse(paths):
+        """
+        Parses the label file of each scanned image.
+        Parameters
+        ----------
+        paths: An iterable of (image_name, image_path, label_path) tuples
+
+        Returns
+        -------
+        A generator of (image_name, detections) tuples, with detections in the format of LabelLoader
+        """
+        for image_name, image_path, label_path in paths:
+            yield image_name, LabelLoader.load_label_file(label_path)
+
+    def detect(self, parsed):
+        """
+        Runs the tailgating detection on chunks of chunk_size images.
+        Parameters
+        ----------
+        parsed: An iterable of (image_name, detections) tuples
+
+        Returns
+        -------
+        A generator of (image_name, tailgating_parameters) tuples
+        """
+        chunk = {}
+        for image_name, detections in parsed:
+            chunk[image_name] = detections
+            if len(chunk) >= self.chunk_size:
+                yield from self._detect_chunk(chunk)
+                chunk = {}
+
+        if chunk:
+            yield from self._detect_chunk(chunk)
+
+    def write_to_csv(self, output_dir: str, filename: str):
+        """
+        Runs the whole pipeline and writes the tailgating parameters of every image to a csv as they are produced.
+        Returns
+        -------
+        The number of images processed
+        """
+        num_images = 0
+        with TailgatingParametersStreamWriter(output_dir, filename) as writer:
+            for image_name, parameters in self:
+                writer.write_image(image_name, parameters)
+                num_images += 1
+
+        return num_images
+
+    def _detect_chunk(self, chunk: dict):
+        detector = ColumnarTailgateDetector(labeled_data=chunk)
+        parameters = detector.run(distance_threshold=self.distance_threshold,
+                                  angular_threshold=self.angular_threshold)
+        yield from parameters.items()
@@ -0,0 +1,303 @@
+try:
+    import math
+    import numpy as np
+
+    from helper_functions import angles_between_angles_radians, calculate_max_speed_difference_two_second_rule, \
+        find_leading_cars
+
+except ImportError as e:
+    raise e
+
+
+class TailgatingTracker:
+    """
+    Tracks cars over consecutive frames of a video sequence (e.g. the raw drive frames converted by
+    parse_raw_to_KITTI_form.py) and turns the per frame car pairs into tailgating events. Unlike TailgateDetector,
+    which treats every image independently and only computes the maximum speed difference allowed by the two second
+    rule, the tracker estimates the velocity of every car and therefore the actual relative speed of each pair.
+
+    Each frame is processed incrementally by update():
+
+    1) predict: a constant velocity Kalman filter predicts the BEV position (x, z) of every track, all tracks being
+       stored as arrays and predicted in a single vectorised step
+    2) associate: the cars of the frame are hashed into a grid of max_distance cells, so each track is only compared
+       with the cars of its neighbouring cells, and the candidate matches are assigned greedily by increasing distance
+    3) update: matched tracks are corrected with their detection, unmatched detections start new tracks and tracks
+       missed for more than max_missed frames are dropped
+    4) pair: each confirmed track is paired with the nearest track ahead of it in the same lane (find_leading_cars),
+       pairs whose directions of motion differ by more than angular_threshold are discarded
+    5) events: a pair is tailgating when the rear car closes in on the front car faster than the two second rule
+       allows, i.e. the relative speed exceeds distance / time_gap. Consecutive tailgating frames of the same pair form
+       an event with a start and an end frame
+
+    The velocities are relative to the camera, which is enough for the relative speed of two cars.
+    """
+
+    def __init__(self, frame_rate: float = 10, distance_threshold: float = 1, angular_threshold: float = np.pi / 6,
+                 time_gap: float = 2, max_distance: float = 3, max_missed: int = 2, min_hits: int = 3,
+                 measurement_noise: float = 0.5, acceleration_noise: float = 2):
+        self.frame_rate = frame_rate
+
+        self.distance_threshold = distance_threshold  # Lane threshold in meters, as in filter_tailgating_by_lane
+        self.angular_threshold = angular_threshold  # As in filter_by_relative_rotation
+        self.time_gap = time_gap  # Seconds of the two second rule
+
+        self.max_distance = max_distance  # Maximum distance in meters between a predicted track and its detection
+        self.max_missed = max_missed  # Number of frames a track is kept without detections
+        self.min_hits = min_hits  # Number of detections before a track is used for pairing
+
+        self.measurement_noise = measurement_noise  # Standard deviation of the detected positions, in meters
+        self.acceleration_noise = acceleration_noise  # Standard deviation of the accelerations, in m/s^2
+
+        # Tracks, one row per track. The state is x, z, vx, vz
+        self.track_ids = np.empty(0, dtype=np.int64)
+        self.states = np.empty((0, 4))
+        self.covariances = np.empty((0, 4, 4))
+        self.rotations = np.empty(0)
+        self.hits = np.empty(0, dtype=np.int64)
+        self.missed = np.empty(0, dtype=np.int64)
+        self.next_track_id = 1
+
+        self.frame_index = -1
+        self.frame_name = None
+
+        # Ongoing events, keyed by (rear track id, front track id), and the finished events
+        self.open_events = {}
+        self.events = []
+
+    def run(self, labeled_data: dict, frame_names: list = None):
+        """
+        Processes a whole sequence and closes the remaining events.
+        Parameters
+        ----------
+        labeled_data: The parsed labels of each frame, as in LabelLoader.get_parsed_data()
+        frame_names: The frames in temporal order, defaults to the sorted keys of labeled_data
+
+        Returns
+        -------
+        The list of tailgating events
+        """
+        frame_names = sorted(labeled_data) if frame_names is None else frame_names
+        for frame_index, frame_name in enumerate(frame_names):
+            self.update(labeled_data[frame_name], frame_index=frame_index, frame_name=frame_name)
+
+        return self.finish()
+
+    def update(self, detections: list, frame_index: int = None, frame_name: str = None):
+        """
+        Processes the detections of the next frame.
+        Parameters
+        ----------
+        detections: The parsed labels of the frame, in the format of LabelLoader. Only cars are tracked
+        frame_index: Index of the frame in the sequence, used to compute the elapsed time when frames are skipped.
+                     Defaults to the frame after the previous one
+        frame_name: Name of the frame (e.g. the image name), stored in the events
+
+        Returns
+        -------
+        A list with the parameters of every car pair of the frame
+        """
+        frame_index = self.frame_index + 1 if frame_index is None else frame_index
+        dt = (frame_index - self.frame_index) / self.frame_rate if self.frame_index >= 0 else 0
+        self.frame_index, self.frame_name = frame_index, frame_name
+
+        cars = [obj for obj in detections if obj['object_type'] == 'Car']
+        positions = np.array([(car['coordinates']['x'], car['coordinates']['z']) for car in cars],
+                             dtype=np.float64).reshape(-1, 2)
+        rotations = np.array([car['rotation_y'] for car in cars], dtype=np.float64)
+
+        self._predict(dt)
+        track_rows, detection_rows = self._associate(positions)
+        self._correct(track_rows, positions[detection_rows], rotations[detection_rows])
+
+        # Tracks that were not matched are kept for max_missed frames, new tracks are started for unmatched detections
+        matched = np.zeros(len(self.track_ids), dtype=bool)
+        matched[track_rows] = True
+        self.missed = np.where(matched, 0, self.missed + 1)
+        self.hits = np.where(matched, self.hits + 1, self.hits)
+        self._remove_tracks(self.missed <= self.max_missed)
+
+        unmatched = np.ones(len(cars), dtype=bool)
+        unmatched[detection_rows] = False
+        self._add_tracks(positions[unmatched], rotations[unmatched])
+
+        pairs = self._pair_tracks()
+        self._update_events(pairs)
+
+        return pairs
+
+    def finish(self):
+        """ Closes the ongoing events, to be called once the last frame has been processed. """
+        self.events.extend(self.open_events.values())
+        self.open_events = {}
+        self.events.sort(key=lambda event: (event['start_frame'], event['rear_track'], event['front_track']))
+
+        return self.events
+
+    def get_events(self):
+        """ Returns the finished events. """
+        return self.events
+
+    def _predict(self, dt):
+        if dt == 0 or not len(self.track_ids):
+            return
+
+        transition = np.eye(4)
+        transition[0, 2] = transition[1, 3] = dt
+
+        # Process noise of a constant velocity model with random accelerations
+        q = self.acceleration_noise ** 2
+        block = np.array([[dt ** 4 / 4, dt ** 3 / 2], [dt ** 3 / 2, dt ** 2]]) * q
+        process_noise = np.zeros((4, 4))
+        process_noise[np.ix_([0, 2], [0, 2])] = block
+        process_noise[np.ix_([1, 3], [1, 3])] = block
+
+        self.states = self.states @ transition.T
+        self.covariances = transition @ self.covariances @ transition.T + process_noise
+
+    def _associate(self, positions):
+        """
+        Greedy association of the predicted tracks with the detections of the frame, within max_distance. The
+        detections are hashed into a grid of max_distance cells, so the number of comparisons grows linearly with the
+        number of detections rather than with the product of tracks and detections.
+        Returns
+        -------
+        The matched track rows and detection rows
+        """
+        if not len(self.track_ids) or not len(positions):
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+        grid = {}
+        for detection, cell in enumerate(map(tuple, np.floor(positions / self.max_distance).astype(np.int64).tolist())):
+            grid.setdefault(cell, []).append(detection)
+
+        candidates = []
+        predicted = self.states[:, :2]
+        cells = np.floor(predicted / self.max_distance).astype(np.int64).tolist()
+        for track, ((x, z), (cell_x, cell_z)) in enumerate(zip(predicted.tolist(), cells)):
+            for neighbour_x in (cell_x - 1, cell_x, cell_x + 1):
+                for neighbour_z in (cell_z - 1, cell_z, cell_z + 1):
+                    for detection in grid.get((neighbour_x, neighbour_z), ()):
+                        distance = math.hypot(positions[detection, 0] - x, positions[detection, 1] - z)
+                        if distance < self.max_distance:
+                            candidates.append((distance, track, detection))
+
+        track_rows, detection_rows = [], []
+        used_tracks, used_detections = set(), set()
+        for distance, track, detection in sorted(candidates):
+            if track not in used_tracks and detection not in used_detections:
+                used_tracks.add(track)
+                used_detections.add(detection)
+                track_rows.append(track)
+                detection_rows.append(detection)
+
+        return np.array(track_rows, dtype=np.int64), np.array(detection_rows, dtype=np.int64)
+
+    def _correct(self, track_rows, positions, rotations):
+        if not len(track_rows):
+            return
+
+        states = self.states[track_rows]
+        covariances = self.covariances[track_rows]
+
+        # The measurement is the position, i.e. the first two elements of the state
+        innovation = positions - states[:, :2]
+        innovation_covariance = covariances[:, :2, :2] + np.eye(2) * self.measurement_noise ** 2
+        gain = covariances[:, :, :2] @ np.linalg.inv(innovation_covariance)
+
+        self.states[track_rows] = states + (gain @ innovation[:, :, None])[:, :, 0]
+        self.covariances[track_rows] = covariances - gain @ covariances[:, :2, :]
+        self.rotations[track_rows] = rotations
+
+    def _add_tracks(self, positions, rotations):
+        num_tracks = len(positions)
+        if not num_tracks:
+            return
+
+        states = np.zeros((num_tracks, 4))
+        states[:, :2] = positions
+
+        # The velocity of a new track is unknown
+        covariance = np.diag([self.measurement_noise ** 2] * 2 + [(self.max_distance * self.frame_rate) ** 2] * 2)
+
+        self.track_ids = np.concatenate((self.track_ids, np.arange(self.next_track_id,
+                                                                   self.next_track_id + num_tracks)))
+        self.states = np.concatenate((self.states, states))
+        self.covariances = np.concatenate((self.covariances, np.broadcast_to(covariance, (num_tracks, 4, 4))))
+        self.rotations = np.concatenate((self.rotations, rotations))
+        self.hits = np.concatenate((self.hits, np.ones(num_tracks, dtype=np.int64)))
+        self.missed = np.concatenate((self.missed, np.zeros(num_tracks, dtype=np.int64)))
+        self.next_track_id += num_tracks
+
+    def _remove_tracks(self, keep):
+        self.track_ids = self.track_ids[keep]
+        self.states = self.states[keep]
+        self.covariances = self.covariances[keep]
+        self.rotations = self.rotations[keep]
+        self.hits = self.hits[keep]
+        self.missed = self.missed[keep]
+
+    def _pair_tracks(self):
+        """
+        Pairs every confirmed track detected in this frame with the nearest confirmed track ahead of it.
+        Returns
+        -------
+        A list with the parameters of each pair
+        """
+        rows = np.flatnonzero((self.missed == 0) & (self.hits >= self.min_hits))
+        if len(rows) < 2:
+            return []
+
+        states, rotations = self.states[rows], self.rotations[rows]
+        leaders, distances = find_leading_cars(states[:, 0], states[:, 1], rotations,
+                                               lateral_threshold=self.distance_threshold)
+        rear = np.flatnonzero(leaders >= 0)
+        front = leaders[rear]
+
+        # Smallest angle between the directions of motion
+        rotation_diff = np.minimum(*angles_between_angles_radians(rotations[rear], rotations[front]))
+        same_direction = rotation_diff < self.angular_threshold
+        rear, front, distances = rear[same_direction], front[same_direction], distances[rear][same_direction]
+
+        # Speed at which the rear car closes in on the front car, along the direction of motion of the rear car
+        heading = np.where(rotations[rear] > 0, rotations[rear] + np.pi, rotations[rear])
+        relative_velocity = states[rear, 2:] - states[front, 2:]
+        relative_speed = relative_velocity[:, 0] * np.cos(-heading) + relative_velocity[:, 1] * np.sin(-heading)
+
+        # Two second rule, the gap must not be closed within time_gap seconds
+        relative_speed_kmh = relative_speed * 3.6
+        max_speed_difference_kmh = calculate_max_speed_difference_two_second_rule(distances, self.time_gap)
+        tailgating = relative_speed_kmh > max_speed_difference_kmh
+
+        pairs = []
+        for rear_id, front_id, distance, speed, max_speed, is_tailgating in zip(
+                self.track_ids[rows[rear]].tolist(), self.track_ids[rows[front]].tolist(), distances.tolist(),
+                relative_speed_kmh.tolist(), max_speed_difference_kmh.tolist(), tailgating.tolist()):
+            pairs.append({'pair': f'Track{rear_id}-Track{front_id}', 'rear_track': rear_id, 'front_track': front_id,
+                          'current_distance': distance, 'relative_speed_kmh': speed,
+                          'max_speed_difference_kmh': max_speed,
+                          'possible_tailgating': 'Yes' if is_tailgating else 'No'})
+
+        return pairs
+
+    def _update_events(self, pairs):
+        ongoing = {}
+        for pair in pairs:
+            if pair['possible_tailgating'] != 'Yes':
+                continue
+
+            key = (pair['rear_track'], pair['front_track'])
+            event = self.open_events.get(key)
+            if event is None:
+                event = {'rear_track': key[0], 'front_track': key[1], 'start_frame': self.frame_index,
+                         'start_frame_name': self.frame_name, 'min_distance': pair['current_distance'],
+                         'max_relative_speed_kmh': pair['relative_speed_kmh']}
+            event['end_frame'] = self.frame_index
+            event['end_frame_name'] = self.frame_name
+            event['min_distance'] = min(event['min_distance'], pair['current_distance'])
+            event['max_relative_speed_kmh'] = max(event['max_relative_speed_kmh'], pair['relative_speed_kmh'])
+            ongoing[key] = event
+
+        # Events of pairs that are no longer tailgating have ended
+        self.events.extend(event for key, event in self.open_events.items() if key not in ongoing)
+        self.open_events = ongoing
@@ -12,8 +12,13 @@ speed difference calculated where applicable.
 
 try:
     import os
+    import sys
     import numpy as np
 
+    # The label parser and the box kernel are shared with the network code (smoke/utils), the repository root is
+    # added to the path so that they are found when this script is run from its directory
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
     from LabelIO import LabelIO
     from LabelLoading import LabelLoader
     from TailgateDetection import TailgateDetector
@@ -79,6 +84,7 @@ def main():
 
     # Split cars into pairs and plot the pairs with direction of motion
     # tailgate_analysis.find_cases()  # Finds pairs of cars based on direction of motion, TODO: complete
+    # tailgate_analysis.find_cases_indexed()  # Pairs each car with the nearest car ahead along its direction of motion
     tailgate_analysis.find_cases_along_Z()  # Detect pairs of cars based on Z distance
     tailgate_analysis.plot_paired_cases(chosen_image)  # Plots subfigures with car pairs
 
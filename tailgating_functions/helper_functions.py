@@ -4,11 +4,22 @@ try:
 
     import numpy as np
     import math
+    import functools
+    import tracemalloc
+
+    from smoke.utils.box3d import bev_corners
 
 except ImportError as e:
     raise e
 
 
+# Types handled by the scalar fast paths, np.float64 is a subclass of float
+_SCALAR_TYPES = (int, float, np.integer, np.floating)
+
+# Up to this number of cars, find_leading_cars compares all pairs of cars at once rather than walking a grid
+_ALL_PAIRS_MAX_CARS = 256
+
+
 def normalize_angle(angle_deg):
     # Normalize angle to the range 0 to 360 degrees
     normalized_angle = angle_deg % 360
@@ -24,7 +35,8 @@ def normalize_angle_rad(angle_rad):
 def angles_between_angles_degrees(angle1_deg, angle2_deg):
     """
     Converts angles (degrees) into unit vectors and calculates the two angles between them, allowing to find the
-    minimum angular difference between two paths.
+    minimum angular difference between two paths. Accepts scalars or arrays of angles, see
+    angles_between_angles_radians.
     Parameters
     ----------
     angle1_deg: Angle of car 1 in degrees
@@ -34,29 +46,23 @@ def angles_between_angles_degrees(angle1_deg, angle2_deg):
     -------
     angle_radians_1, angle_radians_2: The two possible angles between two unit vectors in rads
     """
-    # Normalize angles to the range 0 to 360 degrees
-    angle1_deg = normalize_angle(angle1_deg)
-    angle2_deg = normalize_angle(angle2_deg)
+    if isinstance(angle1_deg, _SCALAR_TYPES) and isinstance(angle2_deg, _SCALAR_TYPES):
+        return angles_between_angles_radians(math.radians(angle1_deg), math.radians(angle2_deg))
 
-    # Convert angles to radians
-    angle1_rad = np.radians(angle1_deg)
-    angle2_rad = np.radians(angle2_deg)
-
-    # Convert angles to unit vectors
-    vector1 = np.array([np.cos(angle1_rad), np.sin(angle1_rad)])
-    vector2 = np.array([np.cos(angle2_rad), np.sin(angle2_rad)])
-
-    # Calculate the angles between the vectors (in radians)
-    angle_radians_1 = np.arccos(np.dot(vector1, vector2))
-    angle_radians_2 = np.arccos(np.dot(-vector1, vector2))
-
-    return angle_radians_1, angle_radians_2
+    return angles_between_angles_radians(np.radians(angle1_deg), np.radians(angle2_deg))
 
 
 def angles_between_angles_radians(angle1_rad, angle2_rad):
     """
     Converts angles (rads) into unit vectors and calculates the two angles between them, allowing to find the
     minimum angular difference between two paths.
+
+    Python and NumPy scalars are handled with math, without creating any NumPy objects. Arrays (or lists) of angles
+    are handled in a single vectorised pass and return arrays, e.g.
+    np.minimum(*angles_between_angles_radians(rotations1, rotations2)) gives the smallest angle of every pair. The two
+    paths round differently, so a pair computed on its own (TailgateDetector) and as part of an array
+    (ColumnarTailgateDetector) agree to within floating point tolerance rather than bit for bit. The dot product of the
+    unit vectors is clipped to [-1, 1], so identical or opposite angles give 0 and pi instead of NaN due to rounding.
     Parameters
     ----------
     angle1_rad: Angle of car 1 in rads
@@ -66,51 +72,206 @@ def angles_between_angles_radians(angle1_rad, angle2_rad):
     -------
     angle_radians_1, angle_radians_2: The two possible angles between two unit vectors in rads
     """
-    # Normalize angles to the range 0 to 360 degrees
-    angle1_deg = np.degrees(angle1_rad)
-    angle2_deg = np.degrees(angle2_rad)
-
-    angle1_deg = normalize_angle(angle1_deg)
-    angle2_deg = normalize_angle(angle2_deg)
+    if isinstance(angle1_rad, _SCALAR_TYPES) and isinstance(angle2_rad, _SCALAR_TYPES):
+        dot_product = math.cos(angle1_rad) * math.cos(angle2_rad) + math.sin(angle1_rad) * math.sin(angle2_rad)
+        dot_product = min(max(dot_product, -1.0), 1.0)
+        return math.acos(dot_product), math.acos(-dot_product)
 
-    # Convert angles to radians
-    angle1_rad = np.radians(angle1_deg)
-    angle2_rad = np.radians(angle2_deg)
+    angle1_rad = np.asarray(angle1_rad, dtype=np.float64)
+    angle2_rad = np.asarray(angle2_rad, dtype=np.float64)
 
-    # Convert angles to unit vectors
-    vector1 = np.array([np.cos(angle1_rad), np.sin(angle1_rad)])
-    vector2 = np.array([np.cos(angle2_rad), np.sin(angle2_rad)])
+    dot_product = np.cos(angle1_rad) * np.cos(angle2_rad) + np.sin(angle1_rad) * np.sin(angle2_rad)
+    np.clip(dot_product, -1.0, 1.0, out=dot_product)
 
-    # Calculate the angles between the vectors (in radians)
-    angle_radians_1 = np.arccos(np.dot(vector1, vector2))
-    angle_radians_2 = np.arccos(np.dot(-vector1, vector2))
+    return np.arccos(dot_product), np.arccos(-dot_product)
 
-    return angle_radians_1, angle_radians_2
 
-
-def calculate_max_speed_difference_two_second_rule(distance_meters):
+def calculate_max_speed_difference_two_second_rule(distance_meters, time_gap_seconds: float = 2):
     """
-    Applies the 2 second rule given a distance in order to determine the speed threshold above which tailgating occurs
+    Applies the 2 second rule given a distance in order to determine the speed threshold above which tailgating occurs.
+    Accepts a scalar distance or an array (or list) of distances.
     Parameters
     ----------
     distance_meters: The distance between two cars in meters
+    time_gap_seconds: The minimum allowable time gap between two cars, 2 seconds for the 2 second rule
 
     Returns
     -------
     max_speed_difference_kmh: The speed difference in km per h above which tailgating occurs
     """
+    if isinstance(distance_meters, _SCALAR_TYPES):
+        distance_meters = float(distance_meters)
+    else:
+        distance_meters = np.asarray(distance_meters, dtype=np.float64)
+
     # Convert distance from meters to kilometers
     distance_km = distance_meters / 1000
 
-    # Assuming the maximum allowable time gap is 2 seconds
-    time_gap_seconds = 2
-
     # Calculate the maximum allowable speed difference in kilometers per hour
     max_speed_difference_kmh = (distance_km / time_gap_seconds) * 3600
 
     return max_speed_difference_kmh
 
 
+def car_boxes_in_BEV(x, z, length, width, rotation_y):
+    """
+    Corners of the BEV boxes of several cars at once, following TailgateVisualisation.define_car_boxes_in_BEV
+    Parameters
+    ----------
+    x: Locations of the cars in x
+    z: Locations of the cars in z
+    length: Lengths of the car 3D boxes (Length is defined along x)
+    width: Widths of the car 3D boxes (Width is defined along z)
+    rotation_y: Rotations of the cars' axes of motion with respect to camera Z frame
+
+    Returns
+    -------
+    rotated_corners: Numpy array of shape (N, 4, 2) with the locations of the four corners of each car
+    """
+    # Corners in the order front-left, front-right, back-right, back-left, i.e. the footprint of the 3D box corners
+    return bev_corners(x, z, length, width, rotation_y)
+
+
+def find_leading_cars(x, z, rotation_y, lateral_threshold: float = 3.5):
+    """
+    Finds, for each car, the nearest car ahead of it along its direction of motion, using a uniform grid over the
+    ground plane instead of comparing every pair of cars. A car is ahead of another if its distance along the direction
+    of motion is strictly positive and its perpendicular distance from the direction of motion is below
+    lateral_threshold.
+
+    The cars are binned into square cells of side 2 * lateral_threshold. The cars ahead of a car lie in a strip of
+    half-width lateral_threshold along its direction of motion, which is walked one cell side at a time, comparing
+    only the cars of the cells that cover it. The walk stops once it has passed the nearest car ahead found so far, or
+    once it leaves the extent of the scene. Each car thus visits at most the cells along its strip up to its leader,
+    or to the edge of the scene (extent / cell side steps) when there is none, regardless of the number of cars; i.e.
+    O(n) per image for a bounded density of cars, with the result being identical to an exhaustive search. Images with
+    at most _ALL_PAIRS_MAX_CARS cars, i.e. nearly all of them, are faster to search exhaustively in a single
+    vectorised pass.
+
+    As in TailgateDetector.filter_direction_of_motion, all cars are assumed to move away from the camera, so cars with
+    a positive rotation_y are inverted before the search.
+    Parameters
+    ----------
+    x: X coordinates of the cars
+    z: Z coordinates of the cars
+    rotation_y: Rotations of the cars around Y, in rads
+    lateral_threshold: A float, in meters, the maximum perpendicular distance of a car ahead
+
+    Returns
+    -------
+    leaders: Index of the nearest car ahead of each car, -1 if there is no car ahead
+    distances: Distance along the direction of motion to that car, inf if there is no car ahead
+    """
+    x = np.asarray(x, dtype=np.float64)
+    z = np.asarray(z, dtype=np.float64)
+    rotation_y = np.asarray(rotation_y, dtype=np.float64)
+    rotation_y = np.where(rotation_y > 0, rotation_y + np.pi, rotation_y)
+
+    num_cars = len(x)
+    leaders = np.full(num_cars, -1, dtype=np.int64)
+    distances = np.full(num_cars, np.inf)
+    if num_cars < 2 or lateral_threshold <= 0:
+        return leaders, distances
+
+    dxs, dzs = np.cos(-rotation_y), np.sin(-rotation_y)
+    if num_cars <= _ALL_PAIRS_MAX_CARS:
+        ex, ez = x[np.newaxis, :] - x[:, np.newaxis], z[np.newaxis, :] - z[:, np.newaxis]
+        along = ex * dxs[:, np.newaxis] + ez * dzs[:, np.newaxis]
+        lateral = np.abs(ex * dzs[:, np.newaxis] - ez * dxs[:, np.newaxis])
+        along[(along <= 0) | (lateral >= lateral_threshold)] = np.inf
+
+        leaders = np.argmin(along, axis=1)
+        distances = along[np.arange(num_cars), leaders]
+        leaders[np.isinf(distances)] = -1
+        return leaders, distances
+
+    cell_size = 2 * lateral_threshold
+    x_min, x_max, z_min, z_max = x.min(), x.max(), z.min(), z.max()
+    cells = {}
+    for car, cell in enumerate(zip(((x - x_min) // cell_size).astype(np.int64).tolist(),
+                                   ((z - z_min) // cell_size).astype(np.int64).tolist())):
+        cells.setdefault(cell, []).append(car)
+
+    xs, zs = x.tolist(), z.tolist()
+    dxs, dzs = dxs.tolist(), dzs.tolist()
+
+    for i in range(num_cars):
+        xi, zi, dxi, dzi = xs[i], zs[i], dxs[i], dzs[i]
+        best, best_distance = -1, math.inf
+
+        # Furthest distance along the direction of motion at which a car of the scene can be
+        extent = max(x_min * dxi, x_max * dxi) + max(z_min * dzi, z_max * dzi) - (xi * dxi + zi * dzi)
+        # Half sizes of the axis aligned box around one cell side of the strip
+        half_x = abs(dxi) * cell_size / 2 + abs(dzi) * lateral_threshold
+        half_z = abs(dzi) * cell_size / 2 + abs(dxi) * lateral_threshold
+
+        visited = set()
+        step = 0
+        while step * cell_size <= extent and best_distance > step * cell_size:
+            centre = (step + 0.5) * cell_size
+            cx, cz = xi - x_min + dxi * centre, zi - z_min + dzi * centre
+            for cell_x in range(int((cx - half_x) // cell_size), int((cx + half_x) // cell_size) + 1):
+                for cell_z in range(int((cz - half_z) // cell_size), int((cz + half_z) // cell_size) + 1):
+                    cell = (cell_x, cell_z)
+                    if cell in visited or cell not in cells:
+                        continue
+                    visited.add(cell)
+
+                    for j in cells[cell]:
+                        ex, ez = xs[j] - xi, zs[j] - zi
+                        along = ex * dxi + ez * dzi
+                        lateral = abs(ex * dzi - ez * dxi)
+                        if 0 < along < best_distance and lateral < lateral_threshold:
+                            best, best_distance = j, along
+            step += 1
+
+        if best >= 0:
+            leaders[i] = best
+            distances[i] = best_distance
+
+    return leaders, distances
+
+
+def track_stage_memory(method):
+    """
+    Decorator for the stages of the tailgating classes. If the instance has report_memory set to True, the memory
+    allocated by the stage (still held once the stage returns) and the peak memory during the stage are stored in
+    the stage_memory dictionary of the instance, in bytes, using the method name as key. Tracing is started for the
+    stage if it is not already running, and stopped once the stage returns.
+    Parameters
+    ----------
+    method: The method to be tracked
+
+    Returns
+    -------
+    The wrapped method
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if not getattr(self, 'report_memory', False):
+            return method(self, *args, **kwargs)
+
+        # Tracing slows down every allocation, so it is stopped again if this stage started it
+        started = not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start()
+        try:
+            if hasattr(tracemalloc, 'reset_peak'):  # Only available in python 3.9 and later
+                tracemalloc.reset_peak()
+
+            start, _ = tracemalloc.get_traced_memory()
+            result = method(self, *args, **kwargs)
+            end, peak = tracemalloc.get_traced_memory()
+        finally:
+            if started:
+                tracemalloc.stop()
+
+        self.stage_memory[method.__name__] = {'allocated_bytes': end - start, 'peak_bytes': max(peak - start, 0)}
+        return result
+
+    return wrapper
+
+
 def pretty_print_dict(dct):
     """
     Used to print longer dictionaries more nicely. If a list of dictionaries is past, function iterates across elements
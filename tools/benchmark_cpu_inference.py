@@ -0,0 +1,86 @@
+"""
+Measures SMOKE inference on the CPU, in images per second and images per second per core (thread), for a range of
+thread counts, in the default (NCHW) and channels_last memory formats. The whole detector is timed, including the
+post-processing, on random images of the test input size.
+
+python tools/benchmark_cpu_inference.py --config-file configs/smoke_gn_vector.yaml --threads 1 2 4 8
+"""
+import argparse
+import time
+
+import numpy as np
+import torch
+
+from smoke.config import cfg
+from smoke.modeling.detector import build_detection_model
+from smoke.structures.params_3d import ParamsList
+from smoke.utils.check_point import DetectronCheckpointer
+
+
+def make_inputs(batch_size):
+    images = torch.randn(batch_size, 3, cfg.INPUT.HEIGHT_TEST, cfg.INPUT.WIDTH_TEST)
+
+    # KITTI camera, and the transform from a 1242 x 375 image to the output feature map
+    K = np.array([[721.5377, 0, 609.5593], [0, 721.5377, 172.854], [0, 0, 1]], dtype=np.float32)
+    scale = cfg.INPUT.WIDTH_TEST / 1242 / cfg.MODEL.BACKBONE.DOWN_RATIO
+    trans_mat = np.array([[scale, 0, 0], [0, scale, 0], [0, 0, 1]], dtype=np.float32)
+    targets = []
+    for _ in range(batch_size):
+        target = ParamsList(image_size=(1242, 375), is_train=False)
+        target.add_field("trans_mat", torch.as_tensor(trans_mat))
+        target.add_field("K", torch.as_tensor(K))
+        targets.append(target)
+
+    return images, targets
+
+
+def time_inference(model, images, targets, iterations, warmup):
+    with torch.no_grad():
+        for _ in range(warmup):
+            model(images, targets)
+        start = time.perf_counter()
+        for _ in range(iterations):
+            model(images, targets)
+    return iterations * images.shape[0] / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark SMOKE inference on the CPU")
+    parser.add_argument("--config-file", default="", metavar="FILE", help="path to config file")
+    parser.add_argument("--ckpt", default=None, help="checkpoint to load, random weights if not given")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, torch.get_num_threads()],
+                        help="thread counts to benchmark")
+    parser.add_argument("--batch-size", type=int, default=1, help="images per forward pass")
+    parser.add_argument("--iterations", type=int, default=10, help="timed forward passes per setting")
+    parser.add_argument("--warmup", type=int, default=2, help="untimed forward passes per setting")
+    parser.add_argument("opts", default=None, nargs=argparse.REMAINDER, help="modify config options")
+    args = parser.parse_args()
+
+    if args.config_file:
+        cfg.merge_from_file(args.config_file)
+    cfg.merge_from_list(args.opts)
+    cfg.MODEL.DEVICE = "cpu"
+    cfg.freeze()
+
+    model = build_detection_model(cfg)
+    if args.ckpt:
+        DetectronCheckpointer(cfg, model).load(args.ckpt, use_latest=False)
+    model.eval()
+
+    images, targets = make_inputs(args.batch_size)
+    print("{} x {} images, batch size {}".format(cfg.INPUT.WIDTH_TEST, cfg.INPUT.HEIGHT_TEST, args.batch_size))
+    print("{:>8s} {:>14s} {:>12s} {:>16s}".format("threads", "format", "images/s", "images/s/core"))
+    for channels_last in (False, True):
+        memory_format = torch.channels_last if channels_last else torch.contiguous_format
+        model.to(memory_format=memory_format)
+        inputs = images.contiguous(memory_format=memory_format)
+        for num_threads in args.threads:
+            torch.set_num_threads(num_threads)
+            images_per_second = time_inference(model, inputs, targets, args.iterations, args.warmup)
+            print("{:>8d} {:>14s} {:>12.2f} {:>16.3f}".format(
+                num_threads, "channels_last" if channels_last else "NCHW", images_per_second,
+                images_per_second / num_threads))
+
+
+if __name__ == "__main__":
+    main()
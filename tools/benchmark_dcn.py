@@ -0,0 +1,95 @@
+"""
+Compares the DCNv2 backends (MODEL.BACKBONE.DCN_BACKEND): the compiled smoke._ext kernels,
+torchvision.ops.deform_conv2d and the bilinear sampling formulation with F.grid_sample. Every deformable convolution
+of the backbone is run with the inputs it gets at the test input size, the outputs of the backends are compared with
+the first one and their forward times reported, then the whole backbone is timed with each backend. Without a
+checkpoint the offsets are random, so that the sampling is compared as well.
+
+python tools/benchmark_dcn.py --config-file configs/smoke_gn_vector.yaml --threads 4
+"""
+import argparse
+import time
+
+import torch
+
+from smoke.config import cfg
+from smoke.layers import dcn_v2
+from smoke.modeling.detector import build_detection_model
+from smoke.utils.check_point import DetectronCheckpointer
+
+
+def time_calls(function, iterations):
+    function()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        function()
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    return (time.perf_counter() - start) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the DCNv2 backends")
+    parser.add_argument("--config-file", default="", metavar="FILE", help="path to config file")
+    parser.add_argument("--ckpt", default=None, help="checkpoint to load, random weights if not given")
+    parser.add_argument("--device", default="cpu", help="device to run on")
+    parser.add_argument("--threads", type=int, default=torch.get_num_threads(), help="number of PyTorch threads")
+    parser.add_argument("--batch-size", type=int, default=1, help="images per forward pass")
+    parser.add_argument("--iterations", type=int, default=5, help="timed forward passes")
+    parser.add_argument("opts", default=None, nargs=argparse.REMAINDER, help="modify config options")
+    args = parser.parse_args()
+
+    if args.config_file:
+        cfg.merge_from_file(args.config_file)
+    cfg.merge_from_list(args.opts)
+    cfg.MODEL.DEVICE = args.device
+    torch.set_num_threads(args.threads)
+
+    backends = [name for name in ("ext", "torchvision", "sampling")
+                if (name == "ext" and dcn_v2._backend is not None) or
+                (name == "torchvision" and dcn_v2.deform_conv2d is not None) or
+                name == "sampling"]
+    print("backends: {}, {} threads".format(", ".join(backends), args.threads))
+
+    device = torch.device(args.device)
+    model = build_detection_model(cfg)
+    if args.ckpt:
+        DetectronCheckpointer(cfg, model).load(args.ckpt, use_latest=False)
+    else:
+        # the offsets are initialized to 0, sample around the kernel positions instead
+        for module in model.modules():
+            if isinstance(module, dcn_v2.DCN):
+                torch.nn.init.normal_(module.conv_offset_mask.weight, std=0.01)
+                torch.nn.init.normal_(module.conv_offset_mask.bias, std=1)
+    backbone = model.backbone.to(device).eval()
+    images = torch.randn(args.batch_size, 3, cfg.INPUT.HEIGHT_TEST, cfg.INPUT.WIDTH_TEST, device=device)
+
+    # the input of every deformable convolution
+    layers = []
+    hooks = [module.register_forward_pre_hook(lambda module, inputs: layers.append((module, inputs[0])))
+             for module in backbone.modules() if isinstance(module, dcn_v2.DCN)]
+    with torch.no_grad():
+        backbone(images)
+    for hook in hooks:
+        hook.remove()
+
+    print("{:>24s} {:>24s} ".format("input", "output") +
+          " ".join("{:>16s}".format(name + " ms") for name in backends) + " {:>12s}".format("max diff"))
+    with torch.no_grad():
+        for module, x in layers:
+            times, outputs = [], []
+            for name in backends:
+                dcn_v2.set_backend(name)
+                outputs.append(module(x))
+                times.append(time_calls(lambda: module(x), args.iterations))
+            difference = max((outputs[0] - output).abs().max().item() for output in outputs[1:])
+            print("{:>24s} {:>24s} ".format(str(tuple(x.shape)), str(tuple(outputs[0].shape))) +
+                  " ".join("{:>16.2f}".format(1000 * t) for t in times) + " {:>12.2e}".format(difference))
+
+        for name in backends:
+            dcn_v2.set_backend(name)
+            print("backbone, {}: {:.1f} ms".format(name, 1000 * time_calls(lambda: backbone(images), args.iterations)))
+
+
+if __name__ == "__main__":
+    main()
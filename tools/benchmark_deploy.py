@@ -0,0 +1,152 @@
+"""
+Per-layer latency of SMOKE before and after the deploy transform (TEST.DEPLOY, smoke/modeling/deploy.py): BatchNorm
+folded into the convolutions, the first convolutions of the heads merged and the model in channels_last. Every layer
+(the convolutions, normalizations, activations, pooling, and each DCN as a whole) is timed with forward hooks on
+random images of the test input size, and the head outputs of both models are compared.
+
+The default config uses GroupNorm, which can not be folded; the BatchNorm variant is benchmarked with
+MODEL.BACKBONE.USE_NORMALIZATION BN MODEL.SMOKE_HEAD.USE_NORMALIZATION BN. Without a checkpoint the BatchNorm
+statistics are random, so that the folding is checked as well.
+
+python tools/benchmark_deploy.py --config-file configs/smoke_gn_vector.yaml --threads 4
+"""
+import argparse
+import copy
+import time
+from collections import OrderedDict, defaultdict
+
+import numpy as np
+import torch
+from torch import nn
+
+from smoke.config import cfg
+from smoke.layers.dcn_v2 import DCN
+from smoke.modeling.deploy import deploy
+from smoke.modeling.detector import build_detection_model
+from smoke.structures.params_3d import ParamsList
+from smoke.utils.check_point import DetectronCheckpointer
+
+
+def make_inputs(batch_size):
+    images = torch.randn(batch_size, 3, cfg.INPUT.HEIGHT_TEST, cfg.INPUT.WIDTH_TEST)
+
+    # KITTI camera, and the transform from a 1242 x 375 image to the output feature map
+    K = np.array([[721.5377, 0, 609.5593], [0, 721.5377, 172.854], [0, 0, 1]], dtype=np.float32)
+    scale = cfg.INPUT.WIDTH_TEST / 1242 / cfg.MODEL.BACKBONE.DOWN_RATIO
+    trans_mat = np.array([[scale, 0, 0], [0, scale, 0], [0, 0, 1]], dtype=np.float32)
+    targets = []
+    for _ in range(batch_size):
+        target = ParamsList(image_size=(1242, 375), is_train=False)
+        target.add_field("trans_mat", trans_mat)
+        target.add_field("K", K)
+        targets.append(target)
+
+    return images, targets
+
+
+def timed_layers(model):
+    """ The leaf modules of the model by name, with each DCN as one layer. """
+    layers = OrderedDict()
+    inside_dcn = set()
+    for name, module in model.named_modules():
+        if name in inside_dcn:
+            continue
+        if isinstance(module, DCN):
+            inside_dcn.update(name + "." + child for child, _ in module.named_modules() if child)
+            layers[name] = module
+        elif not any(True for _ in module.children()):
+            layers[name] = module
+
+    return layers
+
+
+def time_layers(model, images, targets, iterations):
+    """
+    Returns:
+        the mean forward time of every layer, and of the whole model, in seconds
+    """
+    times, starts = defaultdict(float), {}
+    hooks = []
+    for name, module in timed_layers(model).items():
+        def pre_hook(module, inputs, name=name):
+            starts[name] = time.perf_counter()
+
+        def hook(module, inputs, output, name=name):
+            times[name] += time.perf_counter() - starts[name]
+
+        hooks.append(module.register_forward_pre_hook(pre_hook))
+        hooks.append(module.register_forward_hook(hook))
+
+    with torch.no_grad():
+        model(images, targets)
+        times.clear()
+        start = time.perf_counter()
+        for _ in range(iterations):
+            model(images, targets)
+        total = (time.perf_counter() - start) / iterations
+    for hook in hooks:
+        hook.remove()
+
+    return {name: t / iterations for name, t in times.items()}, total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-layer latency before and after the deploy transform")
+    parser.add_argument("--config-file", default="", metavar="FILE", help="path to config file")
+    parser.add_argument("--ckpt", default=None, help="checkpoint to load, random weights if not given")
+    parser.add_argument("--threads", type=int, default=torch.get_num_threads(), help="number of PyTorch threads")
+    parser.add_argument("--batch-size", type=int, default=1, help="images per forward pass")
+    parser.add_argument("--iterations", type=int, default=5, help="timed forward passes")
+    parser.add_argument("--no-channels-last", action="store_true", help="keep the deployed model in NCHW")
+    parser.add_argument("opts", default=None, nargs=argparse.REMAINDER, help="modify config options")
+    args = parser.parse_args()
+
+    if args.config_file:
+        cfg.merge_from_file(args.config_file)
+    cfg.merge_from_list(args.opts)
+    cfg.MODEL.DEVICE = "cpu"
+    torch.set_num_threads(args.threads)
+
+    model = build_detection_model(cfg)
+    if args.ckpt:
+        DetectronCheckpointer(cfg, model).load(args.ckpt, use_latest=False)
+    else:
+        for module in model.modules():
+            if isinstance(module, nn.BatchNorm2d):
+                module.running_mean.normal_(0, 0.1)
+                module.running_var.uniform_(0.5, 2)
+                nn.init.normal_(module.weight, 1, 0.1)
+                nn.init.normal_(module.bias, 0, 0.1)
+    model.eval()
+    deployed = deploy(copy.deepcopy(model), channels_last=not args.no_channels_last)
+
+    images, targets = make_inputs(args.batch_size)
+    memory_format = torch.contiguous_format if args.no_channels_last else torch.channels_last
+    # the head outputs are compared, the order of detections with (nearly) equal scores may change
+    with torch.no_grad():
+        reference = model.heads.predictor(model.backbone(images))
+        outputs = deployed.heads.predictor(deployed.backbone(images.to(memory_format=memory_format)))
+    print("max difference to the model before: heatmap {:.2e}, regression {:.2e}".format(
+        *[(r - o).abs().max().item() for r, o in zip(reference, outputs)]))
+
+    before, before_total = time_layers(model, images, targets, args.iterations)
+    after, after_total = time_layers(deployed, images.to(memory_format=memory_format), targets, args.iterations)
+
+    print("{:<48s} {:>12s} {:>12s} {:>12s}".format("layer", "type", "before ms", "after ms"))
+    # the layers of both models, a folded normalization is listed as the nn.Identity that replaces it
+    layers = OrderedDict((name, type(m).__name__) for name, m in timed_layers(deployed).items())
+    for name, module in timed_layers(model).items():
+        layers.setdefault(name, type(module).__name__)
+    for name, layer_type in layers.items():
+        old, new = before.get(name), after.get(name)
+        print("{:<48s} {:>12s} {:>12s} {:>12s}".format(
+            name, layer_type,
+            "-" if old is None else "{:.3f}".format(1000 * old),
+            "-" if new is None else "{:.3f}".format(1000 * new)))
+    for label, old, new in (("layers", sum(before.values()), sum(after.values())),
+                            ("model", before_total, after_total)):
+        print("{:<48s} {:>12s} {:>12.1f} {:>12.1f}".format(label, "", 1000 * old, 1000 * new))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Compares the throughput (label lines per second) of the bulk KITTI label parser in smoke/utils/kitti_labels.py with the
+per-line parsers it replaces:
+
+* LabelLoader.parse_line, used by the tailgating functions
+* csv.DictReader with per-field float(), used by KITTIDataset.load_annotations and KITTILoader
+
+Run on a directory of label/prediction files, or on synthetic files if no directory is given:
+
+python tools/benchmark_label_parsing.py --label-dir datasets/kitti/training/label_2
+"""
+import argparse
+import csv
+import os
+import random
+import sys
+import tempfile
+import time
+
+from smoke.utils.kitti_labels import read_kitti_label_file, read_kitti_label_files
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tailgating_functions"))
+from LabelLoading import LabelLoader
+
+FIELDNAMES = ['type', 'truncated', 'occluded', 'alpha', 'xmin', 'ymin', 'xmax', 'ymax', 'dh', 'dw',
+              'dl', 'lx', 'ly', 'lz', 'ry', 'score']
+
+
+def write_synthetic_labels(output_dir, num_files, max_objects):
+    rng = random.Random(0)
+    for i in range(num_files):
+        with open(os.path.join(output_dir, "{:06d}.txt".format(i)), "w") as f:
+            for _ in range(rng.randint(0, max_objects)):
+                values = [rng.choice(['Car', 'Cyclist', 'Pedestrian']), 0, 0] + \
+                         [round(rng.uniform(-50, 500), 4) for _ in range(13)]
+                f.write(" ".join(str(v) for v in values) + "\n")
+
+
+def parse_with_label_loader(label_paths):
+    detections = []
+    for label_path in label_paths:
+        with open(label_path, 'r') as f:
+            detections.extend(LabelLoader.parse_line(line.strip()) for line in f if line.strip())
+    return len(detections)
+
+
+def parse_with_csv(label_paths):
+    num_lines = 0
+    for label_path in label_paths:
+        with open(label_path, 'r') as f:
+            for row in csv.DictReader(f, delimiter=' ', fieldnames=FIELDNAMES):
+                [float(row[field]) for field in FIELDNAMES[1:15]]
+                num_lines += 1
+    return num_lines
+
+
+def parse_bulk_per_file(label_paths):
+    return sum(len(read_kitti_label_file(label_path)) for label_path in label_paths)
+
+
+def parse_bulk_concatenated(label_paths):
+    records, _ = read_kitti_label_files(label_paths)
+    return len(records)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark KITTI label parsers")
+    parser.add_argument("--label-dir", type=str, default="", help="directory of KITTI label files")
+    parser.add_argument("--num-files", type=int, default=5000, help="number of synthetic files if no directory")
+    parser.add_argument("--max-objects", type=int, default=12, help="maximum objects per synthetic file")
+    parser.add_argument("--repeats", type=int, default=3, help="number of runs, the fastest is reported")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        label_dir = args.label_dir
+        if not label_dir:
+            label_dir = tmp_dir
+            write_synthetic_labels(label_dir, args.num_files, args.max_objects)
+        label_paths = sorted(os.path.join(label_dir, f) for f in os.listdir(label_dir) if f.endswith(".txt"))
+
+        parsers = [
+            ("LabelLoader.parse_line", parse_with_label_loader),
+            ("csv.DictReader", parse_with_csv),
+            ("kitti_labels, per file", parse_bulk_per_file),
+            ("kitti_labels, concatenated", parse_bulk_concatenated),
+        ]
+        print("{} files".format(len(label_paths)))
+        for name, parse in parsers:
+            best = float("inf")
+            for _ in range(args.repeats):
+                start = time.perf_counter()
+                num_lines = parse(label_paths)
+                best = min(best, time.perf_counter() - start)
+            print("{:<28s} {:>9d} lines {:>8.3f} s {:>12.0f} lines/s".format(name, num_lines, best, num_lines / best))
+
+
+if __name__ == "__main__":
+    main()
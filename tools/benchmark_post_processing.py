@@ -0,0 +1,142 @@
+"""
+Measures the SMOKE post-processing (decoding of the head outputs into KITTI detections) on the CPU, for K = 50 and 100
+top points per image. PostProcessor (separable max filter NMS, fused decoding of the points above the threshold) is
+compared with the max pooling NMS and the chain of select_point_of_interest and SMOKECoder.decode_depth/location/
+dimension/orientation it replaces, on random head outputs of the test input size with a few objects per image.
+
+python tools/benchmark_post_processing.py --batch-size 1 4 --threads 1
+"""
+import argparse
+import time
+
+import numpy as np
+import torch
+
+from smoke.config import cfg
+from smoke.layers.utils import select_topk, select_point_of_interest
+from smoke.modeling.heads.smoke_head.inference import make_smoke_post_processor
+from smoke.structures.params_3d import ParamsList
+
+
+def make_predictions(batch_size, num_objects, seed=0):
+    generator = torch.Generator().manual_seed(seed)
+    height = cfg.INPUT.HEIGHT_TEST // cfg.MODEL.BACKBONE.DOWN_RATIO
+    width = cfg.INPUT.WIDTH_TEST // cfg.MODEL.BACKBONE.DOWN_RATIO
+    num_classes = len(cfg.DATASETS.DETECT_CLASSES)
+
+    # background below the threshold, with peaks of random scores at the objects
+    heatmap = 0.2 * torch.rand(batch_size, num_classes, height, width, generator=generator)
+    for b in range(batch_size):
+        ys = torch.randint(0, height, (num_objects,), generator=generator)
+        xs = torch.randint(0, width, (num_objects,), generator=generator)
+        cls = torch.randint(0, num_classes, (num_objects,), generator=generator)
+        heatmap[b, cls, ys, xs] = 0.1 + 0.9 * torch.rand(num_objects, generator=generator)
+
+    regression = torch.randn(batch_size, cfg.MODEL.SMOKE_HEAD.REGRESSION_HEADS, height, width, generator=generator)
+    regression[:, 3:6] = torch.sigmoid(regression[:, 3:6]) - 0.5
+    regression[:, 6:8] = torch.nn.functional.normalize(regression[:, 6:8])
+
+    # KITTI camera, and the transform from a 1242 x 375 image to the feature map
+    K = np.array([[721.5377, 0, 609.5593], [0, 721.5377, 172.854], [0, 0, 1]], dtype=np.float32)
+    scale = width / 1242
+    trans_mat = np.array([[scale, 0, 0], [0, scale, (height - 375 * scale) / 2], [0, 0, 1]], dtype=np.float32)
+    targets = []
+    for _ in range(batch_size):
+        target = ParamsList(image_size=(1242, 375), is_train=False)
+        target.add_field("trans_mat", trans_mat)
+        target.add_field("K", K)
+        targets.append(target)
+
+    return (heatmap, regression), targets
+
+
+def nms_hm_reference(heat_map, kernel=3):
+    """ nms_hm with max pooling. """
+    pad = (kernel - 1) // 2
+    hmax = torch.nn.functional.max_pool2d(heat_map, kernel_size=(kernel, kernel), stride=1, padding=pad)
+    return heat_map * (hmax == heat_map).float()
+
+
+def post_process_reference(post_processor, predictions, targets):
+    """ PostProcessor.forward before the fused decoding. """
+    pred_heatmap, pred_regression = predictions[0], predictions[1]
+    batch = pred_heatmap.shape[0]
+    coder = post_processor.smoke_coder
+    target_varibales = post_processor.prepare_targets(targets)
+
+    heatmap = nms_hm_reference(pred_heatmap)
+    scores, indexs, clses, ys, xs = select_topk(heatmap, K=post_processor.max_detection)
+    pred_regression = select_point_of_interest(batch, indexs, pred_regression)
+    pred_regression_pois = pred_regression.view(-1, post_processor.reg_head)
+
+    pred_proj_points = torch.cat([xs.view(-1, 1), ys.view(-1, 1)], dim=1)
+    pred_depths = coder.decode_depth(pred_regression_pois[:, 0])
+    pred_locations = coder.decode_location(pred_proj_points, pred_regression_pois[:, 1:3], pred_depths,
+                                           target_varibales["K"], target_varibales["trans_mat"])
+    pred_dimensions = coder.decode_dimension(clses, pred_regression_pois[:, 3:6])
+    pred_locations[:, 1] += pred_dimensions[:, 1] / 2
+    pred_rotys, pred_alphas = coder.decode_orientation(pred_regression_pois[:, 6:], pred_locations)
+
+    if post_processor.pred_2d:
+        box2d = coder.encode_box2d(target_varibales["K"].repeat_interleave(post_processor.max_detection, dim=0),
+                                   pred_rotys, pred_dimensions, pred_locations,
+                                   target_varibales["size"].repeat_interleave(post_processor.max_detection, dim=0))
+    else:
+        box2d = pred_locations.new_zeros(pred_locations.shape[0], 4)
+
+    result = torch.cat([clses.view(-1, 1), pred_alphas.view(-1, 1), box2d, pred_dimensions.roll(shifts=-1, dims=1),
+                        pred_locations, pred_rotys.view(-1, 1), scores.view(-1, 1)], dim=1)
+    result = result.view(batch, post_processor.max_detection, -1)
+    return [r[r[:, -1] > post_processor.det_threshold] for r in result]
+
+
+def time_calls(function, iterations, warmup):
+    for _ in range(warmup):
+        function()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        function()
+    return (time.perf_counter() - start) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the SMOKE post-processing on the CPU")
+    parser.add_argument("--config-file", default="", metavar="FILE", help="path to config file")
+    parser.add_argument("--top-k", type=int, nargs="+", default=[50, 100], help="TEST.DETECTIONS_PER_IMG values")
+    parser.add_argument("--batch-size", type=int, nargs="+", default=[1, 4], help="images per call")
+    parser.add_argument("--num-objects", type=int, default=10, help="peaks per image, about half above the threshold")
+    parser.add_argument("--threads", type=int, default=1, help="number of PyTorch threads")
+    parser.add_argument("--iterations", type=int, default=50, help="timed calls per setting")
+    parser.add_argument("--warmup", type=int, default=5, help="untimed calls per setting")
+    args = parser.parse_args()
+
+    if args.config_file:
+        cfg.merge_from_file(args.config_file)
+    cfg.MODEL.DEVICE = "cpu"
+    torch.set_num_threads(args.threads)
+
+    print("{:>6s} {:>6s} {:>14s} {:>14s} {:>8s}".format("K", "batch", "reference ms", "fused ms", "speedup"))
+    for top_k in args.top_k:
+        cfg.TEST.DETECTIONS_PER_IMG = top_k
+        post_processor = make_smoke_post_processor(cfg)
+        for batch_size in args.batch_size:
+            # the equivalence is also checked without any point above the threshold
+            for num_objects in (args.num_objects, 0):
+                predictions, targets = make_predictions(batch_size, num_objects)
+                with torch.no_grad():
+                    reference = post_process_reference(post_processor, predictions, targets)
+                    fused = post_processor(predictions, targets)
+                for r, f in zip(reference, fused):
+                    assert r.shape == f.shape and torch.allclose(r, f, rtol=1e-4, atol=1e-3), (r, f)
+
+            predictions, targets = make_predictions(batch_size, args.num_objects)
+            with torch.no_grad():
+                old = time_calls(lambda: post_process_reference(post_processor, predictions, targets),
+                                 args.iterations, args.warmup)
+                new = time_calls(lambda: post_processor(predictions, targets), args.iterations, args.warmup)
+            print("{:>6d} {:>6d} {:>14.3f} {:>14.3f} {:>7.1f}x".format(
+                top_k, batch_size, 1000 * old, 1000 * new, old / new))
+
+
+if __name__ == "__main__":
+    main()
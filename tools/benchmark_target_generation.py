@@ -0,0 +1,167 @@
+"""
+Measures the training target generation of KITTIDataset, in samples per second of a single process, i.e. per
+DataLoader worker. KITTIDataset.encode_targets (batched projection and transforms, cached gaussian kernels) is
+compared with the per-object loop it replaces, and the full __getitem__ (image loading and augmentation included) is
+timed as well.
+
+Run on a KITTI training directory, or on synthetic samples if no directory is given:
+
+python tools/benchmark_target_generation.py --root datasets/kitti/training
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+from smoke.config import cfg
+from smoke.data.datasets import KITTIDataset
+from smoke.modeling.heatmap_coder import affine_transform, gaussian2D, gaussian_radius
+from smoke.modeling.smoke_coder import encode_label
+
+P2 = "P2: 7.215377e+02 0.000000e+00 6.095593e+02 4.485728e+01 0.000000e+00 7.215377e+02 1.728540e+02 " \
+     "2.163791e-01 0.000000e+00 0.000000e+00 1.000000e+00 2.745884e-03\n"
+
+
+def write_synthetic_samples(root, num_samples, max_objects):
+    rng = random.Random(0)
+    for sub_dir in ("image_2", "label_2", "calib", "ImageSets"):
+        os.makedirs(os.path.join(root, sub_dir), exist_ok=True)
+
+    image = Image.fromarray(np.random.default_rng(0).integers(0, 255, (375, 1242, 3), dtype=np.uint8))
+    names = ["{:06d}".format(i) for i in range(num_samples)]
+    for name in names:
+        image.save(os.path.join(root, "image_2", name + ".png"), compress_level=1)
+        with open(os.path.join(root, "calib", name + ".txt"), "w") as f:
+            f.write(P2)
+        with open(os.path.join(root, "label_2", name + ".txt"), "w") as f:
+            for _ in range(rng.randint(1, max_objects)):
+                h, w, l = rng.uniform(1.4, 1.8), rng.uniform(1.5, 1.9), rng.uniform(3.5, 4.8)
+                x, y, z = rng.uniform(-15, 15), rng.uniform(1.4, 2), rng.uniform(5, 60)
+                values = ["Car", 0, 0, 0, 0, 0, 0, 0, h, w, l, x, y, z, rng.uniform(-3.14, 3.14)]
+                f.write(" ".join(str(round(v, 2)) if isinstance(v, float) else str(v) for v in values) + "\n")
+
+    with open(os.path.join(root, "ImageSets", "train.txt"), "w") as f:
+        f.write("\n".join(names) + "\n")
+
+
+def encode_targets_per_object(dataset, anns, K, trans_mat, flipped, affine):
+    """ The per-object target generation of KITTIDataset.__getitem__ before encode_targets. """
+    heat_map = np.zeros([dataset.num_classes, dataset.output_height, dataset.output_width], dtype=np.float32)
+    regression = np.zeros([dataset.max_objs, 3, 8], dtype=np.float32)
+    cls_ids = np.zeros([dataset.max_objs], dtype=np.int32)
+    proj_points = np.zeros([dataset.max_objs, 2], dtype=np.int32)
+    p_offsets = np.zeros([dataset.max_objs, 2], dtype=np.float32)
+    dimensions = np.zeros([dataset.max_objs, 3], dtype=np.float32)
+    locations = np.zeros([dataset.max_objs, 3], dtype=np.float32)
+    rotys = np.zeros([dataset.max_objs], dtype=np.float32)
+    reg_mask = np.zeros([dataset.max_objs], dtype=np.uint8)
+    flip_mask = np.zeros([dataset.max_objs], dtype=np.uint8)
+
+    for i, a in enumerate(anns):
+        cls = a["label"]
+        locs = np.array(a["locations"])
+        rot_y = np.array(a["rot_y"])
+        if flipped:
+            locs[0] *= -1
+            rot_y *= -1
+
+        point, box2d, box3d = encode_label(K, rot_y, a["dimensions"], locs)
+        point = affine_transform(point, trans_mat)
+        box2d[:2] = affine_transform(box2d[:2], trans_mat)
+        box2d[2:] = affine_transform(box2d[2:], trans_mat)
+        box2d[[0, 2]] = box2d[[0, 2]].clip(0, dataset.output_width - 1)
+        box2d[[1, 3]] = box2d[[1, 3]].clip(0, dataset.output_height - 1)
+        h, w = box2d[3] - box2d[1], box2d[2] - box2d[0]
+
+        if (0 < point[0] < dataset.output_width) and (0 < point[1] < dataset.output_height):
+            point_int = point.astype(np.int32)
+            radius = max(0, int(gaussian_radius(h, w)))
+
+            # uncached kernel, as draw_umich_gaussian used to build it
+            diameter = 2 * radius + 1
+            gaussian = gaussian2D((diameter, diameter), sigma=diameter / 6)
+            x, y = int(point_int[0]), int(point_int[1])
+            left, right = min(x, radius), min(dataset.output_width - x, radius + 1)
+            top, bottom = min(y, radius), min(dataset.output_height - y, radius + 1)
+            masked_heatmap = heat_map[cls][y - top:y + bottom, x - left:x + right]
+            masked_gaussian = gaussian[radius - top:radius + bottom, radius - left:radius + right]
+            if min(masked_gaussian.shape) > 0 and min(masked_heatmap.shape) > 0:
+                np.maximum(masked_heatmap, masked_gaussian, out=masked_heatmap)
+
+            cls_ids[i] = cls
+            regression[i] = box3d
+            proj_points[i] = point_int
+            p_offsets[i] = point - point_int
+            dimensions[i] = np.array(a["dimensions"])
+            locations[i] = locs
+            rotys[i] = rot_y
+            reg_mask[i] = 1 if not affine else 0
+            flip_mask[i] = 1 if not affine and flipped else 0
+
+    return {"hm": heat_map, "reg": regression, "cls_ids": cls_ids, "proj_p": proj_points,
+            "dimensions": dimensions, "locations": locations, "rotys": rotys, "reg_mask": reg_mask,
+            "flip_mask": flip_mask}
+
+
+def time_samples(function, samples, repeats):
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for sample in samples:
+            function(*sample)
+        best = min(best, time.perf_counter() - start)
+    return len(samples) / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark KITTIDataset target generation")
+    parser.add_argument("--root", type=str, default="", help="KITTI training directory with ImageSets/train.txt")
+    parser.add_argument("--num-samples", type=int, default=200, help="number of synthetic samples if no directory")
+    parser.add_argument("--max-objects", type=int, default=20, help="maximum objects per synthetic sample")
+    parser.add_argument("--repeats", type=int, default=3, help="number of runs, the fastest is reported")
+    args = parser.parse_args()
+
+    cfg.DATASETS.TRAIN_SPLIT = "train"
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        root = args.root
+        if not root:
+            root = tmp_dir
+            write_synthetic_samples(root, args.num_samples, args.max_objects)
+        dataset = KITTIDataset(cfg, root, is_train=True)
+
+        # flips and affine augmentation drawn once per sample, so that both versions get the same inputs
+        rng = random.Random(0)
+        samples = []
+        for idx in range(len(dataset)):
+            anns, K = dataset.load_annotations(idx)
+            trans_mat = np.array([[0.25, 0, rng.uniform(-20, 20)], [0, 0.25, rng.uniform(-10, 10)], [0, 0, 1]],
+                                 dtype=np.float32)
+            samples.append((anns, K, trans_mat, rng.random() < 0.5, rng.random() < 0.3))
+
+        for anns, K, trans_mat, flipped, affine in samples[:20]:
+            batched = dataset.encode_targets(anns, K, trans_mat, flipped, affine)
+            per_object = encode_targets_per_object(dataset, anns, K, trans_mat, flipped, affine)
+            for field, value in per_object.items():
+                assert np.allclose(batched[field], value, atol=1e-4), field
+
+        num_objects = sum(len(sample[0]) for sample in samples)
+        print("{} samples, {:.1f} objects per sample".format(len(samples), num_objects / len(samples)))
+
+        old = time_samples(lambda *sample: encode_targets_per_object(dataset, *sample), samples, args.repeats)
+        new = time_samples(dataset.encode_targets, samples, args.repeats)
+        print("{:<32s} {:>10.0f} samples/s".format("targets, per object", old))
+        print("{:<32s} {:>10.0f} samples/s ({:.1f}x)".format("targets, encode_targets", new, new / old))
+
+        full = time_samples(dataset.__getitem__, [(idx,) for idx in range(len(dataset))], args.repeats)
+        # the same __getitem__ with the per-object targets, from the difference of the target times
+        full_old = 1 / (1 / full - 1 / new + 1 / old)
+        print("{:<32s} {:>10.0f} samples/s, {:.0f} samples/s with per-object targets".format(
+            "__getitem__", full, full_old))
+
+
+if __name__ == "__main__":
+    main()
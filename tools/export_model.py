@@ -0,0 +1,123 @@
+"""
+Exports SMOKE with its post-processing to TorchScript and/or ONNX, for serving with torch.jit.load or ONNX Runtime
+without this package. The exported model takes the images, camera intrinsics K, image to feature map transforms and
+image sizes as tensors, and returns the [N, K, 14] detections in decreasing score with the number above the threshold
+per image (see smoke/modeling/detector/export.py).
+
+The exported models are checked against the eager model on random images, and their load time and latency on the
+CPU are reported.
+
+python tools/export_model.py --config-file configs/smoke_gn_vector.yaml --ckpt model_final.pth --format torchscript onnx
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+import torch
+
+from smoke.config import cfg
+from smoke.modeling.detector import build_detection_model
+from smoke.modeling.detector.export import export_inputs, export_onnx, export_torchscript
+from smoke.structures.params_3d import ParamsList
+from smoke.utils.check_point import DetectronCheckpointer
+
+
+def make_inputs(batch_size):
+    images = torch.randn(batch_size, 3, cfg.INPUT.HEIGHT_TEST, cfg.INPUT.WIDTH_TEST)
+
+    # KITTI camera, and the transform from a 1242 x 375 image to the output feature map
+    K = np.array([[721.5377, 0, 609.5593], [0, 721.5377, 172.854], [0, 0, 1]], dtype=np.float32)
+    scale = cfg.INPUT.WIDTH_TEST / 1242 / cfg.MODEL.BACKBONE.DOWN_RATIO
+    trans_mat = np.array([[scale, 0, 0], [0, scale, 0], [0, 0, 1]], dtype=np.float32)
+    targets = []
+    for _ in range(batch_size):
+        target = ParamsList(image_size=(1242, 375), is_train=False)
+        target.add_field("trans_mat", trans_mat)
+        target.add_field("K", K)
+        targets.append(target)
+
+    return images, targets
+
+
+def time_calls(function, iterations):
+    function()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        function()
+    return (time.perf_counter() - start) / iterations
+
+
+def check_detections(name, reference, detections, num_detections):
+    max_error = 0.
+    for r, d, n in zip(reference, detections, num_detections):
+        d = np.asarray(d)[:int(n)]
+        assert d.shape == tuple(r.shape), "{}: {} detections instead of {}".format(name, d.shape[0], r.shape[0])
+        if len(d):
+            max_error = max(max_error, float(np.abs(d - r.numpy()).max()))
+    print("{}: {} detections, max difference to eager {:.2e}".format(
+        name, sum(len(r) for r in reference), max_error))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export SMOKE to TorchScript or ONNX")
+    parser.add_argument("--config-file", default="", metavar="FILE", help="path to config file")
+    parser.add_argument("--ckpt", default=None, help="checkpoint to export, random weights if not given")
+    parser.add_argument("--format", nargs="+", default=["torchscript"], choices=["torchscript", "onnx"])
+    parser.add_argument("--output-dir", default="export", help="directory of smoke.pt and smoke.onnx")
+    parser.add_argument("--batch-size", type=int, default=1, help="batch size of the example and check inputs")
+    parser.add_argument("--iterations", type=int, default=5, help="timed forward passes")
+    parser.add_argument("opts", default=None, nargs=argparse.REMAINDER, help="modify config options")
+    args = parser.parse_args()
+
+    if args.config_file:
+        cfg.merge_from_file(args.config_file)
+    cfg.merge_from_list(args.opts)
+    cfg.MODEL.DEVICE = "cpu"
+    cfg.freeze()
+
+    model = build_detection_model(cfg)
+    if args.ckpt:
+        DetectronCheckpointer(cfg, model).load(args.ckpt, use_latest=False)
+    model.eval()
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    images, targets = make_inputs(args.batch_size)
+    inputs = export_inputs(images, targets)
+    with torch.no_grad():
+        reference = model(images, targets)
+        eager = time_calls(lambda: model(images, targets), args.iterations)
+    print("eager: {:.1f} ms per batch".format(1000 * eager))
+
+    if "torchscript" in args.format:
+        path = os.path.join(args.output_dir, "smoke.pt")
+        export_torchscript(model, inputs, path)
+
+        start = time.perf_counter()
+        traced = torch.jit.load(path)
+        load_time = time.perf_counter() - start
+        with torch.no_grad():
+            check_detections("torchscript", reference, *traced(*inputs))
+            latency = time_calls(lambda: traced(*inputs), args.iterations)
+        print("torchscript: {}, loaded in {:.2f} s, {:.1f} ms per batch".format(path, load_time, 1000 * latency))
+
+    if "onnx" in args.format:
+        path = os.path.join(args.output_dir, "smoke.onnx")
+        export_onnx(model, inputs, path)
+        try:
+            import onnxruntime
+        except ImportError:
+            print("onnx: {}, install onnxruntime to check it".format(path))
+            return
+
+        start = time.perf_counter()
+        session = onnxruntime.InferenceSession(path, providers=["CPUExecutionProvider"])
+        load_time = time.perf_counter() - start
+        feed = {i.name: value.numpy() for i, value in zip(session.get_inputs(), inputs)}
+        check_detections("onnx", reference, *session.run(None, feed))
+        latency = time_calls(lambda: session.run(None, feed), args.iterations)
+        print("onnx: {}, loaded in {:.2f} s, {:.1f} ms per batch".format(path, load_time, 1000 * latency))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""
+Packs the images, calibration and labels of the KITTI splits of a config into the memory-mapped stores read by
+KITTIDataset with DATASETS.IMAGE_STORE True. The PNG files are decoded and resized to the network input once, so that
+loading a sample without augmentation is a slice of the store instead of a PNG decode and an affine transform.
+
+python tools/pack_kitti_images.py --config-file configs/smoke_gn_vector.yaml
+python tools/plain_train_net.py --config-file configs/smoke_gn_vector.yaml DATASETS.IMAGE_STORE True
+"""
+import argparse
+import os
+import time
+
+from smoke.config import cfg
+from smoke.config.paths_catalog import DatasetCatalog
+from smoke.data.datasets.image_store import pack_image_store
+
+
+def read_split(root, split):
+    with open(os.path.join(root, "ImageSets", split + ".txt"), "r") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pack KITTI images into memory-mapped stores")
+    parser.add_argument("--config-file", default="", metavar="FILE", help="path to config file")
+    parser.add_argument("--num-threads", type=int, default=4, help="threads decoding the PNG files")
+    parser.add_argument("opts", default=None, nargs=argparse.REMAINDER, help="modify config options")
+    args = parser.parse_args()
+
+    if args.config_file:
+        cfg.merge_from_file(args.config_file)
+    cfg.merge_from_list(args.opts)
+
+    # labels are only read by the training datasets
+    datasets = [(name, cfg.DATASETS.TRAIN_SPLIT, True) for name in cfg.DATASETS.TRAIN] + \
+               [(name, cfg.DATASETS.TEST_SPLIT, False) for name in cfg.DATASETS.TEST]
+    for name, split, with_labels in datasets:
+        root = DatasetCatalog.get(name)["args"]["root"]
+        names = read_split(root, split)
+
+        start = time.perf_counter()
+        images_path, index_path = pack_image_store(root, split, names, cfg.INPUT.WIDTH_TRAIN, cfg.INPUT.HEIGHT_TRAIN,
+                                                   with_labels=with_labels, num_threads=args.num_threads)
+        print("{}: {} images packed to {} in {:.1f} s ({:.2f} GB)".format(
+            name, len(names), images_path, time.perf_counter() - start, os.path.getsize(images_path) / 1e9))
+
+
+if __name__ == "__main__":
+    main()
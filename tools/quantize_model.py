@@ -0,0 +1,173 @@
+"""
+Post-training quantization of SMOKE for CPU inference, and the accuracy of each precision. The int8 model is
+calibrated on images of the training split (DATASETS.TRAIN, TRAIN_SPLIT, with the test transforms), see
+smoke/modeling/quantization.py. Then fp32, int8 and the bf16/fp16 autocast modes (TEST.PRECISION) are run on the first
+images of the test split, the KITTI prediction files of each are written to OUTPUT_DIR/quantization/<precision>/data,
+and compared with the fp32 ones: detections of the same class matched by their 3D center, and the mean difference of
+their location, dimensions, rotation and score. Given --kitti-eval, the offline KITTI evaluation is run on each too.
+
+python tools/quantize_model.py --config-file configs/smoke_gn_vector.yaml --ckpt model_final.pth \
+    --calibration-images 200 --eval-images 500 DATASETS.TEST_SPLIT val OUTPUT_DIR output
+"""
+import argparse
+import itertools
+import math
+import os
+import subprocess
+import time
+
+import numpy as np
+import torch
+
+from smoke.config import cfg
+from smoke.data import build_test_loader
+from smoke.data.datasets.evaluation.kitti.kitti_eval import KITTIPredictionWriter
+from smoke.engine.inference import compute_on_dataset
+from smoke.modeling.detector import build_detection_model
+from smoke.modeling.quantization import quantize_int8, quantizable_convs, default_backend
+from smoke.utils.check_point import DetectronCheckpointer
+from smoke.utils.kitti_labels import read_kitti_label_files
+from smoke.utils.timer import Timer
+
+
+def calibration_loader(num_images):
+    calibration_cfg = cfg.clone()
+    calibration_cfg.defrost()
+    calibration_cfg.DATASETS.TEST = cfg.DATASETS.TRAIN
+    calibration_cfg.DATASETS.TEST_SPLIT = cfg.DATASETS.TRAIN_SPLIT
+    data_loader = build_test_loader(calibration_cfg)[0]
+
+    return data_loader, math.ceil(num_images / cfg.TEST.IMS_PER_BATCH)
+
+
+def match_detections(reference, records, max_distance):
+    """
+    Greedy matching of the detections of one image to the reference ones, by class and distance of the 3D centers.
+
+    Returns:
+        the indexes of the matched reference and detections
+    """
+    if len(reference) == 0 or len(records) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    reference_centers = np.stack([reference["x"], reference["y"], reference["z"]], axis=1)
+    centers = np.stack([records["x"], records["y"], records["z"]], axis=1)
+    distance = np.linalg.norm(reference_centers[:, None] - centers[None], axis=2)
+    distance[reference["object_type"][:, None] != records["object_type"][None]] = np.inf
+
+    reference_ids, ids = [], []
+    for i in np.argsort(-reference["score"]):
+        j = np.argmin(distance[i])
+        if distance[i, j] <= max_distance:
+            reference_ids.append(i)
+            ids.append(j)
+            distance[:, j] = np.inf
+
+    return np.array(reference_ids, dtype=np.int64), np.array(ids, dtype=np.int64)
+
+
+def compare_predictions(reference_folder, folder, max_distance):
+    names = sorted(os.listdir(reference_folder))
+    reference, reference_counts = read_kitti_label_files([os.path.join(reference_folder, n) for n in names])
+    records, counts = read_kitti_label_files([os.path.join(folder, n) for n in names])
+
+    matched_reference, matched = [], []
+    reference_offsets, offsets = np.cumsum(reference_counts) - reference_counts, np.cumsum(counts) - counts
+    for r_offset, r_count, offset, count in zip(reference_offsets, reference_counts, offsets, counts):
+        reference_ids, ids = match_detections(reference[r_offset:r_offset + r_count],
+                                              records[offset:offset + count], max_distance)
+        matched_reference.append(reference[r_offset + reference_ids])
+        matched.append(records[offset + ids])
+    matched_reference, matched = np.concatenate(matched_reference), np.concatenate(matched)
+
+    def mean_difference(*fields):
+        if len(matched) == 0:
+            return float("nan")
+        return np.mean([np.abs(matched[f] - matched_reference[f]).mean() for f in fields])
+
+    # rotations differ by a multiple of 2 pi at most, compare them on the circle
+    rotation = np.abs(np.angle(np.exp(1j * (matched["rotation_y"] - matched_reference["rotation_y"]))))
+    return {
+        "images": len(names),
+        "detections": len(records),
+        "matched": len(matched) / max(len(reference), 1),
+        "location": mean_difference("x", "y", "z"),
+        "dimensions": mean_difference("height", "width", "length"),
+        "rotation": rotation.mean() if len(matched) else float("nan"),
+        "score": mean_difference("score"),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Quantize SMOKE and compare the precisions on KITTI")
+    parser.add_argument("--config-file", default="", metavar="FILE", help="path to config file")
+    parser.add_argument("--ckpt", default=None, help="checkpoint to quantize, MODEL.WEIGHT if not given")
+    parser.add_argument("--precision", nargs="+", default=["fp32", "int8", "bf16"],
+                        choices=["fp32", "int8", "bf16", "fp16"], help="precisions to run, fp32 is the reference")
+    parser.add_argument("--backend", default=None, help="quantized engine, x86/fbgemm or qnnpack")
+    parser.add_argument("--calibration-images", type=int, default=200, help="training images to calibrate int8 on")
+    parser.add_argument("--eval-images", type=int, default=500, help="test images to compare the precisions on")
+    parser.add_argument("--max-distance", type=float, default=2.0, help="in meters, to match the detections")
+    parser.add_argument("--kitti-eval", default=None, metavar="BINARY",
+                        help="evaluate_object_3d_offline, run on the predictions of each precision")
+    parser.add_argument("opts", default=None, nargs=argparse.REMAINDER, help="modify config options")
+    args = parser.parse_args()
+
+    if args.config_file:
+        cfg.merge_from_file(args.config_file)
+    cfg.merge_from_list(args.opts)
+    # the quantized convolutions only run on the CPU
+    cfg.MODEL.DEVICE = "cpu"
+    cfg.freeze()
+    if cfg.TEST.NUM_THREADS > 0:
+        torch.set_num_threads(cfg.TEST.NUM_THREADS)
+    if "fp32" not in args.precision:
+        args.precision.insert(0, "fp32")
+
+    device = torch.device("cpu")
+    model = build_detection_model(cfg)
+    checkpointer = DetectronCheckpointer(cfg, model, save_dir=cfg.OUTPUT_DIR)
+    checkpointer.load(cfg.MODEL.WEIGHT if args.ckpt is None else args.ckpt, use_latest=args.ckpt is None)
+    model.eval()
+
+    models = {precision: model for precision in args.precision}
+    if "int8" in args.precision:
+        backend = args.backend or default_backend()
+        data_loader, num_batches = calibration_loader(args.calibration_images)
+        start = time.perf_counter()
+        models["int8"] = quantize_int8(model, data_loader, num_batches, backend)
+        print("int8: {} convolutions quantized with {}, calibrated on {} images in {:.0f} s".format(
+            len(quantizable_convs(model)), backend, min(args.calibration_images, len(data_loader.dataset)),
+            time.perf_counter() - start))
+
+    output_folder = os.path.join(cfg.OUTPUT_DIR, "quantization")
+    data_loader = build_test_loader(cfg)[0]
+    num_batches = math.ceil(args.eval_images / cfg.TEST.IMS_PER_BATCH)
+    timers = {}
+    for precision in args.precision:
+        timer = Timer()
+        with KITTIPredictionWriter(os.path.join(output_folder, precision, "data")) as writer:
+            compute_on_dataset(models[precision], itertools.islice(data_loader, num_batches), device, timer,
+                               writer=writer, precision="fp32" if precision == "int8" else precision)
+        timers[precision] = timer
+
+    print("{:>6s} {:>10s} {:>10s} {:>8s} {:>10s} {:>10s} {:>10s} {:>8s}".format(
+        "", "s / img", "detections", "matched", "location", "dimensions", "rotation", "score"))
+    reference_folder = os.path.join(output_folder, "fp32", "data")
+    for precision in args.precision:
+        delta = compare_predictions(reference_folder, os.path.join(output_folder, precision, "data"),
+                                    args.max_distance)
+        print("{:>6s} {:>10.3f} {:>10d} {:>7.1f}% {:>10.4f} {:>10.4f} {:>10.4f} {:>8.4f}".format(
+            precision, timers[precision].total_time / delta["images"], delta["detections"],
+            100 * delta["matched"], delta["location"], delta["dimensions"], delta["rotation"], delta["score"]))
+
+    if args.kitti_eval:
+        label_dir = data_loader.dataset.label_dir
+        for precision in args.precision:
+            print("KITTI evaluation, {}:".format(precision))
+            print(subprocess.check_output([os.path.abspath(args.kitti_eval), label_dir,
+                                           os.path.abspath(os.path.join(output_folder, precision))],
+                                          universal_newlines=True))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 import numpy as np
 from data_processing import KITTI_dataloader
+from smoke.utils.box3d import box3d_corners
 
 def recover_angle(bin_anchor, bin_confidence, bin_num):
     # select anchor from bins
@@ -115,15 +116,8 @@ class detectionInfo(object):
         return output_line
 
     def box3d_candidate(self, rot_local, soft_range):
-        x_corners = [self.l, self.l, self.l, self.l, 0, 0, 0, 0]
-        y_corners = [self.h, 0, self.h, 0, self.h, 0, self.h, 0]
-        z_corners = [0, 0, self.w, self.w, self.w, self.w, 0, 0]
-
-        x_corners = [i - self.l / 2 for i in x_corners]
-        y_corners = [i - self.h for i in y_corners]
-        z_corners = [i - self.w / 2 for i in z_corners]
-
-        corners_3d = np.transpose(np.array([x_corners, y_corners, z_corners]))
+        # corners of the box at the origin, reordered from the KITTI order of box3d_corners
+        corners_3d = box3d_corners([self.l, self.h, self.w], [0, 0, 0], 0)[0][[2, 1, 3, 4, 6, 5, 7, 0]]
         point1 = corners_3d[0, :]
         point2 = corners_3d[1, :]
         point3 = corners_3d[2, :]
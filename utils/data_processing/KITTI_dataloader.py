@@ -1,7 +1,7 @@
 import os
-import csv
 import numpy as np
 from config import config as cfg
+from smoke.utils.kitti_labels import OBJECT_TYPES, read_kitti_label_file
 
 class KITTILoader():
     def __init__(self, subset='training'):
@@ -21,33 +21,31 @@ class KITTILoader():
             image_full_path = os.path.join(image_dir, fn.replace('.txt', '.png'))
 
             self.images.append(image_full_path)
-            fieldnames = ['type', 'truncated', 'occluded', 'alpha', 'xmin', 'ymin', 'xmax', 'ymax', 'dh', 'dw', 'dl',
-                          'lx', 'ly', 'lz', 'ry']
-            with open(label_full_path, 'r') as csv_file:
-                reader = csv.DictReader(csv_file, delimiter=' ', fieldnames=fieldnames)
-
-                for line, row in enumerate(reader):
-
-                    if row['type'] in self.KITTI_cat:
-                        if subset == 'training':
-                            new_alpha = get_new_alpha(row['alpha'])
-                            dimensions = np.array([float(row['dh']), float(row['dw']), float(row['dl'])])
-                            annotation = {'name': row['type'], 'image': image_full_path,
-                                          'xmin': int(float(row['xmin'])), 'ymin': int(float(row['ymin'])),
-                                          'xmax': int(float(row['xmax'])), 'ymax': int(float(row['ymax'])),
-                                          'dims': dimensions, 'new_alpha': new_alpha}
-
-                        elif subset == 'eval':
-                            dimensions = np.array([float(row['dh']), float(row['dw']), float(row['dl'])])
-                            translations = np.array([float(row['lx']), float(row['ly']), float(row['lz'])])
-                            annotation = {'name': row['type'], 'image': image_full_path,
-                                          'alpha': float(row['alpha']),
-                                          'xmin': int(float(row['xmin'])), 'ymin': int(float(row['ymin'])),
-                                          'xmax': int(float(row['xmax'])), 'ymax': int(float(row['ymax'])),
-                                          'dims': dimensions, 'trans': translations, 'rot_y': float(row['ry'])}
-
-
-                        self.image_data.append(annotation)
+            records = read_kitti_label_file(label_full_path)
+
+            for row in records:
+                name = OBJECT_TYPES[row['object_type']]
+
+                if name in self.KITTI_cat:
+                    if subset == 'training':
+                        new_alpha = get_new_alpha(row['alpha'])
+                        dimensions = np.array([row['height'], row['width'], row['length']])
+                        annotation = {'name': name, 'image': image_full_path,
+                                      'xmin': int(row['left']), 'ymin': int(row['top']),
+                                      'xmax': int(row['right']), 'ymax': int(row['bottom']),
+                                      'dims': dimensions, 'new_alpha': new_alpha}
+
+                    elif subset == 'eval':
+                        dimensions = np.array([row['height'], row['width'], row['length']])
+                        translations = np.array([row['x'], row['y'], row['z']])
+                        annotation = {'name': name, 'image': image_full_path,
+                                      'alpha': float(row['alpha']),
+                                      'xmin': int(row['left']), 'ymin': int(row['top']),
+                                      'xmax': int(row['right']), 'ymax': int(row['bottom']),
+                                      'dims': dimensions, 'trans': translations, 'rot_y': float(row['rotation_y'])}
+
+
+                    self.image_data.append(annotation)
 
     def get_average_dimension(self):
         dims_avg = {key: np.array([0, 0, 0]) for key in self.KITTI_cat}
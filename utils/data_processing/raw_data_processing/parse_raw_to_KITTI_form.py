@@ -7,6 +7,7 @@ import cv2
 import numpy as np
 import shutil
 from utils.read_dir import ReadDir
+from smoke.utils.box3d import encode_boxes
 import parseTrackletXML as xmlParser
 
 def makedir(path):
@@ -21,48 +22,13 @@ def obtain_2Dbox(dims, trans, rot, P2, img_xmax, img_ymax):
     obtain 2D bounding box based on 3D location values
     construct 3D bounding box at first, 2D bounding box is just the minimal and maximal values of 3D bounding box
     '''
-    # generate 8 points for bounding box
     h, w, l = dims[0], dims[1], dims[2]
-    tx, ty, tz = trans[0], trans[1], trans[2]
-
-    R = np.array([[np.cos(rot), 0, np.sin(rot)],
-                  [0, 1, 0],
-                  [-np.sin(rot), 0, np.cos(rot)]])
-
-    x_corners = [0, l, l, l, l, 0, 0, 0]  # -l/2
-    y_corners = [0, 0, h, h, 0, 0, h, h]  # -h
-    z_corners = [0, 0, 0, w, w, w, w, 0]  # -w/2
-
-    x_corners = [i - l / 2 for i in x_corners]
-    y_corners = [i - h for i in y_corners]
-    z_corners = [i - w / 2 for i in z_corners]
-
-    corners_3D = np.array([x_corners, y_corners, z_corners])
-    corners_3D = R.dot(corners_3D)
-    corners_3D += np.array([tx, ty, tz]).reshape((3, 1))
-
-    corners_3D_1 = np.vstack((corners_3D, np.ones((corners_3D.shape[-1]))))
-    corners_2D = P2.dot(corners_3D_1)
-    corners_2D = corners_2D / corners_2D[2]
-    corners_2D = corners_2D[:2]
-
-    for i in range(len(corners_2D[0, :])):
-        if corners_2D[0, i] < 0:
-            corners_2D[0, i] = 0
-        elif corners_2D[0, i] > img_xmax:
-            corners_2D[0, i] = img_xmax
-
-    for j in range(len(corners_2D[1, :])):
-        if corners_2D[1, j] < 0:
-            corners_2D[1, j] = 0
-        elif corners_2D[1, j] > img_ymax:
-            corners_2D[1, j] = img_ymax
-
-    xmin, xmax = int(min(corners_2D[0,:])), int(max(corners_2D[0,:]))
-    ymin, ymax = int(min(corners_2D[1,:])), int(max(corners_2D[1,:]))
-
-    bbox = [xmin, ymin, xmax, ymax]
-    
+
+    _, _, box2d = encode_boxes(P2, [rot], [[l, h, w]], [trans[:3]], img_size=(img_xmax, img_ymax))
+    xmin, ymin, xmax, ymax = box2d[0]
+
+    bbox = [int(xmin), int(ymin), int(xmax), int(ymax)]
+
     return bbox
 
 def local_ori(trans, rot):
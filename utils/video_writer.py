@@ -1,20 +1,73 @@
 import argparse
+import collections
 import cv2
+import itertools
+import logging
+import multiprocessing
 import os
+import time
 import numpy as np
 
-def write_video(args):
-    fourcc = cv2.VideoWriter_fourcc(*"MJPG")
-    video_writer = cv2.VideoWriter(os.path.join(args.out, args.name), fourcc, args.fps, (1557, 394))
+logger = logging.getLogger(__name__)
+
+
+def write_frames(frames, output_path, fps, fourcc="MJPG", log_every=100):
+    """
+    Writes an iterable of BGR uint8 frames to a video as they arrive. The frame size is taken from the first frame,
+    frames of a different size are resized to it. Returns the number of frames written.
+    """
+    video_writer = None
+    num_frames = 0
+    start = time.perf_counter()
+    try:
+        for frame in frames:
+            if video_writer is None:
+                frame_size = (frame.shape[1], frame.shape[0])
+                video_writer = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*fourcc), fps, frame_size)
+            elif (frame.shape[1], frame.shape[0]) != frame_size:
+                frame = cv2.resize(frame, frame_size)
+
+            video_writer.write(np.uint8(frame))
+            num_frames += 1
+            if log_every and num_frames % log_every == 0:
+                logger.info("{} frames, {:.1f} frames/s".format(num_frames, num_frames / (time.perf_counter() - start)))
+    finally:
+        if video_writer is not None:
+            video_writer.release()
+
+    elapsed = time.perf_counter() - start
+    logger.info("Wrote {} frames to {} in {:.1f} s ({:.1f} frames/s)".format(
+        num_frames, output_path, elapsed, num_frames / elapsed if elapsed > 0 else 0))
+    return num_frames
 
-    for image in sorted(os.listdir(args.path)):
-        img = cv2.imread(os.path.join(args.path, image))
-        h, w = img.shape[0], img.shape[1]
 
-        video_writer.write(np.uint8(img))
+def render_frames(render, tasks, num_workers=None, queue_size=None):
+    """
+    Renders frames in a process pool and yields them in the order of tasks. At most queue_size frames are rendered
+    or waiting to be written at any time, so the workers run ahead of the writer without holding the whole video in
+    memory. render must be a module level function (picklable) taking one task and returning a frame.
+    """
+    num_workers = num_workers or os.cpu_count()
+    queue_size = queue_size or 2 * num_workers
+    tasks = iter(tasks)
+
+    with multiprocessing.Pool(num_workers) as pool:
+        pending = collections.deque(pool.apply_async(render, (task,)) for task in itertools.islice(tasks, queue_size))
+        while pending:
+            frame = pending.popleft().get()
+            # Keep the queue full while the frame is being written
+            for task in itertools.islice(tasks, 1):
+                pending.append(pool.apply_async(render, (task,)))
+            yield frame
+
+
+def write_video(args):
+    images = (cv2.imread(os.path.join(args.path, image)) for image in sorted(os.listdir(args.path)))
+    write_frames(images, os.path.join(args.out, args.name), args.fps)
 
 
 def main():
+    logging.basicConfig(level=logging.INFO)
     parser = argparse.ArgumentParser(description='Make video from image frames',
                                      formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument('-p', '--path', type=str, default='../result_vgg_0093', help='Image folder')
@@ -1,6 +1,8 @@
 import numpy as np
 import argparse
+import logging
 import os
+import cv2
 import matplotlib.pyplot as plt
 import matplotlib.patches as patches
 from matplotlib.path import Path
@@ -10,38 +12,20 @@ from PIL import Image
 from utils.read_dir import ReadDir
 from config import config as cfg
 from utils.correspondece_constraint import *
+from smoke.utils.kitti_labels import read_kitti_label_file, record_to_fields
+from smoke.utils.box3d import box3d_corners, project_points
+from smoke.utils.calibration import CalibrationRegistry
+from utils.visualization_raster import birdview_corners, render_frame
+from utils.video_writer import render_frames, write_frames
 
 
 def compute_birdviewbox(line, shape, scale):
     npline = [np.float64(line[i]) for i in range(1, len(line))]
-    h = npline[7] * scale
-    w = npline[8] * scale
-    l = npline[9] * scale
-    x = npline[10] * scale
-    y = npline[11] * scale
-    z = npline[12] * scale
+    h, w, l = npline[7], npline[8], npline[9]
+    x, y, z = npline[10], npline[11], npline[12]
     rot_y = npline[13]
 
-    R = np.array([[-np.cos(rot_y), np.sin(rot_y)],
-                  [np.sin(rot_y), np.cos(rot_y)]])
-    t = np.array([x, z]).reshape(1, 2).T
-
-    x_corners = [0, l, l, 0]  # -l/2
-    z_corners = [w, w, 0, 0]  # -w/2
-
-    x_corners += -w / 2
-    z_corners += -l / 2
-
-    # bounding box in object coordinate
-    corners_2D = np.array([x_corners, z_corners])
-    # rotate
-    corners_2D = R.dot(corners_2D)
-    # translation
-    corners_2D = t - corners_2D
-    # in camera coordinate
-    corners_2D[0] += int(shape / 2)
-    corners_2D = (corners_2D).astype(np.int16)
-    corners_2D = corners_2D.T
+    corners_2D = birdview_corners(x, z, l, w, rot_y, shape, scale)[0]
 
     return np.vstack((corners_2D, corners_2D[0, :]))
 
@@ -93,38 +77,9 @@ def draw_birdeyes_nolabels(ax2, line_p, shape):
 
 def compute_3Dbox(P2, line):
     obj = detectionInfo(line)
-    # Draw 2D Bounding Box
-    xmin = int(obj.xmin)
-    xmax = int(obj.xmax)
-    ymin = int(obj.ymin)
-    ymax = int(obj.ymax)
-    # width = xmax - xmin
-    # height = ymax - ymin
-    # box_2d = patches.Rectangle((xmin, ymin), width, height, fill=False, color='red', linewidth='3')
-    # ax.add_patch(box_2d)
-
-    # Draw 3D Bounding Box
-
-    R = np.array([[np.cos(obj.rot_global), 0, np.sin(obj.rot_global)],
-                  [0, 1, 0],
-                  [-np.sin(obj.rot_global), 0, np.cos(obj.rot_global)]])
-
-    x_corners = [0, obj.l, obj.l, obj.l, obj.l, 0, 0, 0]  # -l/2
-    y_corners = [0, 0, obj.h, obj.h, 0, 0, obj.h, obj.h]  # -h
-    z_corners = [0, 0, 0, obj.w, obj.w, obj.w, obj.w, 0]  # -w/2
-
-    x_corners = [i - obj.l / 2 for i in x_corners]
-    y_corners = [i - obj.h for i in y_corners]
-    z_corners = [i - obj.w / 2 for i in z_corners]
-
-    corners_3D = np.array([x_corners, y_corners, z_corners])
-    corners_3D = R.dot(corners_3D)
-    corners_3D += np.array([obj.tx, obj.ty, obj.tz]).reshape((3, 1))
-
-    corners_3D_1 = np.vstack((corners_3D, np.ones((corners_3D.shape[-1]))))
-    corners_2D = P2.dot(corners_3D_1)
-    corners_2D = corners_2D / corners_2D[2]
-    corners_2D = corners_2D[:2]
+
+    corners_3D = box3d_corners([obj.l, obj.h, obj.w], [obj.tx, obj.ty, obj.tz], obj.rot_global)
+    corners_2D = project_points(corners_3D[0], P2).T
 
     return corners_2D
 
@@ -153,16 +108,12 @@ def draw_3Dbox(ax, P2, line, color):
 
 def visualization(args, image_path, label_path, calib_path, pred_path,
                   dataset, VEHICLES):
+    calibration = CalibrationRegistry(calib_path, dataset[start_frame:end_frame], shared=False)
     for index in range(start_frame, end_frame):
         image_file = os.path.join(image_path, dataset[index] + '.png')
         label_file = os.path.join(label_path, dataset[index] + '.txt')
         prediction_file = os.path.join(pred_path, dataset[index] + '.txt')
-        calibration_file = os.path.join(calib_path, dataset[index] + '.txt')
-        for line in open(calibration_file):
-            if 'P2' in line:
-                P2 = line.split(' ')
-                P2 = np.asarray([float(i) for i in P2[1:]])
-                P2 = np.reshape(P2, (3, 4))
+        P2 = calibration.P2(index - start_frame)
 
         fig = plt.figure(figsize=(20.00, 5.12), dpi=100)
 
@@ -178,24 +129,23 @@ def visualization(args, image_path, label_path, calib_path, pred_path,
         shape = 900
         birdimage = np.zeros((shape, shape, 3), np.uint8)
 
-        with open(label_file) as f1, open(prediction_file) as f2:
-            for line_gt, line_p in zip(f1, f2):
-                line_gt = line_gt.strip().split(' ')
-                line_p = line_p.strip().split(' ')
-
-                truncated = np.abs(float(line_p[1]))
-                occluded = np.abs(float(line_p[2]))
-                trunc_level = 1 if args.a == 'training' else 255
-
-                # truncated object in dataset is not observable
-                if line_p[0] in VEHICLES and truncated < trunc_level:
-                    color = 'green'
-                    if line_p[0] == 'Cyclist':
-                        color = 'yellow'
-                    elif line_p[0] == 'Pedestrian':
-                        color = 'cyan'
-                    draw_3Dbox(ax, P2, line_p, color)
-                    draw_birdeyes(ax2, line_gt, line_p, shape)
+        for record_gt, record_p in zip(read_kitti_label_file(label_file), read_kitti_label_file(prediction_file)):
+            line_gt = record_to_fields(record_gt)
+            line_p = record_to_fields(record_p)
+
+            truncated = np.abs(float(line_p[1]))
+            occluded = np.abs(float(line_p[2]))
+            trunc_level = 1 if args.a == 'training' else 255
+
+            # truncated object in dataset is not observable
+            if line_p[0] in VEHICLES and truncated < trunc_level:
+                color = 'green'
+                if line_p[0] == 'Cyclist':
+                    color = 'yellow'
+                elif line_p[0] == 'Pedestrian':
+                    color = 'cyan'
+                draw_3Dbox(ax, P2, line_p, color)
+                draw_birdeyes(ax2, line_gt, line_p, shape)
 
         # visualize 3D bounding box
         ax.imshow(image)
@@ -230,16 +180,12 @@ def visualization(args, image_path, label_path, calib_path, pred_path,
 
 def visualization_nolabels(args, image_path, label_path, calib_path, pred_path,
                            dataset, VEHICLES):
+    calibration = CalibrationRegistry(calib_path, dataset[start_frame:end_frame], shared=False)
     for index in range(start_frame, end_frame):
         image_file = os.path.join(image_path, dataset[index] + '.png')
         # label_file = os.path.join(label_path, dataset[index] + '.txt')
         prediction_file = os.path.join(pred_path, dataset[index] + '.txt')
-        calibration_file = os.path.join(calib_path, dataset[index] + '.txt')
-        for line in open(calibration_file):
-            if 'P2' in line:
-                P2 = line.split(' ')
-                P2 = np.asarray([float(i) for i in P2[1:]])
-                P2 = np.reshape(P2, (3, 4))
+        P2 = calibration.P2(index - start_frame)
 
         fig = plt.figure(figsize=(20.00, 5.12), dpi=100)
 
@@ -255,23 +201,22 @@ def visualization_nolabels(args, image_path, label_path, calib_path, pred_path,
         shape = 900
         birdimage = np.zeros((shape, shape, 3), np.uint8)
 
-        with open(prediction_file) as f2:
-            for line_p in zip(f2):
-                line_p = line_p[0].strip().split(' ')
+        for record_p in read_kitti_label_file(prediction_file):
+            line_p = record_to_fields(record_p)
 
-                truncated = np.abs(float(line_p[1]))
-                occluded = np.abs(float(line_p[2]))
-                trunc_level = 1 if args.a == 'training' else 255
+            truncated = np.abs(float(line_p[1]))
+            occluded = np.abs(float(line_p[2]))
+            trunc_level = 1 if args.a == 'training' else 255
 
-                # truncated object in dataset is not observable
-                if line_p[0] in VEHICLES and truncated < trunc_level:
-                    color = 'green'
-                    if line_p[0] == 'Cyclist':
-                        color = 'yellow'
-                    elif line_p[0] == 'Pedestrian':
-                        color = 'cyan'
-                    draw_3Dbox(ax, P2, line_p, color)
-                    draw_birdeyes_nolabels(ax2, line_p, shape)
+            # truncated object in dataset is not observable
+            if line_p[0] in VEHICLES and truncated < trunc_level:
+                color = 'green'
+                if line_p[0] == 'Cyclist':
+                    color = 'yellow'
+                elif line_p[0] == 'Pedestrian':
+                    color = 'cyan'
+                draw_3Dbox(ax, P2, line_p, color)
+                draw_birdeyes_nolabels(ax2, line_p, shape)
 
         # visualize 3D bounding box
         ax.imshow(image)
@@ -318,6 +263,59 @@ def visualization_nolabels(args, image_path, label_path, calib_path, pred_path,
         # video_writer.write(np.uint8(fig))
 
 
+def render_raster_frame(image_file, prediction_file, P2, label_file, vehicles, trunc_level):
+    """ One frame of visualization_raster as an RGB array, label_file is None when there are no labels. """
+    image = cv2.cvtColor(cv2.imread(image_file), cv2.COLOR_BGR2RGB)
+    labels = read_kitti_label_file(label_file) if label_file is not None else None
+
+    return render_frame(image, P2, read_kitti_label_file(prediction_file), labels=labels,
+                        vehicles=vehicles, trunc_level=trunc_level)
+
+
+def render_video_frame(task):
+    """ Process pool worker of visualization_video, returns the frame in BGR order as expected by cv2.VideoWriter. """
+    return cv2.cvtColor(render_raster_frame(*task), cv2.COLOR_RGB2BGR)
+
+
+def frame_tasks(args, image_path, label_path, calib_path, pred_path, dataset, VEHICLES):
+    trunc_level = 1 if args.a == 'training' else 255
+    # each calibration file is read once, the tasks carry the P2 matrices
+    calibration = CalibrationRegistry(calib_path, dataset[start_frame:end_frame], shared=False)
+    for index in range(start_frame, end_frame):
+        label_file = os.path.join(label_path, dataset[index] + '.txt') if args.labels else None
+        yield (os.path.join(image_path, dataset[index] + '.png'), os.path.join(pred_path, dataset[index] + '.txt'),
+               calibration.P2(index - start_frame), label_file, VEHICLES, trunc_level)
+
+
+def visualization_raster(args, image_path, label_path, calib_path, pred_path,
+                         dataset, VEHICLES):
+    """
+    Same frames as visualization (with labels) or visualization_nolabels, drawn directly into numpy arrays with
+    OpenCV instead of matplotlib figures.
+    """
+    tasks = frame_tasks(args, image_path, label_path, calib_path, pred_path, dataset, VEHICLES)
+    for index, task in zip(range(start_frame, end_frame), tasks):
+        frame = render_raster_frame(*task)
+
+        print(dataset[index])
+        if args.save == False:
+            plt.imshow(frame)
+            plt.show()
+        else:
+            cv2.imwrite(os.path.join(args.path, dataset[index] + '.png'), cv2.cvtColor(frame, cv2.COLOR_RGB2BGR))
+
+
+def visualization_video(args, image_path, label_path, calib_path, pred_path,
+                        dataset, VEHICLES):
+    """
+    Renders the frames of visualization_raster in a process pool and streams them, in order, straight into a video
+    file without saving them as images. The frame size is taken from the first frame.
+    """
+    tasks = frame_tasks(args, image_path, label_path, calib_path, pred_path, dataset, VEHICLES)
+    frames = render_frames(render_video_frame, tasks, num_workers=args.workers, queue_size=args.queue_size)
+    write_frames(frames, os.path.join(args.path, args.video), args.fps)
+
+
 def main(args):
     base_dir = '/home/spyros/Spyros/temp_repos/SMOKE/datasets/kitti'
     dir = ReadDir(base_dir=base_dir, subset=args.a, labels=args.labels)
@@ -331,7 +329,13 @@ def main(args):
     VEHICLES = cfg().KITTI_cat
 
     # If labels are available, do standard visualisation, otherwise run the case of no labels
-    if args.labels:
+    if args.video:
+        visualization_video(args, image_path, label_path, calib_path, pred_path,
+                            dataset, VEHICLES)
+    elif args.renderer == 'opencv':
+        visualization_raster(args, image_path, label_path, calib_path, pred_path,
+                             dataset, VEHICLES)
+    elif args.labels:
         visualization(args, image_path, label_path, calib_path, pred_path,
                       dataset, VEHICLES)
     else:
@@ -351,8 +355,26 @@ if __name__ == '__main__':
                         help='Output Image folder')
     parser.add_argument('--labels', type=str.lower, choices=['true', 'false', '1', '0'], default='true',
                         help='Enable labels (0, 1, true, false)')
+    parser.add_argument('--renderer', type=str, choices=['matplotlib', 'opencv'], default=None,
+                        help='Draw the frames with matplotlib figures or directly into arrays with OpenCV (faster), '
+                             'matplotlib by default and opencv with --video')
+    parser.add_argument('--video', type=str, default=None,
+                        help='Write the frames to this video file in the output folder instead of images '
+                             '(rendered in parallel with OpenCV)')
+    parser.add_argument('--fps', type=int, default=15, help='Video fps')
+    parser.add_argument('--workers', type=int, default=None, help='Rendering processes for --video, all cores if unset')
+    parser.add_argument('--queue-size', type=int, default=None,
+                        help='Maximum number of frames rendered ahead of the video writer, twice the workers if unset')
     args = parser.parse_args()
 
+    # the video frames are only rendered with OpenCV
+    if args.video and args.renderer == 'matplotlib':
+        parser.error('--video renders the frames with OpenCV, use --renderer opencv or leave --renderer unset')
+    if args.renderer is None:
+        args.renderer = 'opencv' if args.video else 'matplotlib'
+
+    logging.basicConfig(level=logging.INFO)
+
     # eset labels to true or false
     labels_enabled = args.labels in ['true', '1']
     args.labels = labels_enabled
@@ -0,0 +1,178 @@
+import cv2
+import numpy as np
+
+from smoke.utils.box3d import bev_corners, box3d_corners, project_points
+from smoke.utils.kitti_labels import OBJECT_TYPES
+
+# RGB values of the matplotlib colours used by visualization3Dbox
+COLORS = {
+    'green': (0, 128, 0),
+    'yellow': (255, 255, 0),
+    'cyan': (0, 255, 255),
+    'orange': (255, 165, 0),
+    'grey': (128, 128, 128),
+    'red': (255, 0, 0),
+    'white': (255, 255, 255),
+}
+CLASS_COLORS = {'Car': 'green', 'Cyclist': 'yellow', 'Pedestrian': 'cyan'}
+
+# Order in which the 8 projected corners are joined, as in draw_3Dbox
+BB3D_LINES_VERTS_IDX = [0, 1, 2, 3, 4, 5, 6, 7, 0, 5, 4, 1, 2, 7, 6, 3]
+
+
+def compute_3Dboxes(P2, records):
+    """
+    Vectorised compute_3Dbox of visualization3Dbox, for all records (structured array of
+    smoke.utils.kitti_labels.LABEL_DTYPE) at once. Returns the projected corners, shape (N, 2, 8).
+    """
+    corners_3D = box3d_corners(np.column_stack((records['length'], records['height'], records['width'])),
+                               np.column_stack((records['x'], records['y'], records['z'])), records['rotation_y'])
+
+    return project_points(corners_3D, P2).transpose(0, 2, 1)
+
+
+def birdview_corners(x, z, length, width, rotation_y, shape, scale):
+    """
+    BEV footprints in pixels of a shape x shape image, following compute_birdviewbox of visualization3Dbox, which
+    places the box offset by (length - width) / 2 along both of its axes. Returns (N, 4, 2) int16 corners.
+    """
+    x, z, length, width, rotation_y = (np.asarray(values, dtype=np.float64).reshape(-1) * factor for values, factor in
+                                       ((x, scale), (z, scale), (length, scale), (width, scale), (rotation_y, 1)))
+
+    offset = (length - width) / 2
+    cos, sin = np.cos(rotation_y), np.sin(rotation_y)
+    corners_2D = bev_corners(x + (cos + sin) * offset, z + (cos - sin) * offset, length, width, rotation_y)
+    corners_2D[:, :, 0] += int(shape / 2)
+
+    return corners_2D.astype(np.int16)
+
+
+def compute_birdviewboxes(records, shape, scale):
+    """
+    Vectorised compute_birdviewbox of visualization3Dbox. Returns the closed BEV polygons in pixels of a
+    shape x shape image with the origin at the bottom, shape (N, 5, 2).
+    """
+    corners_2D = birdview_corners(records['x'], records['z'], records['length'], records['width'],
+                                  records['rotation_y'], shape, scale)
+
+    return np.concatenate((corners_2D, corners_2D[:, :1]), axis=1)
+
+
+def draw_3Dboxes(image, P2, records, colors, line_width=2, front_alpha=0.4):
+    """
+    Draws the projected 3D boxes on an RGB uint8 image, in place: the box edges with cv2.polylines and a translucent
+    rectangle on the front face, as draw_3Dbox does with matplotlib patches.
+    """
+    if not len(records):
+        return image
+
+    corners_2D = compute_3Dboxes(P2, records)
+    overlay = image.copy()
+    for corners, color in zip(corners_2D, colors):
+        # Rectangle spanned by corner 1 and the width and height used by draw_3Dbox
+        x1, y1 = corners[:, 1]
+        x2, y2 = corners[0, 3], corners[1, 2]
+        cv2.rectangle(overlay, (int(round(x1)), int(round(y1))), (int(round(x2)), int(round(y2))), COLORS[color], -1)
+
+    cv2.addWeighted(overlay, front_alpha, image, 1 - front_alpha, 0, dst=image)
+    for corners, color in zip(corners_2D, colors):
+        verts = np.round(corners[:, BB3D_LINES_VERTS_IDX].T).astype(np.int32)
+        cv2.polylines(image, [verts], isClosed=False, color=COLORS[color], thickness=line_width,
+                      lineType=cv2.LINE_AA)
+
+    return image
+
+
+def draw_birdeyes(birdimage, records, colors, scale=15, line_width=2):
+    """ Draws the BEV boxes on a square birdimage (origin at the bottom row), in place. """
+    if not len(records):
+        return birdimage
+
+    polygons = compute_birdviewboxes(records, birdimage.shape[0], scale).astype(np.int32)
+    # Image rows grow downwards, the BEV origin is at the bottom
+    polygons[:, :, 1] = birdimage.shape[0] - 1 - polygons[:, :, 1]
+    for polygon, color in zip(polygons, colors):
+        cv2.polylines(birdimage, [polygon], isClosed=True, color=COLORS[color], thickness=line_width,
+                      lineType=cv2.LINE_AA)
+
+    return birdimage
+
+
+def draw_camera_range(birdimage, dash=12):
+    """ Dashed lines of the camera view range and the camera position, as in the matplotlib figures. """
+    shape = birdimage.shape[0]
+    centre = shape // 2
+    for start, end in (((0, centre), (centre, 0)), ((centre, 0), (shape, centre))):
+        points = np.linspace(start, end, num=max(2, int(np.hypot(*np.subtract(end, start)) / dash)))
+        for (xa, ya), (xb, yb) in zip(points[0::2], points[1::2]):
+            cv2.line(birdimage, (int(xa), shape - 1 - int(ya)), (int(xb), shape - 1 - int(yb)), COLORS['grey'], 1,
+                     cv2.LINE_AA)
+    cv2.drawMarker(birdimage, (centre, shape - 1), COLORS['red'], cv2.MARKER_CROSS, markerSize=40, thickness=3)
+
+    return birdimage
+
+
+def draw_legend(birdimage, entries):
+    """ Legend in the lower right corner, one (label, colour) entry per line. """
+    font, font_scale, thickness = cv2.FONT_HERSHEY_SIMPLEX, 1.0, 2
+    height = birdimage.shape[0]
+    for row, (label, color) in enumerate(reversed(entries)):
+        (text_width, text_height), _ = cv2.getTextSize(label, font, font_scale, thickness)
+        y = height - 20 - row * (text_height + 20)
+        x = birdimage.shape[1] - text_width - 20
+        cv2.line(birdimage, (x - 70, y - text_height // 2), (x - 20, y - text_height // 2), COLORS[color], 3)
+        cv2.putText(birdimage, label, (x, y), font, font_scale, COLORS['white'], thickness, cv2.LINE_AA)
+
+    return birdimage
+
+
+def render_frame(image, P2, predictions, labels=None, vehicles=('Car', 'Cyclist', 'Pedestrian'), trunc_level=255,
+                 shape=900, scale=15):
+    """
+    Rasterised equivalent of one frame of visualization / visualization_nolabels. The predicted 3D boxes are drawn on
+    the camera image and the BEV boxes on a shape x shape image, which is resized to the height of the camera image
+    and placed on its right.
+
+    Parameters
+    ----------
+    image: RGB uint8 image
+    P2: Projection matrix, (3, 4)
+    predictions: Records of the prediction file (smoke.utils.kitti_labels.LABEL_DTYPE)
+    labels: Records of the label file. If given, the BEV shows the ground truth (orange) and the predictions (green)
+            paired line by line as in visualization, otherwise the predictions coloured by class
+    vehicles: The object types that are drawn
+    trunc_level: Objects with a truncation above this level are not drawn
+
+    Returns
+    -------
+    The RGB uint8 frame
+    """
+    if labels is not None:
+        num_pairs = min(len(labels), len(predictions))
+        labels, predictions = labels[:num_pairs], predictions[:num_pairs]
+
+    types = np.array(OBJECT_TYPES)[predictions['object_type']]
+    keep = np.isin(types, list(vehicles)) & (np.abs(predictions['truncation']) < trunc_level)
+    predictions, types = predictions[keep], types[keep]
+    colors = [CLASS_COLORS.get(object_type, 'green') for object_type in types]
+
+    image = np.ascontiguousarray(image, dtype=np.uint8).copy()
+    draw_3Dboxes(image, P2, predictions, colors)
+
+    birdimage = np.zeros((shape, shape, 3), np.uint8)
+    draw_camera_range(birdimage)
+    if labels is not None:
+        labels = labels[keep]
+        draw_birdeyes(birdimage, labels, ['orange'] * len(labels), scale=scale)
+        draw_birdeyes(birdimage, predictions, ['green'] * len(predictions), scale=scale)
+        legend = [('ground truth', 'orange'), ('prediction', 'green')] if len(predictions) else []
+    else:
+        draw_birdeyes(birdimage, predictions, colors, scale=scale)
+        legend = [(object_type, CLASS_COLORS.get(object_type, 'green'))
+                  for object_type in dict.fromkeys(types.tolist())][:3]
+    draw_legend(birdimage, legend)
+
+    height = image.shape[0]
+    birdimage = cv2.resize(birdimage, (height, height), interpolation=cv2.INTER_AREA)
+
+    return np.hstack((image, birdimage))